@@ -1,25 +1,79 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import feedparser
+from lxml import etree
 import os
 import requests
 from bs4 import BeautifulSoup
 import json
+import re
+import hashlib
+import heapq
+import calendar
+import email.utils
+from xml.sax.saxutils import escape as xml_escape
+import random
 import websockets
 import asyncio
 from functools import wraps
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+import atexit
+import queue
+import itertools
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from urllib.parse import urlparse
 import logging
 
+# Start of the application, for the startup time in the log
+STARTUP_STARTED = time.perf_counter()
+
 # Global cache for users
 # Structure: {'username': {'user_data': {...}, 'timestamp': time.time()}}
 USER_CACHE = {}
 # Cache validity duration in seconds (1 hour)
 CACHE_EXPIRY = 3600  # 1 hour
 
+# Function for reading add-on options (see config.yaml)
+def load_addon_options():
+    try:
+        with open('/data/options.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+ADDON_OPTIONS = load_addon_options()
+
+# Database settings
+DB_PATH = os.environ.get('MY_PODCASTS_DB') or ADDON_OPTIONS.get('db_file') or '/data/mypodcasts.db'
+DB_POOL_SIZE = 8  # idle connections kept open
+DB_CACHE_KB = 8192  # page cache per connection
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_CACHED_STATEMENTS = 256  # prepared statements cached per connection
+# Log statements whose query plan scans or sorts a large table (for development)
+QUERY_PLAN_CHECK = bool(ADDON_OPTIONS.get('query_plan_check', False))
+
+# Settings for downloading RSS feeds
+FEED_REQUEST_TIMEOUT = 30  # seconds
+FEED_USER_AGENT = "MyPodcasts/1.1 (+https://github.com/smartgeeky/my-podcasts-homeassistant)"
+# Number of feeds refreshed in parallel and maximum parallel downloads per host
+REFRESH_WORKERS = max(1, int(ADDON_OPTIONS.get('refresh_workers', 4)))
+REFRESH_PER_HOST = max(1, int(ADDON_OPTIONS.get('refresh_per_host', 2)))
+# Largest feed body that will be downloaded
+FEED_MAX_BYTES = max(1, int(ADDON_OPTIONS.get('feed_max_mb', 20))) * 1024 * 1024
+# Block size in which feed bodies are read and fed to the streaming parser
+FEED_BLOCK_SIZE = 64 * 1024
+# Streaming refresh stops after this many consecutive already known episodes
+FEED_KNOWN_STOP_COUNT = max(1, int(ADDON_OPTIONS.get('feed_known_stop_count', 3)))
+
+# Limits for the per-podcast refresh interval learned from publishing cadence
+MIN_REFRESH_INTERVAL = 15 * 60  # 15 minutes
+DEFAULT_REFRESH_INTERVAL = 6 * 3600  # 6 hours, used until a podcast has enough episodes
+FAILED_REFRESH_RETRY = 3600  # 1 hour
+# Feeds refreshed at most once a day are spread over this window after cas_posodobitve
+DAILY_UPDATE_WINDOW = 3 * 3600  # 3 hours
+
 app = Flask(__name__, static_folder="/app/static")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)  # Added logger definition
@@ -31,31 +85,1376 @@ update_thread_stop_event = threading.Event()
 # Global variables for tracking playback sessions
 tracking_thread = None
 tracking_thread_stop_event = threading.Event()
+# 'events' follows state changes of tracked players, 'polling' reads their state every second
+TRACKING_MODE = ADDON_OPTIONS.get('tracking_mode') or 'events'
+# Player events are handled one at a time, in the order they arrive
+TRACKING_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tracking')
+tracking_subscription = None  # subscription key from HA_WEBSOCKET.subscribe
+tracking_players = []  # players covered by tracking_subscription
+# Seconds between polls of tracked players, in polling mode or while events are not available
+TRACKING_POLL_PLAYING = 5
+TRACKING_POLL_PAUSED = 30
+TRACKING_POLL_NEAR_END = 1  # during the last TRACKING_NEAR_END seconds of an episode
+TRACKING_NEAR_END = 60
+TRACKING_EVENTS_CHECK = 10  # seconds between checks that events mode still gets events
+tracking_event_loop = None  # event loop of the tracking thread
+tracking_wakeup = None  # asyncio.Event on tracking_event_loop, set by wake_tracking()
+# Live tracking sessions; ActiveTrackingSessions holds their checkpoint (see checkpoint_tracking_sessions)
+# Structure: {session_id: session}
+TRACKING_SESSIONS = {}
+tracking_sessions_lock = threading.Lock()
+changed_tracking_sessions = set()  # ids of sessions changed since the last checkpoint
+
+# Priority queue of scheduled podcast refreshes
+# Structure: [(due_timestamp, priority, podcast_id)]; REFRESH_DUE holds the current entry
+# of each podcast, older heap entries are skipped when popped
+REFRESH_QUEUE = []
+REFRESH_DUE = {}
+refresh_queue_condition = threading.Condition()
+REFRESH_PRIORITY_NOW = 0
+REFRESH_PRIORITY_SCHEDULED = 1
+
+# Episodes stored per bulk write by the import jobs, so an import does not hold up other writes
+IMPORT_CHUNK_SIZE = 100
+
+# Maintenance job (see run_maintenance_job) runs every MAINTENANCE_INTERVAL seconds; 0 turns it off
+MAINTENANCE_INTERVAL = max(0, int(ADDON_OPTIONS.get('maintenance_hours', 24))) * 3600
+MAINTENANCE_CHUNK_SIZE = 500  # episodes removed or purged per queued write
+VACUUM_CHUNK_PAGES = 1024  # free pages returned to the file system per queued write
+DELETE_CHUNK_SIZE = 500  # episodes of a deleted feed removed per queued write
+JOBS_KEEP_DAYS = 30  # finished jobs are kept this long for GET /api/jobs/<id>
+maintenance_thread = None
+
+# Worker pool for background jobs (see submit_job)
+JOB_WORKERS = max(1, int(ADDON_OPTIONS.get('job_workers', 2)))
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+jobs_lock = threading.Lock()
+# Event streams of jobs hold a gunicorn thread each, so they are limited in number and length:
+# at most half of the threads, shared fairly between users; other clients poll GET /api/jobs/<id>
+GUNICORN_THREADS = max(1, int(os.environ.get('GUNICORN_THREADS', 8)))
+JOB_EVENTS_MAX_STREAMS = max(1, GUNICORN_THREADS // 2)
+JOB_EVENTS_MAX_STREAMS_PER_USER = max(1, JOB_EVENTS_MAX_STREAMS // 2)
+JOB_EVENTS_TIMEOUT = 30  # seconds
+# Structure: {username: number of open streams}
+JOB_EVENT_STREAMS = {}
+job_event_streams_lock = threading.Lock()
+
+# Playback positions waiting to be written by flush_playback_positions()
+# Structure: {(episode_id, user_id): (position, timestamp)}
+PENDING_POSITIONS = {}
+pending_positions_lock = threading.Lock()
+position_flush_lock = threading.Lock()
+# Seconds between writes of pending positions, which is also the most a crash can lose;
+# 0 writes every position at once
+POSITION_FLUSH_INTERVAL = max(0, int(ADDON_OPTIONS.get('position_flush_seconds', 5)))
+position_flush_thread = None
+
+# Home Assistant WebSocket API, used through HA_WEBSOCKET (see HomeAssistantWebSocket)
+HA_WEBSOCKET_URL = "ws://supervisor/core/websocket"
+HA_WEBSOCKET_TIMEOUT = 10  # seconds to wait for a connection and for the result of a command
+HA_RECONNECT_DELAYS = (1, 2, 5, 10, 30)  # seconds between reconnect attempts, the last one repeats
+# Pooled connections to the Home Assistant REST API
+HA_SESSION = requests.Session()
+
+# Media players of Home Assistant, kept fresh from state change and entity registry events
+# Structure: {entity_id: player}, None until loaded by get_media_player_catalogue()
+MEDIA_PLAYERS = None
+media_players_lock = threading.Lock()
+media_players_load_lock = threading.Lock()
+media_players_loaded_at = 0  # time.monotonic() of the last load, 0 when a player was added or removed
+media_players_subscription = None  # states of media_players_followed, with attribute changes
+media_players_followed = []
+media_players_registry_subscription = None
+# Seconds before the catalogue is loaded again, for changes the events miss (e.g. while reconnecting)
+MEDIA_PLAYERS_TTL = 600
+MEDIA_PLAYERS_TTL_WITHOUT_EVENTS = 30
+
+# Per-hostname semaphores limiting parallel feed downloads
+# Structure: {'hostname': threading.BoundedSemaphore}
+HOST_SEMAPHORES = {}
+host_semaphores_lock = threading.Lock()
+
+# Pool of idle database connections
+DB_POOL = []
+db_pool_lock = threading.Lock()
+
+# All database writes run on a single writer thread (see submit_write)
+# Structure of queue items: (priority, sequence, (function, args, Future)); None instead of the write stops the writer
+DB_WRITE_QUEUE = queue.PriorityQueue()
+DB_WRITE_BATCH = 64  # most queued interactive writes grouped into one transaction
+# Interactive writes go before bulk writes of jobs (imports, feed refreshes, maintenance), and a
+# bulk write is committed in its own transaction, so a small write waits for at most one of them
+WRITE_PRIORITY_INTERACTIVE = 0
+WRITE_PRIORITY_BULK = 1
+WRITE_PRIORITY_STOP = 2
+db_write_sequence = itertools.count()  # keeps writes of the same priority in order
+db_writer_thread = None
+db_writer_conn = None
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection that is returned to the pool instead of being closed: by close()
+    or at the end of a `with get_db_connection() as conn:` block. An unfinished
+    transaction is rolled back when the connection is returned.
+    """
+    owner = None  # thread that checked the connection out
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            release_db_connection(self)
+
+    def close(self):
+        release_db_connection(self)
+
+class QueryPlanCheckConnection(PooledConnection):
+    """Pooled connection used with the query_plan_check option, see check_query_plan"""
+
+    def execute(self, sql, parameters=()):
+        check_query_plan(self, sql, parameters)
+        return super().execute(sql, parameters)
+
+# Function for opening a new database connection with the tuned pragmas
+def open_db_connection():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False,
+                           factory=QueryPlanCheckConnection if QUERY_PLAN_CHECK else PooledConnection,
+                           cached_statements=DB_CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers run while a feed is being written; NORMAL is durable enough with WAL
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    return conn
 
 # Function for database connection
 def get_db_connection():
-    conn = sqlite3.connect('/data/mypodcasts.db', isolation_level=None, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    with db_pool_lock:
+        conn = DB_POOL.pop() if DB_POOL else None
+    if conn is None:
+        conn = open_db_connection()
+    elif conn.in_transaction:
+        conn.rollback()
+    conn.owner = threading.get_ident()
     return conn
 
+# Function for returning a connection to the pool
+def release_db_connection(conn):
+    # Closing twice, or after the connection was handed to another thread, does nothing
+    if conn.owner != threading.get_ident():
+        return
+    conn.owner = None
+    if conn.in_transaction:
+        conn.rollback()
+    with db_pool_lock:
+        if len(DB_POOL) < DB_POOL_SIZE:
+            DB_POOL.append(conn)
+            return
+    sqlite3.Connection.close(conn)
+
+# Tables that grow with the number of episodes, users and jobs; reading one of them
+# in full or sorting its rows in a temp B-tree on a request is reported by check_query_plan
+QUERY_PLAN_LARGE_TABLES = {'Episodes', 'EpisodeListenStatus', 'EpisodePlaybackPosition', 'Jobs'}
+CHECKED_QUERY_PLANS = set()
+TABLE_ALIAS_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|SET|LEFT|JOIN|GROUP|ORDER|LIMIT|VALUES)\b)(\w+))?',
+    re.IGNORECASE)
+
+# Function for checking the query plan of a statement the first time it runs
+def check_query_plan(conn, sql, parameters):
+    if sql in CHECKED_QUERY_PLANS:
+        return
+    CHECKED_QUERY_PLANS.add(sql)
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+        return
+
+    # Plan details name tables by their alias
+    tables = {}
+    for table, alias in TABLE_ALIAS_PATTERN.findall(sql):
+        tables[table] = table
+        if alias:
+            tables[alias] = table
+    try:
+        plan = [row[3] for row in sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters)]
+    except sqlite3.Error as e:
+        logger.debug(f"Query plan not available: {e}")
+        return
+
+    # A scan in index order (SCAN x USING INDEX) is fine, it reads the rows already sorted.
+    # A temp B-tree is reported only when it can hold many rows of a large table, that is
+    # when such a table is read by anything other than a lookup of a single row.
+    problems = []
+    sorts_large_table = False
+    for detail in plan:
+        match = re.match(r'(SCAN|SEARCH) (\w+)', detail)
+        table = tables.get(match.group(2)) if match else None
+        if table not in QUERY_PLAN_LARGE_TABLES:
+            continue
+        if (match.group(1) == 'SCAN' and ' USING ' not in detail) or 'AUTOMATIC' in detail:
+            problems.append(detail)
+        if not is_single_row_lookup(conn, table, detail):
+            sorts_large_table = True
+    if sorts_large_table:
+        problems.extend(detail for detail in plan
+                        if re.search(r'TEMP B-TREE FOR (.*ORDER BY|GROUP BY|DISTINCT)$', detail))
+    if problems:
+        logger.warning(f"Query plan uses {'; '.join(problems)}: {' '.join(sql.split())}")
+
+# Function for checking if a query plan step reads one row by its primary key or a unique index
+def is_single_row_lookup(conn, table, detail):
+    if '(rowid=?)' in detail:
+        return True
+    # Primary key of a WITHOUT ROWID table
+    match = re.search(r'USING PRIMARY KEY \((.*)\)', detail)
+    if match:
+        columns = [row for row in sqlite3.Connection.execute(conn, f"PRAGMA table_info({table})") if row[5]]
+        return match.group(1).count('=?') == len(columns)
+    match = re.search(r'USING (?:COVERING )?INDEX (\w+) \((.*)\)', detail)
+    if not match:
+        return False
+    index, terms = match.groups()
+    unique = any(row[1] == index and row[2] for row in sqlite3.Connection.execute(conn, f"PRAGMA index_list({table})"))
+    columns = sqlite3.Connection.execute(conn, f"PRAGMA index_info({index})").fetchall()
+    return unique and terms.count('=?') == len(columns)
+
+# Function for closing pooled connections at exit
+@atexit.register
+def close_db_connections():
+    with db_pool_lock:
+        while DB_POOL:
+            sqlite3.Connection.close(DB_POOL.pop())
+
+# Function for applying queued writes in a single transaction
+def apply_writes(conn, batch):
+    """
+    Every write runs in its own savepoint, so a write that raises is rolled back alone.
+    Futures get their results only after the transaction is committed.
+    """
+    results = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for func, args, future in batch:
+            conn.execute("SAVEPOINT queued_write")
+            try:
+                results.append((future, func(conn, *args), None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO queued_write")
+                results.append((future, None, e))
+            conn.execute("RELEASE queued_write")
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error committing {len(batch)} queued writes: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        results = [(future, None, e) for _, _, future in batch]
+
+    for future, result, error in results:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+# Function for running a database write on the writer thread
+def submit_write(func, *args):
+    """
+    Queues func(conn, *args) and returns a Future with its result. func may read and
+    write through conn, but must not begin or commit transactions - queued writes are
+    grouped into transactions by the writer thread. Reads on pooled connections are
+    not blocked by the writer (WAL).
+    """
+    return queue_write(WRITE_PRIORITY_INTERACTIVE, func, args)
+
+# Function for running a write of a job that stores many rows on the writer thread
+def submit_bulk_write(func, *args):
+    """Like submit_write, but the write waits for queued interactive writes and is committed alone"""
+    return queue_write(WRITE_PRIORITY_BULK, func, args)
+
+def queue_write(priority, func, args):
+    future = Future()
+    if threading.current_thread() is db_writer_thread:
+        # Write made from inside another queued write - it becomes part of that write
+        try:
+            future.set_result(func(db_writer_conn, *args))
+        except Exception as e:
+            future.set_exception(e)
+    elif db_writer_thread is None or not db_writer_thread.is_alive():
+        # Before the writer is started and after it is stopped the caller writes itself
+        with get_db_connection() as conn:
+            apply_writes(conn, [(func, args, future)])
+    else:
+        DB_WRITE_QUEUE.put((priority, next(db_write_sequence), (func, args, future)))
+    return future
+
+# Function for running a database write on the writer thread and waiting for its result
+def run_write(func, *args):
+    return submit_write(func, *args).result()
+
+def run_bulk_write(func, *args):
+    return submit_bulk_write(func, *args).result()
+
+# Function for running a single write statement on the writer thread
+def execute_write(sql, parameters=()):
+    """Returns the cursor of the statement, for rowcount and lastrowid"""
+    return run_write(lambda conn: conn.execute(sql, parameters))
+
+def db_writer_loop():
+    """
+    Takes writes from DB_WRITE_QUEUE and applies up to DB_WRITE_BATCH interactive writes
+    or one bulk write per transaction
+    """
+    global db_writer_conn
+    db_writer_conn = open_db_connection()
+    while True:
+        priority, _, write = DB_WRITE_QUEUE.get()
+        if write is None:
+            break
+        batch = [write]
+        while priority == WRITE_PRIORITY_INTERACTIVE and len(batch) < DB_WRITE_BATCH:
+            try:
+                item = DB_WRITE_QUEUE.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != WRITE_PRIORITY_INTERACTIVE:
+                DB_WRITE_QUEUE.put(item)  # its sequence keeps its place
+                break
+            batch.append(item[2])
+        apply_writes(db_writer_conn, batch)
+    sqlite3.Connection.close(db_writer_conn)
+
+def start_db_writer():
+    global db_writer_thread
+    if db_writer_thread and db_writer_thread.is_alive():
+        return
+    db_writer_thread = threading.Thread(target=db_writer_loop, daemon=True, name='db-writer')
+    db_writer_thread.start()
+    logger.info("Database writer started.")
+
+# Function for stopping the writer at exit, after the writes queued before it
+@atexit.register
+def stop_db_writer():
+    if not db_writer_thread or not db_writer_thread.is_alive():
+        return
+    DB_WRITE_QUEUE.put((WRITE_PRIORITY_STOP, next(db_write_sequence), None))
+    db_writer_thread.join(timeout=30)
+    # Writes queued while the writer was stopping
+    while not DB_WRITE_QUEUE.empty():
+        _, _, write = DB_WRITE_QUEUE.get_nowait()
+        if write is not None:
+            with get_db_connection() as conn:
+                apply_writes(conn, [write])
+
+# Schema of a new database; existing databases are brought to the same schema
+# by the steps in MIGRATIONS. PRAGMA user_version holds the applied version.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS Feeds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    feed_key TEXT NOT NULL UNIQUE,
+    rss_url TEXT NOT NULL,
+    image_url TEXT,
+    description TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    feed_ttl INTEGER,
+    refresh_interval INTEGER,
+    next_refresh_at INTEGER,
+    episode_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS Podcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    naslov TEXT NOT NULL,
+    rss_url TEXT NOT NULL,
+    datum_naročnine TEXT NOT NULL,
+    user_id INTEGER,
+    is_public INTEGER DEFAULT 0,
+    feed_id INTEGER NOT NULL,
+    keep_episodes INTEGER,  -- retention: newest episodes kept, NULL keeps all
+    keep_days INTEGER,  -- retention: episodes of the last days kept, NULL keeps all
+    deleted_count INTEGER NOT NULL DEFAULT 0,  -- rows of the subscription in DeletedEpisodes
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id)
+);
+
+CREATE TABLE IF NOT EXISTS Episodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    feed_id INTEGER NOT NULL,
+    naslov TEXT NOT NULL,
+    datum_izdaje TEXT NOT NULL,
+    url TEXT NOT NULL,
+    izbrisano INTEGER NOT NULL DEFAULT 0,
+    opis TEXT,
+    guid TEXT,
+    opis_hash TEXT,
+    pub_epoch INTEGER,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id) ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_episodes_feed_guid ON Episodes (feed_id, guid);
+CREATE INDEX IF NOT EXISTS idx_episodes_feed_pub ON Episodes (feed_id, pub_epoch);
+
+-- Episodes deleted from a subscription; the shared episode stays for the other subscriptions
+CREATE TABLE IF NOT EXISTS DeletedEpisodes (
+    podcast_id INTEGER NOT NULL,
+    episode_id INTEGER NOT NULL,
+    PRIMARY KEY (podcast_id, episode_id),
+    FOREIGN KEY (podcast_id) REFERENCES Podcasts (id) ON DELETE CASCADE,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_deleted_episodes_episode ON DeletedEpisodes (episode_id);
+
+-- Newest episode of each feed that is not deleted, kept by refresh_latest_episodes()
+CREATE TABLE IF NOT EXISTS LatestEpisodes (
+    feed_id INTEGER PRIMARY KEY,
+    episode_id INTEGER NOT NULL,
+    pub_epoch INTEGER,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id) ON DELETE CASCADE,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_latest_episodes_pub ON LatestEpisodes (pub_epoch);
+
+-- Listened episodes of each feed per user; unread = Feeds.episode_count - listened
+CREATE TABLE IF NOT EXISTS ListenedCounts (
+    user_id INTEGER NOT NULL,
+    feed_id INTEGER NOT NULL,
+    listened INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, feed_id),
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Listened episodes among those deleted from a subscription, per user; see UNREAD_COUNT
+CREATE TABLE IF NOT EXISTS DeletedListenedCounts (
+    user_id INTEGER NOT NULL,
+    podcast_id INTEGER NOT NULL,
+    listened INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, podcast_id),
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    FOREIGN KEY (podcast_id) REFERENCES Podcasts (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS Settings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    avtomatsko INTEGER NOT NULL DEFAULT 1,
+    interval INTEGER NOT NULL DEFAULT 24,
+    cas_posodobitve TEXT DEFAULT '03:00',
+    zadnja_posodobitev TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS SelectedPlayers (
+    entity_id TEXT PRIMARY KEY,
+    display_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS Users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    display_name TEXT NOT NULL,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    is_tab_user INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS EpisodeListenStatus (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    episode_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    poslušano INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(episode_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS PodcastVisibilityPreferences (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    podcast_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    hidden INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (podcast_id) REFERENCES Podcasts (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(podcast_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS EpisodePlaybackPosition (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    episode_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(episode_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS ActiveTrackingSessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    episode_id INTEGER NOT NULL,
+    player_entity_id TEXT NOT NULL,
+    episode_url TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_position INTEGER DEFAULT -1,
+    same_position_count INTEGER DEFAULT 0,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(episode_id, user_id, player_entity_id)
+);
+
+CREATE TABLE IF NOT EXISTS Jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    params TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    feeds_total INTEGER DEFAULT 0,
+    feeds_done INTEGER DEFAULT 0,
+    episodes_added INTEGER DEFAULT 0,
+    items_total INTEGER DEFAULT 0,  -- progress of jobs that do not work on feeds
+    items_done INTEGER DEFAULT 0,
+    errors TEXT,
+    result TEXT,
+    user_id INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_dedupe_status ON Jobs (dedupe_key, status);
+
+-- Indexes for frequent queries
+CREATE INDEX IF NOT EXISTS idx_episodes_url ON Episodes (url);
+CREATE INDEX IF NOT EXISTS idx_podcasts_feed ON Podcasts (feed_id);
+CREATE INDEX IF NOT EXISTS idx_podcasts_user ON Podcasts (user_id);
+CREATE INDEX IF NOT EXISTS idx_visibility_user ON PodcastVisibilityPreferences (user_id, hidden);
+CREATE INDEX IF NOT EXISTS idx_listen_status_user ON EpisodeListenStatus (user_id);
+CREATE INDEX IF NOT EXISTS idx_playback_paused ON EpisodePlaybackPosition (timestamp) WHERE position > 0;
+CREATE INDEX IF NOT EXISTS idx_playback_user_paused ON EpisodePlaybackPosition (user_id, timestamp) WHERE position > 0;
+CREATE INDEX IF NOT EXISTS idx_tracking_user ON ActiveTrackingSessions (user_id);
+
+-- Insert default settings if they don't exist yet
+INSERT OR IGNORE INTO Settings (id, avtomatsko, interval, cas_posodobitve, zadnja_posodobitev)
+VALUES (1, 1, 24, '03:00', datetime('now'));
+"""
+
+# Function for checking if a table exists
+def table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+# Function for checking if a table has a column
+def column_exists(conn, table, column):
+    return conn.execute(
+        "SELECT 1 FROM pragma_table_info(?) WHERE name = ?", (table, column)
+    ).fetchone() is not None
+
+# Function for running an SQL script inside the current transaction
+def execute_sql_script(conn, script):
+    """Runs the statements one by one; executescript() would commit the open transaction"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+    if statement.strip():
+        conn.execute(statement)
+
+# Migration 1: structure updates from before versioned migrations, when run.sh altered the schema
+def migrate_legacy_schema(conn):
+    """The database can be at any older layout, so every change is checked first"""
+    if not column_exists(conn, 'Episodes', 'opis'):
+        logger.info("Adding column 'opis' to Episodes table...")
+        conn.execute("ALTER TABLE Episodes ADD COLUMN opis TEXT DEFAULT NULL")
+
+    if table_exists(conn, 'Settings') and not (column_exists(conn, 'Settings', 'cas_posodobitve')
+                                               and column_exists(conn, 'Settings', 'zadnja_posodobitev')):
+        logger.info("Updating Settings table with new columns...")
+        execute_sql_script(conn, """
+CREATE TABLE Settings_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    avtomatsko INTEGER NOT NULL DEFAULT 1,
+    interval INTEGER NOT NULL DEFAULT 24,
+    cas_posodobitve TEXT DEFAULT '03:00',
+    zadnja_posodobitev TEXT DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO Settings_new(id, avtomatsko, interval)
+SELECT id, avtomatsko, interval FROM Settings;
+DROP TABLE Settings;
+ALTER TABLE Settings_new RENAME TO Settings;
+""")
+
+    # Tables added over time, in the layout they had before the Feeds table
+    execute_sql_script(conn, """
+CREATE TABLE IF NOT EXISTS Settings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    avtomatsko INTEGER NOT NULL DEFAULT 1,
+    interval INTEGER NOT NULL DEFAULT 24,
+    cas_posodobitve TEXT DEFAULT '03:00',
+    zadnja_posodobitev TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO Settings (id, avtomatsko, interval, cas_posodobitve, zadnja_posodobitev)
+VALUES (1, 1, 24, '03:00', datetime('now'));
+
+CREATE TABLE IF NOT EXISTS SelectedPlayers (
+    entity_id TEXT PRIMARY KEY,
+    display_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS Users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    display_name TEXT NOT NULL,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    is_tab_user INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS PodcastVisibilityPreferences (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    podcast_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    hidden INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (podcast_id) REFERENCES Podcasts (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(podcast_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS EpisodeListenStatus (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    episode_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    poslušano INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(episode_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS EpisodePlaybackPosition (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    episode_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(episode_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS Jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    params TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    feeds_total INTEGER DEFAULT 0,
+    feeds_done INTEGER DEFAULT 0,
+    episodes_added INTEGER DEFAULT 0,
+    errors TEXT,
+    result TEXT,
+    user_id INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_dedupe_status ON Jobs (dedupe_key, status);
+
+CREATE TABLE IF NOT EXISTS ActiveTrackingSessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    episode_id INTEGER NOT NULL,
+    player_entity_id TEXT NOT NULL,
+    episode_url TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_position INTEGER DEFAULT -1,
+    same_position_count INTEGER DEFAULT 0,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    UNIQUE(episode_id, user_id, player_entity_id)
+);
+""")
+
+    if not column_exists(conn, 'ActiveTrackingSessions', 'last_position'):
+        logger.info("Adding position tracking columns...")
+        conn.execute("ALTER TABLE ActiveTrackingSessions ADD COLUMN last_position INTEGER DEFAULT -1")
+        conn.execute("ALTER TABLE ActiveTrackingSessions ADD COLUMN same_position_count INTEGER DEFAULT 0")
+
+    if not column_exists(conn, 'Podcasts', 'user_id'):
+        logger.info("Adding column user_id to Podcasts table...")
+        conn.execute("ALTER TABLE Podcasts ADD COLUMN user_id INTEGER")
+
+    if not column_exists(conn, 'Podcasts', 'is_public'):
+        logger.info("Adding column 'is_public' to Podcasts table...")
+        conn.execute("ALTER TABLE Podcasts ADD COLUMN is_public INTEGER DEFAULT 0")
+        # Set all existing podcasts from admin users as public
+        conn.execute("UPDATE Podcasts SET is_public = 1 WHERE user_id IN (SELECT id FROM Users WHERE is_admin = 1)")
+
+    if not table_exists(conn, 'Feeds'):
+        # Columns that migration 2 moves from Podcasts to Feeds
+        for column, column_type in (('image_url', 'TEXT'), ('description', 'TEXT'), ('etag', 'TEXT'), ('last_modified', 'TEXT'), ('content_hash', 'TEXT'),
+                                    ('feed_ttl', 'INTEGER'), ('refresh_interval', 'INTEGER'),
+                                    ('next_refresh_at', 'INTEGER')):
+            if not column_exists(conn, 'Podcasts', column):
+                conn.execute(f"ALTER TABLE Podcasts ADD COLUMN {column} {column_type}")
+
+        if not column_exists(conn, 'Episodes', 'guid'):
+            logger.info("Adding episode identity columns to Episodes table...")
+            execute_sql_script(conn, """
+ALTER TABLE Episodes ADD COLUMN guid TEXT;
+ALTER TABLE Episodes ADD COLUMN opis_hash TEXT;
+
+-- Existing episodes are identified by their URL until the next refresh adopts the feed GUID
+UPDATE Episodes SET guid = url
+WHERE id IN (SELECT MIN(id) FROM Episodes GROUP BY podcast_id, url);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_episodes_podcast_guid ON Episodes (podcast_id, guid);
+""")
+
+# Migration 2: feeds and their episodes are stored once for all subscribers
+def migrate_shared_feeds(conn):
+    if table_exists(conn, 'Feeds'):
+        return
+    logger.info("Moving shared feeds and episodes to Feeds table...")
+    execute_sql_script(conn, """
+-- Feed key, same as normalize_feed_url() in main.py: host in lower case without
+-- default port, path without trailing slash, query; scheme and fragment are ignored
+CREATE TEMP TABLE FeedUrls AS
+SELECT id AS podcast_id,
+       CASE WHEN instr(url, '://') THEN substr(url, instr(url, '://') + 3) ELSE url END AS rest
+FROM (SELECT id, CASE WHEN instr(trim(rss_url), '#') THEN substr(trim(rss_url), 1, instr(trim(rss_url), '#') - 1)
+                      ELSE trim(rss_url) END AS url
+      FROM Podcasts);
+
+CREATE TEMP TABLE FeedParts AS
+SELECT podcast_id,
+       lower(CASE WHEN instr(rest, '/') THEN substr(rest, 1, instr(rest, '/') - 1) ELSE rest END) AS host,
+       CASE WHEN instr(rest, '/') THEN substr(rest, instr(rest, '/')) ELSE '' END AS path
+FROM FeedUrls;
+
+CREATE TEMP TABLE FeedKeys AS
+SELECT podcast_id,
+       CASE WHEN host LIKE '%:80' THEN substr(host, 1, length(host) - 3)
+            WHEN host LIKE '%:443' THEN substr(host, 1, length(host) - 4)
+            ELSE host END
+       || CASE WHEN rtrim(CASE WHEN instr(path, '?') THEN substr(path, 1, instr(path, '?') - 1) ELSE path END, '/') = '' THEN '/'
+               ELSE rtrim(CASE WHEN instr(path, '?') THEN substr(path, 1, instr(path, '?') - 1) ELSE path END, '/') END
+       || CASE WHEN instr(path, '?') AND length(path) > instr(path, '?') THEN substr(path, instr(path, '?')) ELSE '' END AS feed_key
+FROM FeedParts;
+
+CREATE TABLE Feeds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    feed_key TEXT NOT NULL UNIQUE,
+    rss_url TEXT NOT NULL,
+    image_url TEXT,
+    description TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    feed_ttl INTEGER,
+    refresh_interval INTEGER,
+    next_refresh_at INTEGER
+);
+
+-- Metadata and schedule of the oldest subscription; validators are left empty,
+-- so the first refresh downloads each feed once in full
+INSERT INTO Feeds (feed_key, rss_url, image_url, description, feed_ttl, refresh_interval, next_refresh_at)
+SELECT k.feed_key, p.rss_url, p.image_url, p.description, p.feed_ttl, p.refresh_interval, p.next_refresh_at
+FROM FeedKeys k
+JOIN Podcasts p ON p.id = k.podcast_id
+WHERE p.id IN (SELECT MIN(podcast_id) FROM FeedKeys GROUP BY feed_key);
+
+CREATE TABLE Podcasts_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    naslov TEXT NOT NULL,
+    rss_url TEXT NOT NULL,
+    datum_naročnine TEXT NOT NULL,
+    user_id INTEGER,
+    is_public INTEGER DEFAULT 0,
+    feed_id INTEGER NOT NULL,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id)
+);
+
+INSERT INTO Podcasts_new (id, naslov, rss_url, datum_naročnine, user_id, is_public, feed_id)
+SELECT p.id, p.naslov, p.rss_url, p.datum_naročnine, p.user_id, p.is_public, f.id
+FROM Podcasts p
+JOIN FeedKeys k ON k.podcast_id = p.id
+JOIN Feeds f ON f.feed_key = k.feed_key;
+
+-- Copies of the same episode in several subscriptions collapse to the oldest row
+CREATE TEMP TABLE EpisodeKeys AS
+SELECT e.id, p.feed_id, COALESCE(e.guid, e.url) AS episode_key
+FROM Episodes e
+JOIN Podcasts_new p ON p.id = e.podcast_id;
+
+CREATE TEMP TABLE EpisodeMap AS
+SELECT k.id AS old_id, m.new_id
+FROM EpisodeKeys k
+JOIN (SELECT feed_id, episode_key, MIN(id) AS new_id FROM EpisodeKeys GROUP BY feed_id, episode_key) m
+  ON m.feed_id = k.feed_id AND m.episode_key = k.episode_key;
+
+CREATE TABLE Episodes_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    feed_id INTEGER NOT NULL,
+    naslov TEXT NOT NULL,
+    datum_izdaje TEXT NOT NULL,
+    url TEXT NOT NULL,
+    izbrisano INTEGER NOT NULL DEFAULT 0,
+    opis TEXT,
+    guid TEXT,
+    opis_hash TEXT,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id) ON DELETE CASCADE
+);
+
+-- An episode stays visible if any subscriber kept it
+INSERT INTO Episodes_new (id, feed_id, naslov, datum_izdaje, url, izbrisano, opis, guid, opis_hash)
+SELECT e.id, k.feed_id, e.naslov, e.datum_izdaje, e.url,
+       (SELECT MIN(d.izbrisano) FROM EpisodeMap dm JOIN Episodes d ON d.id = dm.old_id WHERE dm.new_id = e.id),
+       e.opis, k.episode_key, e.opis_hash
+FROM Episodes e
+JOIN EpisodeKeys k ON k.id = e.id
+WHERE e.id IN (SELECT new_id FROM EpisodeMap);
+
+-- Point listening history, positions and tracking sessions at the kept episode
+UPDATE OR IGNORE EpisodeListenStatus SET episode_id = (SELECT new_id FROM EpisodeMap WHERE old_id = episode_id)
+WHERE episode_id IN (SELECT old_id FROM EpisodeMap WHERE old_id != new_id);
+DELETE FROM EpisodeListenStatus WHERE episode_id NOT IN (SELECT id FROM Episodes_new);
+
+UPDATE OR IGNORE EpisodePlaybackPosition SET episode_id = (SELECT new_id FROM EpisodeMap WHERE old_id = episode_id)
+WHERE episode_id IN (SELECT old_id FROM EpisodeMap WHERE old_id != new_id);
+DELETE FROM EpisodePlaybackPosition WHERE episode_id NOT IN (SELECT id FROM Episodes_new);
+
+UPDATE OR IGNORE ActiveTrackingSessions SET episode_id = (SELECT new_id FROM EpisodeMap WHERE old_id = episode_id)
+WHERE episode_id IN (SELECT old_id FROM EpisodeMap WHERE old_id != new_id);
+DELETE FROM ActiveTrackingSessions WHERE episode_id NOT IN (SELECT id FROM Episodes_new);
+
+DROP TABLE Episodes;
+ALTER TABLE Episodes_new RENAME TO Episodes;
+CREATE UNIQUE INDEX idx_episodes_feed_guid ON Episodes (feed_id, guid);
+
+DROP TABLE Podcasts;
+ALTER TABLE Podcasts_new RENAME TO Podcasts;
+""")
+
+# Migration 3: indexes for frequent queries
+def migrate_query_indexes(conn):
+    execute_sql_script(conn, """
+-- Indexes for frequent queries
+CREATE INDEX IF NOT EXISTS idx_episodes_url ON Episodes (url);
+CREATE INDEX IF NOT EXISTS idx_podcasts_feed ON Podcasts (feed_id);
+CREATE INDEX IF NOT EXISTS idx_podcasts_user ON Podcasts (user_id);
+CREATE INDEX IF NOT EXISTS idx_visibility_user ON PodcastVisibilityPreferences (user_id, hidden);
+CREATE INDEX IF NOT EXISTS idx_listen_status_user ON EpisodeListenStatus (user_id);
+CREATE INDEX IF NOT EXISTS idx_playback_paused ON EpisodePlaybackPosition (timestamp) WHERE position > 0;
+CREATE INDEX IF NOT EXISTS idx_playback_user_paused ON EpisodePlaybackPosition (user_id, timestamp) WHERE position > 0;
+CREATE INDEX IF NOT EXISTS idx_tracking_user ON ActiveTrackingSessions (user_id);
+""")
+
+# Migration 4: publish date as a UNIX timestamp that listings can order by with an index
+def migrate_publish_epoch(conn):
+    conn.execute("ALTER TABLE Episodes ADD COLUMN pub_epoch INTEGER")
+    # Stored dates are 'YYYY-MM-DD HH:MM:SS'; anything SQLite cannot read is parsed like a feed date
+    conn.execute("UPDATE Episodes SET pub_epoch = CAST(strftime('%s', datum_izdaje) AS INTEGER)")
+    unparsed = conn.execute("SELECT id, datum_izdaje FROM Episodes WHERE pub_epoch IS NULL").fetchall()
+    conn.executemany("UPDATE Episodes SET pub_epoch = ? WHERE id = ?",
+                     [(parse_publish_date(datum_izdaje), episode_id) for episode_id, datum_izdaje in unparsed])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_episodes_feed_pub ON Episodes (feed_id, pub_epoch)")
+
+# Migration 5: newest episode of each feed
+def migrate_latest_episodes(conn):
+    execute_sql_script(conn, """
+CREATE TABLE IF NOT EXISTS LatestEpisodes (
+    feed_id INTEGER PRIMARY KEY,
+    episode_id INTEGER NOT NULL,
+    pub_epoch INTEGER,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id) ON DELETE CASCADE,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_latest_episodes_pub ON LatestEpisodes (pub_epoch);
+""")
+    rebuild_latest_episodes(conn)
+
+# Migration 6: counters of unread episodes
+def migrate_unread_counts(conn):
+    conn.execute("ALTER TABLE Feeds ADD COLUMN episode_count INTEGER NOT NULL DEFAULT 0")
+    execute_sql_script(conn, """
+CREATE TABLE IF NOT EXISTS ListenedCounts (
+    user_id INTEGER NOT NULL,
+    feed_id INTEGER NOT NULL,
+    listened INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, feed_id),
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    FOREIGN KEY (feed_id) REFERENCES Feeds (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+""")
+    rebuild_unread_counts(conn)
+
+# Migration 7: episode retention per podcast; the VACUUM afterwards turns on incremental auto-vacuum
+def migrate_episode_retention(conn):
+    conn.execute("ALTER TABLE Podcasts ADD COLUMN keep_episodes INTEGER")
+    conn.execute("ALTER TABLE Podcasts ADD COLUMN keep_days INTEGER")
+
+# Migration 8: progress of jobs that do not work on feeds, and rows left behind by podcast
+# deletions from before they ran as a background job
+def migrate_job_items(conn):
+    conn.execute("ALTER TABLE Jobs ADD COLUMN items_total INTEGER DEFAULT 0")
+    conn.execute("ALTER TABLE Jobs ADD COLUMN items_done INTEGER DEFAULT 0")
+    for table in ('EpisodeListenStatus', 'EpisodePlaybackPosition', 'ActiveTrackingSessions'):
+        conn.execute(f"DELETE FROM {table} WHERE episode_id NOT IN (SELECT id FROM Episodes)")
+
+# Migration 9: episodes deleted by a user are hidden only in the user's subscription
+def migrate_deleted_episodes(conn):
+    """
+    Migration 2 merged the deletes of a feed's subscriptions into the shared episode row,
+    where they cannot be traced to a subscription any more. They are kept in every
+    subscription of the feed, where they were hidden before.
+    """
+    execute_sql_script(conn, """
+-- Episodes deleted from a subscription; the shared episode stays for the other subscriptions
+CREATE TABLE IF NOT EXISTS DeletedEpisodes (
+    podcast_id INTEGER NOT NULL,
+    episode_id INTEGER NOT NULL,
+    PRIMARY KEY (podcast_id, episode_id),
+    FOREIGN KEY (podcast_id) REFERENCES Podcasts (id) ON DELETE CASCADE,
+    FOREIGN KEY (episode_id) REFERENCES Episodes (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_deleted_episodes_episode ON DeletedEpisodes (episode_id);
+""")
+    conn.execute("""
+        INSERT OR IGNORE INTO DeletedEpisodes (podcast_id, episode_id)
+        SELECT p.id, e.id FROM Episodes e JOIN Podcasts p ON p.feed_id = e.feed_id
+        WHERE e.izbrisano = 1
+    """)
+    conn.execute("UPDATE Episodes SET izbrisano = 0 WHERE izbrisano = 1")
+    rebuild_unread_counts(conn)
+    rebuild_latest_episodes(conn)
+
+# Migration 10: counters of deleted episodes, so unread counts need no count of DeletedEpisodes
+def migrate_deleted_counts(conn):
+    conn.execute("ALTER TABLE Podcasts ADD COLUMN deleted_count INTEGER NOT NULL DEFAULT 0")
+    execute_sql_script(conn, """
+-- Listened episodes among those deleted from a subscription, per user; see UNREAD_COUNT
+CREATE TABLE IF NOT EXISTS DeletedListenedCounts (
+    user_id INTEGER NOT NULL,
+    podcast_id INTEGER NOT NULL,
+    listened INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, podcast_id),
+    FOREIGN KEY (user_id) REFERENCES Users (id) ON DELETE CASCADE,
+    FOREIGN KEY (podcast_id) REFERENCES Podcasts (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+""")
+    rebuild_deleted_counts(conn)
+
+# Schema migrations: (version, description, function, vacuum afterwards)
+MIGRATIONS = [
+    (1, "structure updates from before versioned migrations", migrate_legacy_schema, False),
+    (2, "shared feeds", migrate_shared_feeds, True),
+    (3, "indexes for frequent queries", migrate_query_indexes, False),
+    (4, "episode publish timestamps", migrate_publish_epoch, False),
+    (5, "latest episode of each feed", migrate_latest_episodes, False),
+    (6, "unread episode counters", migrate_unread_counts, False),
+    (7, "episode retention and incremental vacuum", migrate_episode_retention, True),
+    (8, "job item progress and orphaned episode data", migrate_job_items, False),
+    (9, "episode deletes per subscription", migrate_deleted_episodes, False),
+    (10, "deleted episode counters", migrate_deleted_counts, False),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Newest episode of each feed that is not deleted, computed from all episodes
+LATEST_EPISODES_QUERY = """
+    SELECT feed_id, id AS episode_id, pub_epoch FROM (
+        SELECT feed_id, id, pub_epoch,
+               ROW_NUMBER() OVER (PARTITION BY feed_id ORDER BY pub_epoch DESC, id DESC) AS rn
+        FROM Episodes
+        WHERE izbrisano IS NOT 1
+    )
+    WHERE rn = 1
+"""
+
+# Episode of subscription p shown in place of its feed's newest episode le: the newest one that
+# the subscription did not delete
+SUBSCRIPTION_LATEST_EPISODE = """
+    CASE WHEN NOT EXISTS (SELECT 1 FROM DeletedEpisodes de WHERE de.podcast_id = p.id AND de.episode_id = le.episode_id)
+    THEN le.episode_id
+    ELSE (SELECT e2.id FROM Episodes e2
+          WHERE e2.feed_id = le.feed_id AND e2.izbrisano IS NOT 1
+          AND NOT EXISTS (SELECT 1 FROM DeletedEpisodes de WHERE de.podcast_id = p.id AND de.episode_id = e2.id)
+          ORDER BY e2.pub_epoch DESC, e2.id DESC
+          LIMIT 1)
+    END
+"""
+
+# Unread episodes of subscription p for the user of lc: episodes of the feed that the user has not
+# listened to, without those that the subscription deleted. A user without listened episodes of
+# the feed has no lc row, and none of the deleted ones listened either.
+UNREAD_COUNT = """
+    f.episode_count - COALESCE(lc.listened, 0) - p.deleted_count + COALESCE((
+        SELECT dlc.listened FROM DeletedListenedCounts dlc
+        WHERE dlc.user_id = lc.user_id AND dlc.podcast_id = p.id
+    ), 0)
+"""
+
+# Function for updating LatestEpisodes after episodes of feeds were added or deleted
+def refresh_latest_episodes(conn, feed_ids):
+    """Same result as LATEST_EPISODES_QUERY for the given feeds, read from idx_episodes_feed_pub"""
+    for feed_id in feed_ids:
+        conn.execute("DELETE FROM LatestEpisodes WHERE feed_id = ?", (feed_id,))
+        conn.execute("""
+            INSERT INTO LatestEpisodes (feed_id, episode_id, pub_epoch)
+            SELECT feed_id, id, pub_epoch
+            FROM Episodes
+            WHERE feed_id = ? AND izbrisano IS NOT 1
+            ORDER BY pub_epoch DESC, id DESC
+            LIMIT 1
+        """, (feed_id,))
+
+# Function for recomputing LatestEpisodes from all episodes
+def rebuild_latest_episodes(conn):
+    conn.execute("DELETE FROM LatestEpisodes")
+    conn.execute(f"INSERT INTO LatestEpisodes (feed_id, episode_id, pub_epoch) {LATEST_EPISODES_QUERY}")
+
+# Function for checking LatestEpisodes against a full recompute at startup
+def check_latest_episodes():
+    with get_db_connection() as conn:
+        differences = conn.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT * FROM (SELECT feed_id, episode_id, pub_epoch FROM LatestEpisodes EXCEPT {LATEST_EPISODES_QUERY})
+                UNION ALL
+                SELECT * FROM ({LATEST_EPISODES_QUERY} EXCEPT SELECT feed_id, episode_id, pub_epoch FROM LatestEpisodes)
+            )
+        """).fetchone()[0]
+    if differences:
+        logger.warning(f"LatestEpisodes differs from episodes in {differences} rows, rebuilding")
+        run_write(rebuild_latest_episodes)
+
+# Function for recomputing episode counts of feeds and listened counts of users
+def rebuild_unread_counts(conn):
+    conn.execute("""
+        UPDATE Feeds SET episode_count = (
+            SELECT COUNT(*) FROM Episodes e WHERE e.feed_id = Feeds.id AND e.izbrisano IS NOT 1
+        )
+    """)
+    conn.execute("DELETE FROM ListenedCounts")
+    conn.execute("""
+        INSERT INTO ListenedCounts (user_id, feed_id, listened)
+        SELECT els.user_id, e.feed_id, COUNT(*)
+        FROM EpisodeListenStatus els
+        JOIN Episodes e ON e.id = els.episode_id
+        WHERE els.poslušano = 1 AND e.izbrisano IS NOT 1
+        GROUP BY els.user_id, e.feed_id
+    """)
+
+# Function for recomputing the counters of episodes deleted from subscriptions
+def rebuild_deleted_counts(conn):
+    conn.execute("""
+        UPDATE Podcasts SET deleted_count = (
+            SELECT COUNT(*) FROM DeletedEpisodes de WHERE de.podcast_id = Podcasts.id
+        )
+    """)
+    conn.execute("DELETE FROM DeletedListenedCounts")
+    conn.execute("""
+        INSERT INTO DeletedListenedCounts (user_id, podcast_id, listened)
+        SELECT els.user_id, de.podcast_id, COUNT(*)
+        FROM DeletedEpisodes de
+        JOIN EpisodeListenStatus els ON els.episode_id = de.episode_id
+        WHERE els.poslušano = 1
+        GROUP BY els.user_id, de.podcast_id
+    """)
+
+# Function for changing the listened counters of subscriptions that deleted an episode
+def count_deleted_listened(conn, episode_id, user_id, change):
+    conn.execute("""
+        INSERT INTO DeletedListenedCounts (user_id, podcast_id, listened)
+        SELECT ?, podcast_id, ? FROM DeletedEpisodes WHERE episode_id = ?
+        ON CONFLICT(user_id, podcast_id) DO UPDATE SET listened = listened + excluded.listened
+    """, (user_id, change, episode_id))
+
+# Function for marking an episode as listened by a user
+def set_episode_listened(conn, episode_id, user_id):
+    """Call inside a write transaction, so the listened count changes only once per episode"""
+    listen_status = conn.execute(
+        "SELECT poslušano FROM EpisodeListenStatus WHERE episode_id = ? AND user_id = ?",
+        (episode_id, user_id)
+    ).fetchone()
+    conn.execute("""
+        INSERT INTO EpisodeListenStatus (episode_id, user_id, poslušano, timestamp)
+        VALUES (?, ?, 1, datetime('now'))
+        ON CONFLICT(episode_id, user_id)
+        DO UPDATE SET poslušano = 1, timestamp = datetime('now')
+    """, (episode_id, user_id))
+    if not listen_status or not listen_status[0]:
+        conn.execute("""
+            INSERT INTO ListenedCounts (user_id, feed_id, listened)
+            SELECT ?, feed_id, 1 FROM Episodes WHERE id = ? AND izbrisano IS NOT 1
+            ON CONFLICT(user_id, feed_id) DO UPDATE SET listened = listened + 1
+        """, (user_id, episode_id))
+        count_deleted_listened(conn, episode_id, user_id, 1)
+
+# Function for creating the database or bringing it to the current schema
+def migrate_database():
+    """
+    Runs once at startup, before any thread uses the database. Pending migrations
+    are applied in one transaction, so a failed step leaves the database unchanged.
+    """
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == SCHEMA_VERSION:
+            logger.info(f"Database schema is up to date (version {version}).")
+            return
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than this add-on ({SCHEMA_VERSION})")
+
+        # Applies to a new database at once and to an existing one at its next VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        # Tables are rebuilt while migrating, references are checked before commit
+        conn.execute("PRAGMA foreign_keys = OFF")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not table_exists(conn, 'Podcasts'):
+                logger.info(f"Creating new SQLite database at {DB_PATH}...")
+                execute_sql_script(conn, SCHEMA_SQL)
+                pending = []
+            else:
+                pending = [m for m in MIGRATIONS if m[0] > version]
+            for migration_version, description, migrate, vacuum in pending:
+                step_started = time.perf_counter()
+                migrate(conn)
+                logger.info(f"Applied database migration {migration_version} ({description}) "
+                            f"in {(time.perf_counter() - step_started) * 1000:.0f} ms")
+            broken = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if broken:
+                logger.warning(f"{len(broken)} rows reference missing rows after migration")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if any(m[3] for m in pending):
+            conn.execute("VACUUM")
+        logger.info(f"Database schema updated from version {version} to {SCHEMA_VERSION} "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+    finally:
+        conn.close()
+
+class HomeAssistantWebSocket:
+    """
+    One authenticated connection to the Home Assistant WebSocket API, shared by request
+    handlers and background threads. The connection lives on its own event loop thread,
+    which is started by the first command and reconnects with HA_RECONNECT_DELAYS.
+    Commands get their message id here and wait for the response with that id.
+    """
+
+    def __init__(self, url=HA_WEBSOCKET_URL, token=None):
+        self.url = url
+        self.token = token  # None reads SUPERVISOR_TOKEN when connecting
+        self.loop = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.websocket = None
+        self.connected = None
+        self.next_id = 1
+        self.pending = {}  # {message id: asyncio.Future}
+        self.event_handlers = {}  # {message id of a subscription: callback}
+        self.next_subscription_key = 1
+        # Structure: {key: {'command': dict, 'callback': function, 'on_lost': function or None, 'id': message id or None}}
+        self.subscriptions = {}
+        self.changes_lock = None  # asyncio.Lock of the loop, for callers that replace subscriptions
+
+    def run(self, function, *args):
+        """Runs the coroutine function on the connection's loop; returns a concurrent.futures.Future"""
+        if not (self.token or os.environ.get('SUPERVISOR_TOKEN')):
+            raise Exception("No Supervisor token available")
+        self.start()
+        return asyncio.run_coroutine_threadsafe(function(*args), self.loop)
+
+    def submit(self, command, timeout=HA_WEBSOCKET_TIMEOUT):
+        """Sends a command from any thread; returns a concurrent.futures.Future with the response"""
+        return self.run(self.call, command, timeout)
+
+    def subscribe(self, command, callback, timeout=HA_WEBSOCKET_TIMEOUT, on_lost=None):
+        """
+        Subscribes from any thread; callback(event) runs on the connection's thread for every
+        event. Returns a concurrent.futures.Future with the key for unsubscribe(). The
+        subscription is renewed after every reconnect; on_lost() runs on the connection's
+        thread when the connection drops or renewing fails, so events stop arriving.
+        """
+        return self.run(self.add_subscription, command, callback, timeout, on_lost)
+
+    def unsubscribe(self, key):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.remove_subscription(key), self.loop)
+
+    def is_connected(self):
+        return self.connected is not None and self.connected.is_set()
+
+    def is_subscribed(self, key):
+        """True while Home Assistant has confirmed the subscription on the current connection"""
+        subscription = self.subscriptions.get(key)
+        return self.is_connected() and subscription is not None and subscription['id'] is not None
+
+    def start(self):
+        with self.start_lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self.thread = threading.Thread(target=self.run_loop, args=(ready,), daemon=True, name='ha-websocket')
+            self.thread.start()
+            ready.wait()
+
+    def run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.connected = asyncio.Event()
+        self.changes_lock = asyncio.Lock()
+        self.loop.create_task(self.keep_connected())
+        ready.set()
+        self.loop.run_forever()
+
+    async def call(self, command, timeout=HA_WEBSOCKET_TIMEOUT, on_event=None):
+        """
+        Runs on the connection's loop; the response is returned as received. on_event gets
+        the events of a subscribe command, and is registered before sending so none is missed.
+        """
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError("Home Assistant WebSocket API is not available")
+
+        message_id = self.next_id
+        self.next_id += 1
+        response = self.loop.create_future()
+        self.pending[message_id] = response
+        if on_event:
+            self.event_handlers[message_id] = on_event
+        try:
+            await self.websocket.send(json.dumps({**command, "id": message_id}))
+            result = await asyncio.wait_for(response, timeout)
+        except Exception:
+            self.event_handlers.pop(message_id, None)
+            raise
+        finally:
+            self.pending.pop(message_id, None)
+        if not result.get('success', True):
+            self.event_handlers.pop(message_id, None)
+        return result
+
+    async def add_subscription(self, command, callback, timeout, on_lost=None):
+        key = self.next_subscription_key
+        self.next_subscription_key += 1
+        self.subscriptions[key] = {'command': command, 'callback': callback, 'on_lost': on_lost, 'id': None}
+        # Without a connection the subscription is sent by renew_subscriptions once connected
+        if self.connected.is_set():
+            try:
+                await self.send_subscription(key, timeout)
+            except Exception:
+                self.subscriptions.pop(key, None)
+                raise
+        return key
+
+    async def send_subscription(self, key, timeout=HA_WEBSOCKET_TIMEOUT):
+        subscription = self.subscriptions[key]
+        result = await self.call(subscription['command'], timeout, on_event=subscription['callback'])
+        if not result.get('success'):
+            raise Exception(f"Home Assistant subscription failed: {result.get('error')}")
+        subscription['id'] = result['id']
+
+    async def renew_subscriptions(self):
+        for key in list(self.subscriptions):
+            try:
+                await self.send_subscription(key)
+            except Exception as e:
+                logger.error(f"Error renewing Home Assistant subscription {key}: {e}")
+                if key in self.subscriptions:
+                    self.subscription_lost(self.subscriptions[key])
+
+    def subscription_lost(self, subscription):
+        if subscription['on_lost']:
+            try:
+                subscription['on_lost']()
+            except Exception as e:
+                logger.error(f"Error handling a lost Home Assistant subscription: {e}")
+
+    async def remove_subscription(self, key):
+        subscription = self.subscriptions.pop(key, None)
+        if not subscription or subscription['id'] is None:
+            return
+        self.event_handlers.pop(subscription['id'], None)
+        if self.connected.is_set():
+            await self.call({"type": "unsubscribe_events", "subscription": subscription['id']})
+
+    async def keep_connected(self):
+        failures = 0
+        while True:
+            try:
+                async with websockets.connect(self.url) as websocket:
+                    await self.authenticate(websocket)
+                    self.websocket = websocket
+                    self.connected.set()
+                    failures = 0
+                    logger.info("Connected to Home Assistant WebSocket API")
+                    if self.subscriptions:
+                        self.loop.create_task(self.renew_subscriptions())
+                    async for message in websocket:
+                        self.dispatch(json.loads(message))
+                error = "connection closed"
+            except Exception as e:
+                error = e
+            finally:
+                self.connected.clear()
+                self.websocket = None
+                # Subscriptions end with the connection
+                self.event_handlers.clear()
+                for subscription in self.subscriptions.values():
+                    if subscription['id'] is not None:
+                        subscription['id'] = None
+                        self.subscription_lost(subscription)
+                for response in self.pending.values():
+                    if not response.done():
+                        response.set_exception(ConnectionError("Home Assistant WebSocket connection was lost"))
+
+            delay = HA_RECONNECT_DELAYS[min(failures, len(HA_RECONNECT_DELAYS) - 1)]
+            failures += 1
+            logger.warning(f"Home Assistant WebSocket API: {error}, reconnecting in {delay} s")
+            await asyncio.sleep(delay)
+
+    async def authenticate(self, websocket):
+        message = json.loads(await asyncio.wait_for(websocket.recv(), HA_WEBSOCKET_TIMEOUT))
+        if message.get('type') != 'auth_required':
+            raise ConnectionError(f"unexpected message {message.get('type')} before authentication")
+        await websocket.send(json.dumps({
+            "type": "auth",
+            "access_token": self.token or os.environ.get('SUPERVISOR_TOKEN')
+        }))
+        message = json.loads(await asyncio.wait_for(websocket.recv(), HA_WEBSOCKET_TIMEOUT))
+        if message.get('type') != 'auth_ok':
+            raise ConnectionError(f"authentication failed: {message.get('message', message.get('type'))}")
+
+    def dispatch(self, message):
+        if message.get('type') == 'event':
+            callback = self.event_handlers.get(message.get('id'))
+            if callback:
+                try:
+                    callback(message.get('event', {}))
+                except Exception as e:
+                    logger.error(f"Error handling Home Assistant event: {e}")
+            return
+        response = self.pending.get(message.get('id'))
+        if response and not response.done():
+            response.set_result(message)
+
+HA_WEBSOCKET = HomeAssistantWebSocket()
+
 # Function for Home Assistant WebSocket API
 async def ha_websocket_call(command):
-    """Execute Home Assistant WebSocket API call"""
-    supervisor_token = os.environ.get('SUPERVISOR_TOKEN')
-    if not supervisor_token:
-        raise Exception("No Supervisor token available")
-    uri = "ws://supervisor/core/websocket"
-    async with websockets.connect(uri) as websocket:
-        auth_message = {
-            "type": "auth",
-            "access_token": supervisor_token
-        }
-        await websocket.send(json.dumps(auth_message))
-        response = await websocket.recv()
-        
-        await websocket.send(json.dumps(command))
-        response = await websocket.recv()
-        return json.loads(response)
+    """Execute Home Assistant WebSocket API call over the shared connection"""
+    return await asyncio.wrap_future(HA_WEBSOCKET.submit(command))
 
 # Function for getting current user
 def get_current_user():
@@ -138,6 +1537,18 @@ def clear_cache():
         'message': f"Cache {'za uporabnika ' + username if username else 'za vse uporabnike'} je bil uspešno izbrisan."
     })
 
+# API for recomputing unread episode counters from scratch
+@app.route('/api/unread_counts/rebuild', methods=['POST'])
+def rebuild_unread_counts_api():
+    user = get_user_from_db(get_current_user())
+    if not user or not user['is_admin']:
+        return jsonify({"error": "Nimate pravic za ponovni izračun števcev."}), 403
+
+    run_write(rebuild_unread_counts)
+    run_write(rebuild_deleted_counts)
+    logger.info(f"Unread counters rebuilt by {user['username']}")
+    return jsonify({"message": "Števci neposlušanih epizod so ponovno izračunani."})
+
 # Function for checking and creating user in database
 def get_user_from_db(username):
     """Checks if user exists and creates them if they don't exist"""
@@ -157,19 +1568,6 @@ def get_user_from_db(username):
     try:
         conn = get_db_connection()
         
-        # First check if Users table exists, if not, create it
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS Users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            display_name TEXT NOT NULL,
-            is_admin INTEGER NOT NULL DEFAULT 0,
-            is_tab_user INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        conn.commit()
-        
         # Check if user already exists
         user = conn.execute(
             "SELECT * FROM Users WHERE username = ?", 
@@ -205,14 +1603,13 @@ def get_user_from_db(username):
                 logger.info(f"Assigning admin privileges to first user: {username}")
         
         # FIXED: correct number of parameters in SQL statement
-        conn.execute(
+        execute_write(
             """
             INSERT INTO Users (username, display_name, is_admin, is_tab_user, created_at)
             VALUES (?, ?, ?, ?, datetime('now'))
             """,
             (username, display_name, 1 if is_admin else 0, 0)  # is_tab_user is always set to 0 for new users
         )
-        conn.commit()
         
         # Get the created user
         user = conn.execute(
@@ -294,49 +1691,374 @@ def get_podcasts():
     
     if user['is_admin'] == 1:
         logger.info(f"Retrieving all podcasts for admin user {user['username']}.")
-        podcasts = conn.execute("""
-            SELECT p.*, u.display_name as user_display_name 
+        podcasts = conn.execute(f"""
+            SELECT p.*, f.image_url, f.description, u.display_name as user_display_name,
+                {UNREAD_COUNT} as unread_count
             FROM Podcasts p
+            JOIN Feeds f ON p.feed_id = f.id
             LEFT JOIN Users u ON p.user_id = u.id
-        """).fetchall()
+            LEFT JOIN ListenedCounts lc ON lc.user_id = ? AND lc.feed_id = p.feed_id
+        """, (user['id'],)).fetchall()
     else:
         logger.info(f"Retrieving podcasts for user {user['username']} (ID: {user['id']}).")
         # Added consideration for hidden podcasts
-        podcasts = conn.execute("""
-            SELECT p.*, u.display_name as user_display_name
+        podcasts = conn.execute(f"""
+            SELECT p.*, f.image_url, f.description, u.display_name as user_display_name,
+                {UNREAD_COUNT} as unread_count
             FROM Podcasts p
+            JOIN Feeds f ON p.feed_id = f.id
             LEFT JOIN Users u ON p.user_id = u.id
+            LEFT JOIN ListenedCounts lc ON lc.user_id = ? AND lc.feed_id = p.feed_id
             LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
             WHERE (p.user_id = ? OR p.is_public = 1)
             AND (pvp.hidden IS NULL OR pvp.hidden = 0)
-        """, (user['id'], user['id'])).fetchall()
+        """, (user['id'], user['id'], user['id'])).fetchall()
     
     conn.close()
     logger.info(f"{len(podcasts)} podcasts found for user {user['username']}.")
     return jsonify([dict(podcast) for podcast in podcasts])
 
-# Function for getting description from RSS feed
-def get_podcast_description(rss_url):
-    feed = feedparser.parse(rss_url)
-    if feed.bozo:
-        logger.info(f"Error reading RSS for description: {rss_url}")
+# XML namespaces used in podcast RSS feeds
+ITUNES_NS = 'http://www.itunes.com/dtds/podcast-1.0.dtd'
+CONTENT_NS = 'http://purl.org/rss/1.0/modules/content/'
+SY_NS = 'http://purl.org/rss/1.0/modules/syndication/'
+
+# Length of sy:updatePeriod values in seconds
+SY_UPDATE_PERIODS = {'hourly': 3600, 'daily': 86400, 'weekly': 604800, 'monthly': 2592000, 'yearly': 31536000}
+
+# Function for downloading and parsing an RSS feed once
+def fetch_podcast_feed(rss_url, etag=None, last_modified=None, content_hash=None, known_guids=None):
+    """
+    Downloads and parses an RSS feed a single time.
+
+    When ETag / Last-Modified from the previous download are given, a conditional
+    request is sent. Parsing is skipped if the server answers 304 or the body hash
+    matches content_hash.
+
+    When known_guids is given, the feed is parsed incrementally and reading stops after
+    FEED_KNOWN_STOP_COUNT consecutive episodes whose GUID is already known. In that case
+    content_hash covers only the part of the body that was read. Without known_guids the
+    whole feed is parsed (full scan, used for backfills).
+
+    Returns:
+        dict: {'status', 'etag', 'last_modified', 'content_hash'} and, when status is 'ok',
+              also {'image_url', 'description', 'entries'}. Status is one of 'ok',
+              'not_modified' or 'unchanged'. None if the feed could not be read.
+    """
+    headers = {'User-Agent': FEED_USER_AGENT}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    try:
+        with requests.get(rss_url, headers=headers, timeout=FEED_REQUEST_TIMEOUT, stream=True) as response:
+            if response.status_code == 304:
+                return {'status': 'not_modified', 'etag': etag, 'last_modified': last_modified, 'content_hash': content_hash}
+
+            if not response.ok:
+                logger.info(f"Error downloading RSS {rss_url}: HTTP {response.status_code}")
+                return None
+
+            result = {
+                'status': 'ok',
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            blocks = iter_feed_blocks(response)
+            hasher = hashlib.sha256()
+
+            parsed = None
+            body = b''
+            if known_guids is not None:
+                parsed = stream_feed(blocks, hasher, known_guids)
+                if not parsed['is_rss']:
+                    body = parsed['body_prefix']
+                    parsed = None
+            if parsed is None:
+                # Full scan (or a feed the streaming parser does not understand)
+                rest = b''.join(blocks)
+                hasher.update(rest)
+                body += rest
+    except (requests.RequestException, ValueError, etree.LxmlError) as e:
+        logger.info(f"Error downloading RSS {rss_url}: {e}")
+        return None
+
+    result['content_hash'] = hasher.hexdigest()
+    if content_hash and result['content_hash'] == content_hash:
+        result['status'] = 'unchanged'
+        return result
+
+    if parsed is None:
+        response_headers = {key.lower(): value for key, value in response.headers.items()}
+        feed = feedparser.parse(body, response_headers=response_headers)
+        if feed.bozo:
+            logger.info(f"Error reading RSS: {rss_url}")
+            return None
+        parsed = {
+            'image_url': get_podcast_image(feed),
+            'description': get_podcast_description(feed),
+            'entries': [normalize_feed_entry(entry) for entry in feed.entries],
+            'refresh_hint': get_feed_refresh_hint(
+                feed.feed.get('ttl'), feed.feed.get('sy_updateperiod'), feed.feed.get('sy_updatefrequency')),
+        }
+
+    result['image_url'] = parsed['image_url']
+    result['description'] = parsed['description']
+    result['entries'] = parsed['entries']
+    result['refresh_hint'] = parsed['refresh_hint']
+    return result
+
+# Function for reading a feed body in fixed size blocks
+def iter_feed_blocks(response):
+    """
+    Yields the response body in FEED_BLOCK_SIZE blocks so that the hash of a partially
+    read body is stable between refreshes. Raises ValueError above FEED_MAX_BYTES.
+    """
+    buffer = b''
+    total = 0
+    for chunk in response.iter_content(chunk_size=FEED_BLOCK_SIZE):
+        total += len(chunk)
+        if total > FEED_MAX_BYTES:
+            raise ValueError(f"feed is larger than {FEED_MAX_BYTES // (1024 * 1024)} MB")
+        buffer += chunk
+        while len(buffer) >= FEED_BLOCK_SIZE:
+            yield buffer[:FEED_BLOCK_SIZE]
+            buffer = buffer[FEED_BLOCK_SIZE:]
+    if buffer:
+        yield buffer
+
+# Function for incremental parsing of an RSS feed
+def stream_feed(blocks, hasher, known_guids):
+    """
+    Parses RSS items with lxml while the body is being downloaded and stops after
+    FEED_KNOWN_STOP_COUNT consecutive known episodes. Parsed items are cleared right
+    away, so memory stays bounded regardless of the feed size.
+
+    Returns:
+        dict: {'is_rss': True, 'image_url', 'description', 'entries'}, or
+              {'is_rss': False, 'body_prefix'} if the document is not RSS (for example Atom)
+              and has to be parsed with feedparser.
+    """
+    parser = etree.XMLPullParser(events=('start', 'end'), resolve_entities=False, no_network=True, recover=True, huge_tree=True)
+    parsed = {'is_rss': False, 'image_url': None, 'description': None, 'entries': []}
+    channel = {}
+    consumed = []
+    root_checked = False
+    known_in_row = 0
+    depth = 0
+
+    for block in blocks:
+        hasher.update(block)
+        if not root_checked:
+            consumed.append(block)
+        parser.feed(block)
+
+        for event, elem in parser.read_events():
+            if event == 'start':
+                depth += 1
+                if not root_checked:
+                    root_checked = True
+                    if elem.tag != 'rss':
+                        # Not RSS - hand the body over to feedparser
+                        return {'is_rss': False, 'body_prefix': b''.join(consumed)}
+                    parsed['is_rss'] = True
+                    consumed = []
+                continue
+
+            depth -= 1
+            if elem.tag == 'item':
+                entry = parse_feed_item(elem)
+                parsed['entries'].append(entry)
+                known_in_row = known_in_row + 1 if get_episode_guid(entry) in known_guids else 0
+                # Drop the item and everything before it to keep memory bounded
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+                if known_in_row >= FEED_KNOWN_STOP_COUNT:
+                    parsed.update(get_channel_metadata(channel))
+                    return parsed
+            elif depth == 2 and isinstance(elem.tag, str):
+                # Direct child of <channel>
+                channel.setdefault(elem.tag, elem)
+            elif depth == 3 and elem.tag == 'url' and elem.getparent().tag == 'image':
+                channel.setdefault('image_url', (elem.text or '').strip())
+
+    if not parsed['is_rss']:
+        return {'is_rss': False, 'body_prefix': b''.join(consumed)}
+    parsed.update(get_channel_metadata(channel))
+    return parsed
+
+# Function for reading podcast image and description from streamed <channel> elements
+def get_channel_metadata(channel):
+    image_url = channel.get('image_url')
+    if not image_url and f'{{{ITUNES_NS}}}image' in channel:
+        image_url = channel[f'{{{ITUNES_NS}}}image'].get('href')
+
+    description = None
+    for tag in ('description', f'{{{ITUNES_NS}}}subtitle'):
+        if tag in channel and channel[tag].text:
+            description = channel[tag].text.strip()
+            break
+
+    def channel_text(tag):
+        return channel[tag].text if tag in channel else None
+
+    return {
+        'image_url': image_url or None,
+        'description': description,
+        'refresh_hint': get_feed_refresh_hint(
+            channel_text('ttl'), channel_text(f'{{{SY_NS}}}updatePeriod'), channel_text(f'{{{SY_NS}}}updateFrequency')),
+    }
+
+# Function for reading how often a feed asks to be refreshed (<ttl>, sy:updatePeriod)
+def get_feed_refresh_hint(ttl, update_period, update_frequency):
+    """Returns the shortest refresh interval in seconds the feed allows, or None without hints."""
+    hints = []
+    try:
+        if ttl:
+            hints.append(int(ttl.strip()) * 60)
+    except ValueError:
+        pass
+
+    period = SY_UPDATE_PERIODS.get((update_period or '').strip().lower())
+    if period:
+        try:
+            frequency = max(1, int((update_frequency or '1').strip()))
+        except ValueError:
+            frequency = 1
+        hints.append(period // frequency)
+
+    return max(hints) if hints else None
+
+# Function for reading one streamed <item> element
+def parse_feed_item(item):
+    entry = {'guid': None, 'naslov': '', 'published': None, 'url': None, 'opis': ''}
+    link = None
+    summary = ''
+    content = ''
+    for child in item:
+        if not isinstance(child.tag, str):
+            continue
+        text = (child.text or '').strip()
+        if child.tag == 'title':
+            entry['naslov'] = text
+        elif child.tag == 'guid':
+            entry['guid'] = text or None
+        elif child.tag == 'pubDate':
+            entry['published'] = text or None
+        elif child.tag == 'link':
+            link = text or None
+        elif child.tag == 'enclosure' and not entry['url']:
+            entry['url'] = child.get('url')
+        elif child.tag == 'description':
+            entry['opis'] = text
+        elif child.tag == f'{{{ITUNES_NS}}}summary':
+            summary = text
+        elif child.tag == f'{{{CONTENT_NS}}}encoded':
+            content = text
+
+    entry['url'] = entry['url'] or link
+    entry['opis'] = sanitize_episode_html(entry['opis'] or summary or content)
+    return entry
+
+# Function for getting the stable identity of a feed entry
+def get_episode_guid(entry):
+    """Episodes are identified by the feed GUID, or by their URL when the feed has no GUIDs."""
+    return entry['guid'] or entry['url']
+
+# feedparser's HTML sanitizer and date parser are private; when an upgrade removes or
+# changes them, sanitize_episode_html and parse_publish_date use public fallbacks
+FEEDPARSER_SANITIZE_HTML = getattr(getattr(feedparser, 'sanitizer', None), '_sanitize_html', None)
+FEEDPARSER_PARSE_DATE = getattr(getattr(feedparser, 'datetimes', None), '_parse_date', None)
+if not (FEEDPARSER_SANITIZE_HTML and FEEDPARSER_PARSE_DATE):
+    logger.warning(f"feedparser {feedparser.__version__} has no private sanitizer or date parser, using fallbacks")
+
+# Function for cleaning episode HTML the same way feedparser does
+def sanitize_episode_html(html):
+    if not html:
+        return ''
+    if FEEDPARSER_SANITIZE_HTML:
+        try:
+            return FEEDPARSER_SANITIZE_HTML(html, 'utf-8', 'text/html')
+        except TypeError:
+            pass
+    # feedparser sanitizes the description of a parsed item
+    entries = feedparser.parse(
+        f"<rss><channel><item><description>{xml_escape(html)}</description></item></channel></rss>").entries
+    return entries[0].get('summary', '') if entries else ''
+
+# Function for reading date text with the standard library: RFC 822 or ISO 8601
+def parse_date_text(value):
+    """Returns a UTC time.struct_time, or None; dates without a zone are taken as UTC"""
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).timetuple()
+
+# Function for converting an episode publish date to a UNIX timestamp
+def parse_publish_date(value):
+    """
+    Accepts a UTC time.struct_time (feedparser *_parsed fields) or date text in any
+    format feedparser understands: RFC 822 with numeric or named zones, ISO 8601, W3C-DTF...
+    Returns None when the date is missing or cannot be read.
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = FEEDPARSER_PARSE_DATE(value) if FEEDPARSER_PARSE_DATE else parse_date_text(value)
+        except TypeError:
+            value = parse_date_text(value)
+        if not value:
+            return None
+    try:
+        return calendar.timegm(value)
+    except (TypeError, ValueError, OverflowError):
         return None
 
+# Function for formatting a UNIX timestamp as the stored datum_izdaje (UTC)
+def format_publish_date(pub_epoch):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(pub_epoch))
+
+# Function for converting a feedparser entry to the episode format used in update_episodes
+def normalize_feed_entry(entry):
+    opis = ""
+    if hasattr(entry, 'summary'):
+        opis = entry.summary
+    elif hasattr(entry, 'description'):
+        opis = entry.description
+
+    return {
+        'guid': entry.get('id'),
+        'naslov': entry.get('title', ''),
+        'published': entry.get('published'),
+        'published_parsed': entry.get('published_parsed') or entry.get('updated_parsed'),
+        'url': entry.enclosures[0].href if hasattr(entry, 'enclosures') and entry.enclosures else entry.get('link'),
+        'opis': opis,
+    }
+
+# Function for getting description from parsed RSS feed
+def get_podcast_description(feed):
     if 'description' in feed.feed:
         return feed.feed.description
     elif 'subtitle' in feed.feed:
         return feed.feed.subtitle
     return None
 
-# Function for getting image from RSS feed
-def get_podcast_image(rss_url):
-    feed = feedparser.parse(rss_url)
-    if feed.bozo:
-        logger.info(f"Error reading RSS for image: {rss_url}")
-        return None
-
+# Function for getting image from parsed RSS feed
+def get_podcast_image(feed):
     if 'image' in feed.feed and 'url' in feed.feed.image:
         return feed.feed.image.url
+    elif 'image' in feed.feed and 'href' in feed.feed.image:
+        return feed.feed.image.href
     elif hasattr(feed.feed, 'logo'):
         return feed.feed.logo
     return None
@@ -361,30 +2083,43 @@ def add_podcast():
         logger.error("User is not registered in the system.")
         return jsonify({"error": "Uporabnik ni registriran v sistemu."}), 401
 
-    conn = get_db_connection()
-    obstojece = conn.execute("SELECT * FROM Podcasts WHERE rss_url = ? AND user_id = ?", 
-                          (rss_url, user['id'])).fetchone()
-
-    if obstojece:
-        logger.info(f"Podcast already exists for user {user['username']} (RSS URL: {rss_url}).")
-        return jsonify({"error": "Podcast že obstaja pri tem uporabniku."}), 400
+    feed_key = normalize_feed_url(rss_url)
+    with get_db_connection() as conn:
+        obstojece = conn.execute("""
+            SELECT p.* FROM Podcasts p
+            JOIN Feeds f ON p.feed_id = f.id
+            WHERE f.feed_key = ? AND p.user_id = ?
+        """, (feed_key, user['id'])).fetchone()
 
-    description = get_podcast_description(rss_url)
-    image_url = get_podcast_image(rss_url)
+        if obstojece:
+            logger.info(f"Podcast already exists for user {user['username']} (RSS URL: {rss_url}).")
+            return jsonify({"error": "Podcast že obstaja pri tem uporabniku."}), 400
 
     logger.info(f"Adding podcast: {naslov}, RSS URL: {rss_url}, is_public: {is_public}, user: {user['username']}")
 
-    conn.execute(
-        """
-        INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, image_url, description, user_id, is_public)
-        VALUES (?, ?, datetime('now'), ?, ?, ?, ?)
-        """,
-        (naslov, rss_url, image_url, description, user['id'], is_public)
-    )
-    conn.commit()
-    conn.close()
+    def add_subscription(conn):
+        # Subscriptions to the same feed share its metadata and episodes
+        feed = conn.execute("SELECT id FROM Feeds WHERE feed_key = ?", (feed_key,)).fetchone()
+        if feed:
+            feed_id = feed['id']
+        else:
+            feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES (?, ?)", (feed_key, rss_url)).lastrowid
+
+        # Feed metadata and episodes are filled in by the import job
+        cursor = conn.execute(
+            """
+            INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, is_public, feed_id)
+            VALUES (?, ?, datetime('now'), ?, ?, ?)
+            """,
+            (naslov, rss_url, user['id'], is_public, feed_id)
+        )
+        return cursor.lastrowid
+
+    podcast_id = run_write(add_subscription)
+
+    job_id, _ = submit_job('import_podcast', f"import_podcast:{podcast_id}", {'podcast_id': podcast_id}, user['id'])
     logger.info(f"Podcast {naslov} successfully added for user {user['username']}.")
-    return jsonify({"message": "Podcast dodan uspešno."}), 201
+    return jsonify({"message": "Podcast dodan uspešno.", "podcast_id": podcast_id, "job_id": job_id}), 202
 
 # API for checking podcast usage before deletion
 @app.route('/api/podcasts/<int:podcast_id>/check_usage', methods=['GET'])
@@ -433,10 +2168,10 @@ def check_podcast_usage(podcast_id):
                     END) as hidden_with_history
                 FROM Users u
                 LEFT JOIN PodcastVisibilityPreferences pvp ON u.id = pvp.user_id AND pvp.podcast_id = ?
-                LEFT JOIN Episodes e ON e.podcast_id = ?
+                LEFT JOIN Episodes e ON e.feed_id = ?
                 LEFT JOIN EpisodeListenStatus els ON els.episode_id = e.id AND els.user_id = u.id
                 WHERE u.id != ?
-            """, (podcast_id, podcast_id, user['id'])).fetchone()
+            """, (podcast_id, podcast['feed_id'], user['id'])).fetchone()
             
             visible_users = usage_check['visible_users'] or 0
             hidden_with_history = usage_check['hidden_with_history'] or 0
@@ -468,28 +2203,63 @@ def check_podcast_usage(podcast_id):
 # API for deleting podcast
 @app.route('/api/podcasts/<int:podcast_id>', methods=['DELETE'])
 def delete_podcast(podcast_id):
-    with get_db_connection() as conn:
+    def delete_subscription(conn):
+        """Returns (deleted, feed_id) - feed_id is set when the feed lost its last subscription"""
         podcast = conn.execute("SELECT * FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone()
         if not podcast:
-            return jsonify({"error": "Podcast ne obstaja."}), 404
+            return False, None
 
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.execute("DELETE FROM Episodes WHERE podcast_id = ?", (podcast_id,))
         conn.execute("DELETE FROM Podcasts WHERE id = ?", (podcast_id,))
-        conn.commit()
-    return jsonify({"message": "Podcast in njegove epizode so uspešno izbrisane."}), 200
+        # Episodes are shared - remove the feed only with its last subscription
+        if conn.execute("SELECT 1 FROM Podcasts WHERE feed_id = ?", (podcast['feed_id'],)).fetchone():
+            return True, None
+        # Free the key, so the feed can be added again while its episodes are being deleted
+        conn.execute("UPDATE Feeds SET feed_key = 'deleted:' || id WHERE id = ?", (podcast['feed_id'],))
+        return True, podcast['feed_id']
+
+    deleted, feed_id = run_write(delete_subscription)
+    if not deleted:
+        return jsonify({"error": "Podcast ne obstaja."}), 404
+    if feed_id is None:
+        return jsonify({"message": "Podcast in njegove epizode so uspešno izbrisane."}), 200
+
+    # The podcast is gone at once; its episodes are deleted in the background
+    user = get_user_from_db(get_current_user())
+    job_id, _ = submit_job('delete_feed', f"delete_feed:{feed_id}", {'feed_id': feed_id},
+                           user['id'] if user else None)
+    return jsonify({"message": "Podcast je izbrisan, njegove epizode se brišejo v ozadju.", "job_id": job_id}), 202
 
 # API for updating all podcasts
 @app.route('/api/podcasts/update_all', methods=['POST'])
 def update_all_podcasts():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    data = request.get_json(silent=True) or {}
+    user = get_user_from_db(get_current_user())
+    # full_scan re-reads whole feeds instead of stopping at known episodes (backfill)
+    full_scan = bool(data.get('full_scan'))
+    job_id, created = submit_job('update_all', f"update_all:{int(full_scan)}", {'full_scan': full_scan},
+                                 user['id'] if user else None)
+    return jsonify({
+        "message": "Posodabljanje podcastov se je začelo." if created else "Posodabljanje podcastov že poteka.",
+        "job_id": job_id
+    }), 202
+
+# API for refreshing a single podcast now
+@app.route('/api/podcasts/<int:podcast_id>/refresh', methods=['POST'])
+def refresh_podcast_now(podcast_id):
+    username = get_current_user()
+    user = get_user_from_db(username)
+
+    if not user:
+        return jsonify({"error": "User is not registered in the system."}), 401
+
     with get_db_connection() as conn:
-        podcasts = conn.execute("SELECT * FROM Podcasts").fetchall()
-        for podcast in podcasts:
-            update_episodes(podcast['id'], podcast['rss_url'])
-        conn.execute("UPDATE Podcasts SET datum_naročnine = ?", (now,))
-        conn.commit()
-    return jsonify({"message": "Vsi podcasti so bili posodobljeni."}), 200
+        podcast = conn.execute("SELECT id, feed_id FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone()
+    if not podcast:
+        return jsonify({"error": "Podcast ne obstaja."}), 404
+
+    request_feed_refresh(podcast['feed_id'])
+    logger.info(f"User {user['username']} requested refresh of podcast {podcast_id}")
+    return jsonify({"message": "Osvežitev podcasta je v vrsti."}), 202
 
 # Add functionality for marking episodes as listened
 @app.route('/api/episodes/mark_listened/<int:episode_id>', methods=['POST'])
@@ -524,29 +2294,8 @@ def mark_episode_listened(episode_id):
         else:
             target_user_id = user['id']
         
-        # Check if listening record already exists for this user
-        listen_status = conn.execute("""
-            SELECT * FROM EpisodeListenStatus
-            WHERE episode_id = ? AND user_id = ?
-        """, (episode_id, target_user_id)).fetchone()
-        
-        if listen_status:
-            # Update existing record
-            conn.execute("""
-                UPDATE EpisodeListenStatus
-                SET poslušano = 1, timestamp = datetime('now')
-                WHERE episode_id = ? AND user_id = ?
-            """, (episode_id, target_user_id))
-        else:
-            # Create new record
-            conn.execute("""
-                INSERT INTO EpisodeListenStatus (episode_id, user_id, poslušano)
-                VALUES (?, ?, 1)
-            """, (episode_id, target_user_id))
-        
-        conn.commit()
-        
-        logger.info(f"User {username} marked episode {episode_id} as listened for user {target_user_id}")
+    run_write(set_episode_listened, episode_id, target_user_id)
+    logger.info(f"User {username} marked episode {episode_id} as listened for user {target_user_id}")
     
     return jsonify({"message": "Epizoda označena kot poslušana."}), 200
 
@@ -570,23 +2319,30 @@ def get_episodes(podcast_id):
         episodes = conn.execute("""
             SELECT 
                 e.*,
+                p.id as podcast_id,
                 COALESCE(els.poslušano, 0) as poslušano,
                 COALESCE(epp.position, 0) as playback_position,
                 epp.timestamp as playback_timestamp
-            FROM Episodes e
+            FROM Podcasts p
+            JOIN Episodes e ON e.feed_id = p.feed_id
             LEFT JOIN EpisodeListenStatus els ON e.id = els.episode_id AND els.user_id = ?
             LEFT JOIN EpisodePlaybackPosition epp ON e.id = epp.episode_id AND epp.user_id = ?
-            WHERE e.podcast_id = ? AND e.izbrisano IS NOT 1
-            ORDER BY datetime(e.datum_izdaje) DESC
+            WHERE p.id = ? AND e.izbrisano IS NOT 1
+            AND NOT EXISTS (SELECT 1 FROM DeletedEpisodes de WHERE de.podcast_id = p.id AND de.episode_id = e.id)
+            ORDER BY e.pub_epoch DESC, e.id DESC
         """, (check_user_id, check_user_id, podcast_id)).fetchall()
     
     if not episodes:
         return jsonify([])  # Return empty list instead of error
     
     # Convert results to list of dictionaries and add playback information
+    pending_positions = get_pending_positions(check_user_id)
     result = []
     for episode in episodes:
         episode_dict = dict(episode)
+        # A position that is not written yet takes precedence
+        if episode_dict['id'] in pending_positions:
+            episode_dict['playback_position'], episode_dict['playback_timestamp'] = pending_positions[episode_dict['id']]
         # Add formatted playback time (for easier display in user interface)
         if episode_dict['playback_position'] > 0:
             minutes = episode_dict['playback_position'] // 60
@@ -610,114 +2366,701 @@ def delete_episode(episode_id):
         if not user:
             return jsonify({"error": "User is not registered in the system."}), 401
         
+        # Podcast to delete the episode from; by default the user's own subscription of its feed
+        podcast_id = request.args.get('podcast_id', type=int)
+
         with get_db_connection() as conn:
-            # Check if episode exists and get podcast data
-            episode = conn.execute("""
-                SELECT e.*, p.user_id as podcast_owner_id
-                FROM Episodes e
-                JOIN Podcasts p ON e.podcast_id = p.id
-                WHERE e.id = ?
-            """, (episode_id,)).fetchone()
+            episode = conn.execute("SELECT id, feed_id FROM Episodes WHERE id = ?", (episode_id,)).fetchone()
             
             if not episode:
                 return jsonify({"error": "Epizoda ne obstaja."}), 404
+
+            if podcast_id:
+                podcast = conn.execute("SELECT id, user_id FROM Podcasts WHERE id = ? AND feed_id = ?",
+                                       (podcast_id, episode['feed_id'])).fetchone()
+                if not podcast:
+                    return jsonify({"error": "Podcast ne obstaja."}), 404
+            else:
+                podcast = conn.execute("SELECT id, user_id FROM Podcasts WHERE feed_id = ? AND user_id = ?",
+                                       (episode['feed_id'], user['id'])).fetchone()
+                if not podcast and user['is_admin']:
+                    return jsonify({"error": "Manjka parameter 'podcast_id'."}), 400
             
             # Check if user has permission to delete episode
             # Podcast owner or admin has permission
-            if episode['podcast_owner_id'] != user['id'] and not user['is_admin']:
+            if not podcast or (podcast['user_id'] != user['id'] and not user['is_admin']):
                 return jsonify({"error": "Nimate pravice brisati te epizode."}), 403
             
-            # Mark episode as deleted (soft delete)
-            conn.execute("""
-                UPDATE Episodes 
-                SET izbrisano = 1 
-                WHERE id = ?
-            """, (episode_id,))
-            
-            # Also delete related listening and playback position data
-            conn.execute("DELETE FROM EpisodeListenStatus WHERE episode_id = ?", (episode_id,))
-            conn.execute("DELETE FROM EpisodePlaybackPosition WHERE episode_id = ?", (episode_id,))
-            
-            conn.commit()
-            
-        logger.info(f"User {user['username']} deleted episode {episode_id}")
+        run_write(delete_subscription_episode, podcast['id'], podcast['user_id'], episode_id)
+        with pending_positions_lock:
+            PENDING_POSITIONS.pop((episode_id, podcast['user_id']), None)
+        logger.info(f"User {user['username']} deleted episode {episode_id} from podcast {podcast['id']}")
         return jsonify({"message": "Epizoda uspešno izbrisana."}), 200
         
     except Exception as e:
         logger.error(f"Error deleting episode: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Function for deleting an episode from one subscription
+def delete_subscription_episode(conn, podcast_id, owner_id, episode_id):
+    """
+    The shared episode stays for the other subscriptions of its feed; only the listening
+    data of the subscription's owner is deleted with it
+    """
+    if not conn.execute("INSERT OR IGNORE INTO DeletedEpisodes (podcast_id, episode_id) VALUES (?, ?)",
+                        (podcast_id, episode_id)).rowcount:
+        return
+    conn.execute("UPDATE Podcasts SET deleted_count = deleted_count + 1 WHERE id = ?", (podcast_id,))
+    # Users who listened to the episode have it among the listened ones of the subscription
+    conn.execute("""
+        INSERT INTO DeletedListenedCounts (user_id, podcast_id, listened)
+        SELECT user_id, ?, 1 FROM EpisodeListenStatus WHERE episode_id = ? AND poslušano = 1
+        ON CONFLICT(user_id, podcast_id) DO UPDATE SET listened = listened + 1
+    """, (podcast_id, episode_id))
+
+    listened = conn.execute("""
+        DELETE FROM EpisodeListenStatus WHERE episode_id = ? AND user_id = ? AND poslušano = 1
+    """, (episode_id, owner_id)).rowcount
+    conn.execute("DELETE FROM EpisodeListenStatus WHERE episode_id = ? AND user_id = ?", (episode_id, owner_id))
+    if listened:
+        conn.execute("""
+            UPDATE ListenedCounts SET listened = listened - 1
+            WHERE user_id = ? AND feed_id = (SELECT feed_id FROM Episodes WHERE id = ? AND izbrisano IS NOT 1)
+        """, (owner_id, episode_id))
+        count_deleted_listened(conn, episode_id, owner_id, -1)
+    conn.execute("DELETE FROM EpisodePlaybackPosition WHERE episode_id = ? AND user_id = ?", (episode_id, owner_id))
+
+# Function for removing an episode from its feed for every subscription (soft delete)
+def soft_delete_episode(conn, episode_id):
+    """
+    Used by retention. The row stays with izbrisano = 1, so the episode is not imported
+    again; deletes of single subscriptions are replaced by it.
+    """
+    episode = conn.execute("SELECT feed_id, izbrisano FROM Episodes WHERE id = ?", (episode_id,)).fetchone()
+    if not episode:
+        return
+    # The counters of subscriptions that deleted the episode lose it together with its listens
+    conn.execute("""
+        UPDATE DeletedListenedCounts SET listened = listened - 1
+        WHERE (user_id, podcast_id) IN (
+            SELECT els.user_id, de.podcast_id FROM DeletedEpisodes de
+            JOIN EpisodeListenStatus els ON els.episode_id = de.episode_id
+            WHERE de.episode_id = ? AND els.poslušano = 1
+        )
+    """, (episode_id,))
+    conn.execute("""
+        UPDATE Podcasts SET deleted_count = deleted_count - 1
+        WHERE id IN (SELECT podcast_id FROM DeletedEpisodes WHERE episode_id = ?)
+    """, (episode_id,))
+    conn.execute("DELETE FROM DeletedEpisodes WHERE episode_id = ?", (episode_id,))
+    conn.execute("""
+        UPDATE Episodes 
+        SET izbrisano = 1 
+        WHERE id = ?
+    """, (episode_id,))
+
+    refresh_latest_episodes(conn, [episode['feed_id']])
+    if not episode['izbrisano']:
+        conn.execute("UPDATE Feeds SET episode_count = episode_count - 1 WHERE id = ?", (episode['feed_id'],))
+        conn.execute("""
+            UPDATE ListenedCounts SET listened = listened - 1
+            WHERE feed_id = ? AND user_id IN (
+                SELECT user_id FROM EpisodeListenStatus WHERE episode_id = ? AND poslušano = 1
+            )
+        """, (episode['feed_id'], episode_id))
+
+    # Also delete related listening and playback position data
+    conn.execute("DELETE FROM EpisodeListenStatus WHERE episode_id = ?", (episode_id,))
+    conn.execute("DELETE FROM EpisodePlaybackPosition WHERE episode_id = ?", (episode_id,))
+
+# Function for deleting episodes of a feed that its podcasts no longer keep
+def remove_expired_episodes(conn, feed_id, limit):
+    """
+    A feed shared by several podcasts keeps every episode that one of them keeps.
+    Episodes with a saved or pending playback position and tracked episodes are never removed.
+    Returns the number of deleted episodes, at most limit.
+    """
+    policy = conn.execute("""
+        SELECT COUNT(*) AS podcasts, MAX(keep_episodes) AS keep_episodes, MAX(keep_days) AS keep_days,
+            SUM(keep_episodes IS NULL AND keep_days IS NULL) AS keep_all
+        FROM Podcasts
+        WHERE feed_id = ?
+    """, (feed_id,)).fetchone()
+    if not policy['podcasts'] or policy['keep_all']:
+        return 0
+
+    cutoff = int(time.time()) - policy['keep_days'] * 86400 if policy['keep_days'] is not None else None
+    with pending_positions_lock:
+        pending = sorted({episode_id for episode_id, _ in PENDING_POSITIONS})
+    expired = conn.execute("""
+        SELECT e.id FROM (
+            SELECT id, pub_epoch, ROW_NUMBER() OVER (ORDER BY pub_epoch DESC, id DESC) AS rn
+            FROM Episodes
+            WHERE feed_id = :feed_id AND izbrisano IS NOT 1
+        ) e
+        WHERE (:keep_episodes IS NULL OR e.rn > :keep_episodes)
+        AND (:cutoff IS NULL OR e.pub_epoch < :cutoff)
+        AND NOT EXISTS (SELECT 1 FROM EpisodePlaybackPosition pp WHERE pp.episode_id = e.id AND pp.position > 0)
+        AND NOT EXISTS (SELECT 1 FROM ActiveTrackingSessions ats WHERE ats.episode_id = e.id)
+        AND e.id NOT IN (SELECT value FROM json_each(:pending))
+        LIMIT :limit
+    """, {'feed_id': feed_id, 'keep_episodes': policy['keep_episodes'], 'cutoff': cutoff,
+          'pending': json.dumps(pending), 'limit': limit}).fetchall()
+    for episode in expired:
+        soft_delete_episode(conn, episode['id'])
+    return len(expired)
+
+# Function for deleting some episodes of a feed together with their dependent rows
+def delete_feed_episodes(conn, feed_id, limit):
+    """Returns the number of deleted episodes, at most limit"""
+    episode_ids = json.dumps([row['id'] for row in conn.execute(
+        "SELECT id FROM Episodes WHERE feed_id = ? LIMIT ?", (feed_id, limit))])
+    for table in ('LatestEpisodes', 'DeletedEpisodes', 'EpisodeListenStatus', 'EpisodePlaybackPosition',
+                  'ActiveTrackingSessions'):
+        conn.execute(f"DELETE FROM {table} WHERE episode_id IN (SELECT value FROM json_each(?))", (episode_ids,))
+    cursor = conn.execute("DELETE FROM Episodes WHERE id IN (SELECT value FROM json_each(?))", (episode_ids,))
+    return cursor.rowcount
+
+# Function for reducing deleted episodes to what stops them from being imported again
+def purge_deleted_episodes(conn, first_id, last_id):
+    """
+    Deleted episodes with IDs between first_id and last_id keep only feed, GUID, title,
+    URL and date for the duplicate checks of imports. The rows are deleted and inserted
+    again without the description: an UPDATE would leave their pages mostly empty instead
+    of freeing them for vacuum_free_pages. Listening data left over from before
+    soft_delete_episode deleted it is removed too.
+
+    Episodes that every subscription of their feed has deleted lose their description
+    with an UPDATE: their rows are still referenced by DeletedEpisodes and LatestEpisodes,
+    which would lose them by cascade. The description hash stays, so refreshes do not
+    write the same description again.
+    """
+    deleted = conn.execute("""
+        SELECT id, feed_id, guid, naslov, datum_izdaje, pub_epoch, url, izbrisano
+        FROM Episodes
+        WHERE id BETWEEN ? AND ? AND izbrisano = 1 AND (opis IS NOT NULL OR opis_hash IS NOT NULL)
+    """, (first_id, last_id)).fetchall()
+    conn.execute("""
+        DELETE FROM EpisodeListenStatus
+        WHERE episode_id IN (SELECT id FROM Episodes WHERE id BETWEEN ? AND ? AND izbrisano = 1)
+    """, (first_id, last_id))
+    conn.execute("""
+        DELETE FROM EpisodePlaybackPosition
+        WHERE episode_id IN (SELECT id FROM Episodes WHERE id BETWEEN ? AND ? AND izbrisano = 1)
+    """, (first_id, last_id))
+    conn.executemany("DELETE FROM Episodes WHERE id = ?", [(episode['id'],) for episode in deleted])
+    conn.executemany("""
+        INSERT INTO Episodes (id, feed_id, guid, naslov, datum_izdaje, pub_epoch, url, izbrisano)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [tuple(episode) for episode in deleted])
+    stripped = conn.execute("""
+        UPDATE Episodes SET opis = NULL
+        WHERE id IN (
+            SELECT e.id FROM Episodes e
+            WHERE e.id BETWEEN ? AND ? AND e.izbrisano IS NOT 1 AND e.opis IS NOT NULL
+            AND EXISTS (SELECT 1 FROM DeletedEpisodes de WHERE de.episode_id = e.id)
+            AND NOT EXISTS (
+                SELECT 1 FROM Podcasts p
+                WHERE p.feed_id = e.feed_id
+                AND NOT EXISTS (SELECT 1 FROM DeletedEpisodes de WHERE de.podcast_id = p.id AND de.episode_id = e.id)
+            )
+        )
+    """, (first_id, last_id)).rowcount
+    return len(deleted) + stripped
+
+# Function for deleting finished jobs older than JOBS_KEEP_DAYS
+def prune_finished_jobs(conn):
+    """
+    The last maintenance job is kept, maintenance_loop reads its time. Parameters of the
+    jobs that are kept are cleared, for jobs finished before run_job cleared them.
+    """
+    pruned = conn.execute("""
+        DELETE FROM Jobs
+        WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?)
+        AND id IS NOT (SELECT MAX(id) FROM Jobs WHERE dedupe_key = 'maintenance' AND status = 'done')
+    """, (f"-{JOBS_KEEP_DAYS} days",)).rowcount
+    conn.execute("UPDATE Jobs SET params = NULL WHERE status IN ('done', 'failed') AND params IS NOT NULL")
+    return pruned
+
+# Function for returning free pages of the database file to the file system
+def vacuum_free_pages(conn, pages):
+    """
+    Needs auto_vacuum = INCREMENTAL. sqlite3 steps a PRAGMA only once and every step
+    of incremental_vacuum frees one page, so it runs once per page.
+    """
+    free = min(pages, conn.execute("PRAGMA freelist_count").fetchone()[0])
+    for _ in range(free):
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return free
+
 # Function for updating episodes from RSS feed
-def update_episodes(podcast_id, rss_url):
-    logger.info(f"Updating podcast ID {podcast_id} from source {rss_url}")
-    feed = feedparser.parse(rss_url)
-    if feed.bozo:
-        logger.info(f"Error reading RSS: {rss_url}")
+def update_episodes(feed_id, rss_url, feed_data=None):
+    logger.info(f"Updating feed ID {feed_id} from source {rss_url}")
+    if feed_data is None:
+        feed_data = fetch_podcast_feed(rss_url)
+    if not feed_data:
         return
 
-    with get_db_connection() as conn:
-        # Get podcast image URL and description and update
-        image_url = get_podcast_image(rss_url)
-        description = get_podcast_description(rss_url)
-        if image_url or description:
-            if image_url and description:
-                conn.execute("UPDATE Podcasts SET image_url = ?, description = ? WHERE id = ?", (image_url, description, podcast_id))
-            elif image_url:
-                conn.execute("UPDATE Podcasts SET image_url = ? WHERE id = ?", (image_url, podcast_id))
-            elif description:
-                conn.execute("UPDATE Podcasts SET description = ? WHERE id = ?", (description, podcast_id))
-
-        for entry in feed.entries:
-            naslov = entry.title
-            datum_izdaje = entry.published if hasattr(entry, 'published') else datetime.now().isoformat()
-            # Date formatting
+    rows = []
+    for entry in feed_data['entries']:
+        naslov = entry['naslov']
+        pub_epoch = parse_publish_date(entry.get('published_parsed') or entry['published'])
+        if pub_epoch is None:
+            logger.warning(f"Unknown publish date '{entry['published']}' for episode: {naslov}")
+            pub_epoch = int(time.time())
+        datum_izdaje_iso = format_publish_date(pub_epoch)
+
+        url = entry['url']
+        if not url:
+            logger.info(f"Missing URL for episode: {naslov}")
+            continue
+
+        opis = entry['opis'] or ""
+        opis_hash = hashlib.sha256(opis.encode('utf-8')).hexdigest() if opis else None
+        rows.append((feed_id, get_episode_guid(entry), naslov, datum_izdaje_iso, pub_epoch, url, opis, opis_hash))
+
+    # The whole feed is stored by one queued write, in a single transaction
+    def store_episodes(conn):
+
+        # Update feed image URL and description only when they changed
+        image_url = feed_data['image_url']
+        description = feed_data['description']
+        feed = conn.execute("SELECT image_url, description FROM Feeds WHERE id = ?", (feed_id,)).fetchone()
+        if feed:
+            new_image_url = image_url or feed['image_url']
+            new_description = description or feed['description']
+            if new_image_url != feed['image_url'] or new_description != feed['description']:
+                conn.execute("UPDATE Feeds SET image_url = ?, description = ? WHERE id = ?",
+                             (new_image_url, new_description, feed_id))
+
+        known_guids = {row['guid'] for row in conn.execute(
+            "SELECT guid FROM Episodes WHERE feed_id = ? AND guid IS NOT NULL", (feed_id,))}
+
+        # Episodes stored before GUIDs were known are identified by their URL - give them the feed GUID
+        adopt = [(guid, feed_id, url) for (_, guid, _, _, _, url, _, _) in rows if guid not in known_guids and guid != url]
+        if adopt:
+            conn.executemany("UPDATE OR IGNORE Episodes SET guid = ? WHERE feed_id = ? AND guid = ?", adopt)
+            known_guids = {row['guid'] for row in conn.execute(
+                "SELECT guid FROM Episodes WHERE feed_id = ? AND guid IS NOT NULL", (feed_id,))}
+
+        # Insert new episodes and update title, URL and changed descriptions of existing ones.
+        # Deleted episodes keep izbrisano = 1, so they are neither imported nor updated again.
+        conn.executemany("""
+            INSERT INTO Episodes (feed_id, guid, naslov, datum_izdaje, pub_epoch, url, opis, opis_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(feed_id, guid) DO UPDATE SET
+                naslov = excluded.naslov,
+                url = excluded.url,
+                opis = CASE WHEN excluded.opis_hash IS NULL THEN Episodes.opis ELSE excluded.opis END,
+                opis_hash = COALESCE(excluded.opis_hash, Episodes.opis_hash)
+            WHERE Episodes.izbrisano IS NOT 1 AND (
+                Episodes.naslov IS NOT excluded.naslov
+                OR Episodes.url IS NOT excluded.url
+                OR (excluded.opis_hash IS NOT NULL AND Episodes.opis_hash IS NOT excluded.opis_hash)
+            )
+        """, rows)
+        added = len({row[1] for row in rows} - known_guids)
+        refresh_latest_episodes(conn, [feed_id])
+        if added:
+            conn.execute("UPDATE Feeds SET episode_count = episode_count + ? WHERE id = ?", (added, feed_id))
+
+        # Remember validators so the next refresh can skip an unchanged feed
+        conn.execute(
+            "UPDATE Feeds SET etag = ?, last_modified = ?, content_hash = ?, feed_ttl = ? WHERE id = ?",
+            (feed_data['etag'], feed_data['last_modified'], feed_data['content_hash'], feed_data['refresh_hint'], feed_id)
+        )
+        return added
+
+    added = run_bulk_write(store_episodes)
+    logger.info(f"Update for feed ID {feed_id} completed: {len(rows)} entries read, {added} new episodes")
+    return added
+
+# Function for getting the download limit of a feed's host
+def get_host_semaphore(rss_url):
+    host = (urlparse(rss_url).hostname or '').lower()
+    with host_semaphores_lock:
+        if host not in HOST_SEMAPHORES:
+            HOST_SEMAPHORES[host] = threading.BoundedSemaphore(REFRESH_PER_HOST)
+        return HOST_SEMAPHORES[host]
+
+# Function for normalizing a feed URL, so subscriptions to the same feed share one Feeds row
+def normalize_feed_url(rss_url):
+    """
+    Returns the key that identifies a feed regardless of how it was typed:
+    scheme, letter case of the host, default ports, fragment and trailing slash are ignored.
+    migrate_shared_feeds (migration 2) computes the same key in SQL for existing subscriptions.
+    """
+    parts = urlparse(rss_url.strip())
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/') or '/'
+    return f"{host}{path}" + (f"?{parts.query}" if parts.query else '')
+
+# Function for getting feeds that have at least one subscription, with the number of subscriptions
+def get_subscribed_feeds(conn, feed_ids=None):
+    query = """
+        SELECT f.*, COUNT(p.id) AS subscriptions
+        FROM Feeds f
+        JOIN Podcasts p ON p.feed_id = f.id
+    """
+    params = ()
+    if feed_ids is not None:
+        query += f" WHERE f.id IN ({','.join('?' for _ in feed_ids)})"
+        params = tuple(feed_ids)
+    return conn.execute(query + " GROUP BY f.id", params).fetchall()
+
+# Function for refreshing a feed with a single conditional download
+def refresh_feed(feed, full_scan=False):
+    """
+    Downloads and parses the feed once; its episodes are shared by every podcast
+    subscribed to it. Safe to call from several threads at once: downloads are
+    limited per host and database writes are serialized.
+
+    By default the feed is read only until the already known episodes start;
+    full_scan=True reads and parses the whole feed (backfill).
+
+    Returns:
+        tuple: (outcome, episodes_added), outcome is 'updated', 'not_modified', 'unchanged' or 'failed'
+    """
+    if full_scan:
+        # Backfill - download and parse everything, ignoring validators
+        validators = (None, None, None)
+        known_guids = None
+    else:
+        validators = (feed['etag'], feed['last_modified'], feed['content_hash'])
+        with get_db_connection() as conn:
+            known_guids = {row['guid'] for row in conn.execute("SELECT guid FROM Episodes WHERE feed_id = ? AND guid IS NOT NULL", (feed['id'],))}
+
+    with get_host_semaphore(feed['rss_url']):
+        feed_data = fetch_podcast_feed(feed['rss_url'], *validators, known_guids)
+    if not feed_data:
+        return 'failed', 0
+
+    if feed_data['status'] != 'ok':
+        logger.info(f"Feed {feed['rss_url']} has not changed ({feed_data['status']}), skipping.")
+        # Same body but new validators - remember them so the next request can be answered with 304
+        if (feed_data['etag'], feed_data['last_modified']) != (feed['etag'], feed['last_modified']):
+            execute_write("UPDATE Feeds SET etag = ?, last_modified = ? WHERE id = ?",
+                          (feed_data['etag'], feed_data['last_modified'], feed['id']))
+        return feed_data['status'], 0
+
+    added = update_episodes(feed['id'], feed['rss_url'], feed_data)
+    return 'updated', added
+
+# Function for ordering feeds so that consecutive downloads go to different hosts
+def interleave_by_host(feeds):
+    by_host = {}
+    for feed in feeds:
+        by_host.setdefault((urlparse(feed['rss_url']).hostname or '').lower(), []).append(feed)
+
+    host_feeds = list(by_host.values())
+    ordered = []
+    while host_feeds:
+        for feeds_of_host in host_feeds:
+            ordered.append(feeds_of_host.pop(0))
+        host_feeds = [feeds_of_host for feeds_of_host in host_feeds if feeds_of_host]
+    return ordered
+
+# Function for refreshing feeds in parallel
+def refresh_feeds(feeds, max_workers=None, full_scan=False, on_progress=None):
+    """
+    Refreshes the given feeds (rows from get_subscribed_feeds) with a pool of worker
+    threads and returns a report with the number of feeds per outcome and the number
+    of new episodes. Every feed is downloaded once for all of its subscriptions (fetches_saved).
+
+    on_progress(feed, outcome, episodes_added, error) is called after each feed.
+    """
+    report = {'updated': 0, 'not_modified': 0, 'unchanged': 0, 'failed': 0, 'failed_ids': [], 'episodes_added': 0}
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers or REFRESH_WORKERS) as executor:
+        futures = {executor.submit(refresh_feed, feed, full_scan): feed for feed in interleave_by_host(feeds)}
+        for future in as_completed(futures):
+            feed = futures[future]
+            error = None
             try:
-                parsed_date = datetime.strptime(datum_izdaje, "%a, %d %b %Y %H:%M:%S %z")
-                datum_izdaje_iso = parsed_date.strftime("%Y-%m-%d %H:%M:%S")
+                outcome, added = future.result()
             except Exception as e:
-                logger.error(f"Error formatting date: {e}")
-                datum_izdaje_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                logger.error(f"Napaka pri posodabljanju vira {feed['rss_url']}: {e}")
+                outcome, added, error = 'failed', 0, str(e)
+            report[outcome] += 1
+            report['episodes_added'] += added or 0
+            if outcome == 'failed':
+                report['failed_ids'].append(feed['id'])
+            if on_progress:
+                on_progress(feed, outcome, added or 0, error)
+
+    subscriptions = sum(feed['subscriptions'] for feed in feeds)
+    report['skipped'] = report['not_modified'] + report['unchanged']
+    report['feeds'] = len(feeds)
+    report['fetches_saved'] = subscriptions - len(feeds)
+    logger.info(
+        f"Refreshed {len(feeds)} feeds for {subscriptions} podcasts ({report['fetches_saved']} fetches saved) "
+        f"in {time.time() - started:.1f}s: {report['updated']} updated, "
+        f"{report['skipped']} skipped ({report['not_modified']} not modified, {report['unchanged']} unchanged), "
+        f"{report['failed']} failed."
+    )
+    return report
 
-            url = entry.enclosures[0].href if hasattr(entry, 'enclosures') and entry.enclosures else entry.link
-            if not url:
-                logger.info(f"Missing URL for episode: {naslov}")
-                continue
+# Function for creating a background job, or returning the same job if it is already waiting or running
+def submit_job(kind, dedupe_key, params=None, user_id=None):
+    """
+    Returns:
+        tuple: (job_id, created) - created is False when an identical job was coalesced
+    """
+    with jobs_lock, get_db_connection() as conn:
+        existing = conn.execute("""
+            SELECT id FROM Jobs
+            WHERE dedupe_key = ? AND status IN ('queued', 'running')
+            ORDER BY id LIMIT 1
+        """, (dedupe_key,)).fetchone()
+        if existing:
+            logger.info(f"Job {dedupe_key} is already in progress (job {existing['id']})")
+            return existing['id'], False
+
+        cursor = execute_write("""
+            INSERT INTO Jobs (kind, dedupe_key, params, status, user_id, created_at)
+            VALUES (?, ?, ?, 'queued', ?, datetime('now'))
+        """, (kind, dedupe_key, json.dumps(params or {}), user_id))
+        job_id = cursor.lastrowid
+
+    JOB_EXECUTOR.submit(run_job, job_id)
+    logger.info(f"Job {job_id} ({kind}) queued")
+    return job_id, True
+
+# Function for updating progress of a running job
+def update_job_progress(job_id, feeds_total=None, feeds_done=0, episodes_added=0, error=None,
+                        items_total=None, items_done=0):
+    def store_progress(conn):
+        if feeds_total is not None:
+            conn.execute("UPDATE Jobs SET feeds_total = ? WHERE id = ?", (feeds_total, job_id))
+        if items_total is not None:
+            conn.execute("UPDATE Jobs SET items_total = ? WHERE id = ?", (items_total, job_id))
+        if items_done:
+            conn.execute("UPDATE Jobs SET items_done = items_done + ? WHERE id = ?", (items_done, job_id))
+        if feeds_done or episodes_added:
+            conn.execute("""
+                UPDATE Jobs SET feeds_done = feeds_done + ?, episodes_added = episodes_added + ?
+                WHERE id = ?
+            """, (feeds_done, episodes_added, job_id))
+        if error:
+            conn.execute("UPDATE Jobs SET errors = json_insert(COALESCE(errors, '[]'), '$[#]', ?) WHERE id = ?",
+                         (error, job_id))
 
-            # Add check for episode description
-            opis = ""
-            if hasattr(entry, 'summary'):
-                opis = entry.summary
-            elif hasattr(entry, 'description'):
-                opis = entry.description
-
-            # Check if episode already exists and get its ID and current description
-            obstojece = conn.execute(
-                "SELECT id, opis FROM Episodes WHERE podcast_id = ? AND naslov = ? AND datum_izdaje = ? AND izbrisano IS NOT 1",
-                (podcast_id, naslov, datum_izdaje_iso)
-            ).fetchone()
-
-            if obstojece:
-                # Get current description from database
-                obstojeciOpis = obstojece['opis'] if obstojece['opis'] is not None else ""
-                # If new description is different and not empty, update record
-                if opis and opis != obstojeciOpis:
-                    conn.execute(
-                        "UPDATE Episodes SET opis = ? WHERE id = ?",
-                        (opis, obstojece['id'])
-                    )
-                    logger.info(f"Updated description for episode: {naslov}")
-                else:
-                    logger.info(f"Episode '{naslov}' already exists, description unchanged or missing in RSS.")
-                continue
+    run_write(store_progress)
 
-            logger.info(f"Adding new episode: {naslov}")
-            conn.execute(
-                "INSERT INTO Episodes (podcast_id, naslov, datum_izdaje, url, opis) VALUES (?, ?, ?, ?, ?)",
-                (podcast_id, naslov, datum_izdaje_iso, url, opis)
-            )
+# Function for running a background job in the job worker pool
+def run_job(job_id):
+    with get_db_connection() as conn:
+        job = conn.execute("SELECT * FROM Jobs WHERE id = ?", (job_id,)).fetchone()
+        if not job or job['status'] != 'queued':
+            return
+    execute_write("UPDATE Jobs SET status = 'running', started_at = datetime('now') WHERE id = ?", (job_id,))
 
-        conn.commit()
-    logger.info(f"Update for podcast ID {podcast_id} completed")
+    try:
+        result = JOB_HANDLERS[job['kind']](job_id, json.loads(job['params'] or '{}'))
+        status = 'done'
+    except Exception as e:
+        logger.error(f"Job {job_id} ({job['kind']}) failed: {e}", exc_info=True)
+        update_job_progress(job_id, error=str(e))
+        result = None
+        status = 'failed'
+
+    # The parameters are only needed to run the job; an import holds its whole episode list there
+    execute_write("""
+        UPDATE Jobs SET status = ?, result = ?, params = NULL, finished_at = datetime('now')
+        WHERE id = ?
+    """, (status, json.dumps(result) if result is not None else None, job_id))
+    logger.info(f"Job {job_id} ({job['kind']}) finished: {status}")
+
+# Function for converting a Jobs row to the API format
+def job_to_dict(job):
+    job_dict = dict(job)
+    del job_dict['params']
+    job_dict['errors'] = json.loads(job['errors']) if job['errors'] else []
+    job_dict['result'] = json.loads(job['result']) if job['result'] else None
+    return job_dict
+
+# Function for queueing jobs that were interrupted by a restart
+def resume_jobs():
+    with get_db_connection() as conn:
+        jobs = conn.execute("SELECT id FROM Jobs WHERE status IN ('queued', 'running') ORDER BY id").fetchall()
+    execute_write("UPDATE Jobs SET status = 'queued' WHERE status = 'running'")
+    for job in jobs:
+        JOB_EXECUTOR.submit(run_job, job['id'])
+    if jobs:
+        logger.info(f"Resumed {len(jobs)} interrupted jobs.")
+
+# Job: refresh all podcasts
+def run_update_all_job(job_id, params):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with get_db_connection() as conn:
+        feeds = get_subscribed_feeds(conn)
+    update_job_progress(job_id, feeds_total=len(feeds))
+
+    def on_progress(feed, outcome, episodes_added, error):
+        if outcome == 'failed':
+            error = f"{feed['rss_url']}: {error or 'feed could not be read'}"
+        update_job_progress(job_id, feeds_done=1, episodes_added=episodes_added, error=error)
+
+    report = refresh_feeds(feeds, full_scan=params.get('full_scan', False), on_progress=on_progress)
+    execute_write("UPDATE Podcasts SET datum_naročnine = ?", (now,))
+    return report
+
+# Job: delete a feed that lost its last subscription, in chunks
+def run_delete_feed_job(job_id, params):
+    feed_id = params['feed_id']
+    with get_db_connection() as conn:
+        episode_count = conn.execute("SELECT COUNT(*) FROM Episodes WHERE feed_id = ?", (feed_id,)).fetchone()[0]
+    update_job_progress(job_id, items_total=episode_count)
+
+    deleted = 0
+    while True:
+        count = run_bulk_write(delete_feed_episodes, feed_id, DELETE_CHUNK_SIZE)
+        deleted += count
+        update_job_progress(job_id, items_done=count)
+        if count < DELETE_CHUNK_SIZE:
+            break
+
+    # Counters of the feed go with it (ON DELETE CASCADE)
+    execute_write("DELETE FROM Feeds WHERE id = ?", (feed_id,))
+    logger.info(f"Deleted feed {feed_id} with {deleted} episodes")
+    return {'message': f"Deleted {deleted} episodes", 'episodes_deleted': deleted}
+
+# Job: episode retention, purge of deleted episodes and finished jobs, incremental vacuum
+def run_maintenance_job(job_id, params):
+    """params['feed_ids'] limits retention to the given feeds"""
+    with get_db_connection() as conn:
+        feed_ids = [row['feed_id'] for row in conn.execute("""
+            SELECT DISTINCT feed_id FROM Podcasts
+            WHERE keep_episodes IS NOT NULL OR keep_days IS NOT NULL
+        """)]
+        last_episode_id = conn.execute("SELECT MAX(id) FROM Episodes").fetchone()[0] or 0
+        incremental_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    if params.get('feed_ids') is not None:
+        feed_ids = [feed_id for feed_id in feed_ids if feed_id in params['feed_ids']]
+    update_job_progress(job_id, feeds_total=len(feed_ids))
+
+    # Every step is split into short queued writes, so other writes are not held up
+    removed = 0
+    for feed_id in feed_ids:
+        while True:
+            count = run_bulk_write(remove_expired_episodes, feed_id, MAINTENANCE_CHUNK_SIZE)
+            removed += count
+            if count < MAINTENANCE_CHUNK_SIZE:
+                break
+        update_job_progress(job_id, feeds_done=1)
+
+    jobs_pruned = run_bulk_write(prune_finished_jobs)
+
+    purged = 0
+    for first_id in range(1, last_episode_id + 1, MAINTENANCE_CHUNK_SIZE):
+        purged += run_bulk_write(purge_deleted_episodes, first_id, first_id + MAINTENANCE_CHUNK_SIZE - 1)
+
+    pages_freed = 0
+    if incremental_vacuum:
+        while True:
+            count = run_bulk_write(vacuum_free_pages, VACUUM_CHUNK_PAGES)
+            pages_freed += count
+            if count < VACUUM_CHUNK_PAGES:
+                break
+        if pages_freed:
+            # The file only shrinks when the freed pages are checkpointed from the WAL
+            with get_db_connection() as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    else:
+        logger.warning("Database is not in incremental auto-vacuum mode, free pages are kept.")
+
+    message = (f"Removed {removed} expired episodes, purged {purged} deleted episodes, "
+               f"pruned {jobs_pruned} finished jobs, freed {pages_freed} pages")
+    logger.info(message)
+    return {'message': message, 'episodes_removed': removed, 'episodes_purged': purged,
+            'jobs_pruned': jobs_pruned, 'pages_freed': pages_freed}
+
+# Function for queueing the maintenance job when it is due
+def maintenance_loop():
+    """The time of the last run is read from Jobs, so restarts do not postpone it"""
+    while True:
+        try:
+            with get_db_connection() as conn:
+                last_run = conn.execute("""
+                    SELECT CAST(strftime('%s', MAX(finished_at)) AS INTEGER) FROM Jobs
+                    WHERE dedupe_key = 'maintenance' AND status = 'done'
+                """).fetchone()[0] or 0
+            delay = last_run + MAINTENANCE_INTERVAL - time.time()
+            if delay <= 0:
+                submit_job('maintenance', 'maintenance')
+                delay = MAINTENANCE_INTERVAL
+            time.sleep(delay)
+        except Exception as e:
+            logger.error(f"Error in maintenance_loop: {e}")
+            time.sleep(300)
+
+def start_maintenance_thread():
+    global maintenance_thread
+    if MAINTENANCE_INTERVAL == 0 or (maintenance_thread and maintenance_thread.is_alive()):
+        return
+    maintenance_thread = threading.Thread(target=maintenance_loop, daemon=True, name='maintenance')
+    maintenance_thread.start()
+    logger.info(f"Database maintenance runs every {MAINTENANCE_INTERVAL // 3600} h")
+
+# API for getting status of a background job
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    with get_db_connection() as conn:
+        job = conn.execute("SELECT * FROM Jobs WHERE id = ?", (job_id,)).fetchone()
+    if not job:
+        return jsonify({"error": "Opravilo ne obstaja."}), 404
+    return jsonify(job_to_dict(job))
+
+# API for streaming progress of a background job (Server-Sent Events)
+@app.route('/api/jobs/<int:job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    with get_db_connection() as conn:
+        if not conn.execute("SELECT 1 FROM Jobs WHERE id = ?", (job_id,)).fetchone():
+            return jsonify({"error": "Opravilo ne obstaja."}), 404
+
+    # 204 stops EventSource from reconnecting, so the client falls back to polling
+    username = get_current_user()
+    if request.headers.get('Last-Event-ID') == 'timeout' or not open_job_event_stream(username):
+        return Response(status=204)
+
+    def events():
+        last = None
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while True:
+            with get_db_connection() as conn:
+                job = job_to_dict(conn.execute("SELECT * FROM Jobs WHERE id = ?", (job_id,)).fetchone())
+            if job != last:
+                yield f"data: {json.dumps(job)}\n\n"
+                last = job
+            if job['status'] in ('done', 'failed'):
+                return
+            if time.monotonic() >= deadline:
+                yield f"id: timeout\nevent: timeout\ndata: {json.dumps({'poll': f'/api/jobs/{job_id}'})}\n\n"
+                return
+            time.sleep(1)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: close_job_event_stream(username))
+    return response
+
+# Function for reserving one of the limited job event streams for a user
+def open_job_event_stream(username):
+    with job_event_streams_lock:
+        if (sum(JOB_EVENT_STREAMS.values()) >= JOB_EVENTS_MAX_STREAMS
+                or JOB_EVENT_STREAMS.get(username, 0) >= JOB_EVENTS_MAX_STREAMS_PER_USER):
+            return False
+        JOB_EVENT_STREAMS[username] = JOB_EVENT_STREAMS.get(username, 0) + 1
+        return True
+
+def close_job_event_stream(username):
+    with job_event_streams_lock:
+        JOB_EVENT_STREAMS[username] -= 1
+        if not JOB_EVENT_STREAMS[username]:
+            del JOB_EVENT_STREAMS[username]
 
 # Function for extracting all episodes from HTML archive of given URL
 def scrape_all_episodes_from_html_url(html_url):
@@ -762,68 +3105,214 @@ def add_missing_from_html_url(podcast_id):
     if not html_url:
         return jsonify({"error": "html_url je obvezen parameter."}), 400
 
-    episodes_data = scrape_all_episodes_from_html_url(html_url)
+    with get_db_connection() as conn:
+        if not conn.execute("SELECT 1 FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone():
+            return jsonify({"error": "Podcast ne obstaja."}), 404
+
+    user = get_user_from_db(get_current_user())
+    job_id, created = submit_job('import_html', f"import_html:{podcast_id}:{html_url}",
+                                 {'podcast_id': podcast_id, 'html_url': html_url}, user['id'] if user else None)
+    return jsonify({
+        "message": "Uvoz epizod iz HTML arhiva se je začel." if created else "Uvoz epizod iz HTML arhiva že poteka.",
+        "job_id": job_id
+    }), 202
+
+# Function for getting the feed a podcast subscribes to
+def get_podcast_feed_id(podcast_id):
+    with get_db_connection() as conn:
+        podcast = conn.execute("SELECT feed_id FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone()
+    if not podcast:
+        raise ValueError("Podcast ne obstaja več.")
+    return podcast['feed_id']
+
+# Job: first import of a newly added podcast (feed validation, metadata and all episodes)
+def run_import_podcast_job(job_id, params):
+    with get_db_connection() as conn:
+        podcast = conn.execute("SELECT * FROM Podcasts WHERE id = ?", (params['podcast_id'],)).fetchone()
+        if not podcast:
+            raise ValueError("Podcast ne obstaja več.")
+        feed = conn.execute("SELECT * FROM Feeds WHERE id = ?", (podcast['feed_id'],)).fetchone()
+        # A feed that another user already subscribes to only needs a regular refresh
+        is_new_feed = conn.execute("SELECT 1 FROM Episodes WHERE feed_id = ? LIMIT 1", (feed['id'],)).fetchone() is None
+    update_job_progress(job_id, feeds_total=1)
 
+    outcome, added = refresh_feed(feed, full_scan=is_new_feed)
     with get_db_connection() as conn:
+        settings = conn.execute("SELECT * FROM Settings LIMIT 1").fetchone()
+    schedule_feed_refresh(feed['id'], run_write(schedule_next_refresh, feed, settings, outcome == 'failed'))
+    if outcome == 'failed':
+        raise ValueError(f"RSS vira {feed['rss_url']} ni mogoče prebrati.")
+
+    update_job_progress(job_id, feeds_done=1, episodes_added=added)
+    return {"podcast_id": podcast['id'], "added_count": added}
+
+# Job: import missing episodes from an HTML archive
+def run_import_html_job(job_id, params):
+    feed_id = get_podcast_feed_id(params['podcast_id'])
+    update_job_progress(job_id, feeds_total=1)
+    episodes_data = scrape_all_episodes_from_html_url(params['html_url'])
+
+    def store_episodes(conn, chunk):
+        obstojece = {(row['naslov'], row['datum_izdaje']) for row in conn.execute(
+            "SELECT naslov, datum_izdaje FROM Episodes WHERE feed_id = ?", (feed_id,))}
         dodano = 0
-        for (naslov, datum_izdaje_iso, url) in episodes_data:
-            obstojece = conn.execute(
-                "SELECT 1 FROM Episodes WHERE podcast_id = ? AND naslov = ? AND datum_izdaje = ?",
-                (podcast_id, naslov, datum_izdaje_iso)
-            ).fetchone()
-            if obstojece:
+        for (naslov, datum_izdaje_iso, url) in chunk:
+            if (naslov, datum_izdaje_iso) in obstojece:
                 continue
 
-            conn.execute(
-                "INSERT INTO Episodes (podcast_id, naslov, datum_izdaje, url) VALUES (?, ?, ?, ?)",
-                (podcast_id, naslov, datum_izdaje_iso, url)
+            # Without a feed GUID the URL identifies the episode
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO Episodes (feed_id, guid, naslov, datum_izdaje, pub_epoch, url) VALUES (?, ?, ?, ?, ?, ?)",
+                (feed_id, url, naslov, datum_izdaje_iso, parse_publish_date(datum_izdaje_iso), url)
             )
-            dodano += 1
-        conn.commit()
-    return jsonify({"message": f"Dodano {dodano} manjkajočih epizod iz HTML arhiva."}), 200
+            if cursor.rowcount:
+                obstojece.add((naslov, datum_izdaje_iso))
+            dodano += cursor.rowcount
+        refresh_latest_episodes(conn, [feed_id])
+        conn.execute("UPDATE Feeds SET episode_count = episode_count + ? WHERE id = ?", (dodano, feed_id))
+        return dodano
+
+    dodano = 0
+    for start in range(0, len(episodes_data), IMPORT_CHUNK_SIZE):
+        dodano += run_bulk_write(store_episodes, episodes_data[start:start + IMPORT_CHUNK_SIZE])
+
+    update_job_progress(job_id, feeds_done=1, episodes_added=dodano)
+    return {"message": f"Dodano {dodano} manjkajočih epizod iz HTML arhiva.", "added_count": dodano}
+
+# Function for the catalogue entry of a media player state
+def get_media_player_entry(entity):
+    player = {
+        "entity_id": entity['entity_id'],
+        "state": entity.get('state', 'unknown'),
+        "attributes": entity.get('attributes', {})
+    }
+    if 'friendly_name' in entity.get('attributes', {}):
+        player["name"] = entity['attributes']['friendly_name']
+    else:
+        player["name"] = entity['entity_id'].replace('media_player.', '')
+    return player
+
+# Function for loading the media player catalogue from Home Assistant
+def load_media_players():
+    """Reads all states; afterwards events keep the catalogue fresh"""
+    global MEDIA_PLAYERS, media_players_loaded_at
+    supervisor_token = os.environ.get('SUPERVISOR_TOKEN')
+    if not supervisor_token:
+        raise Exception("No Supervisor token available")
+
+    headers = {
+        "Authorization": f"Bearer {supervisor_token}",
+        "Content-Type": "application/json",
+    }
+    response = HA_SESSION.get("http://supervisor/core/api/states", headers=headers, timeout=10)
+    if not response.ok:
+        logger.error(f"Error fetching states: {response.status_code} - {response.text}")
+        raise Exception("Failed to fetch media players")
+
+    players = {entity['entity_id']: get_media_player_entry(entity) for entity in response.json()
+               if isinstance(entity, dict) and entity.get('entity_id', '').startswith('media_player.')}
+    with media_players_lock:
+        MEDIA_PLAYERS = players
+        media_players_loaded_at = time.monotonic()
+    logger.info(f"Found {len(players)} media players")
+    update_media_player_subscriptions(sorted(players))
+
+# Function for following the states of the media players and changes of the entity registry
+def update_media_player_subscriptions(players):
+    """The change is made on the WebSocket thread; the caller does not wait for Home Assistant"""
+    try:
+        HA_WEBSOCKET.run(follow_media_players, players)
+    except Exception as e:
+        logger.error(f"Error following media players: {e}")
+
+async def follow_media_players(players):
+    global media_players_subscription, media_players_followed, media_players_registry_subscription
+    # Changes are made one at a time, in the order they were requested
+    async with HA_WEBSOCKET.changes_lock:
+        try:
+            if media_players_registry_subscription is None:
+                media_players_registry_subscription = await HA_WEBSOCKET.add_subscription({
+                    "type": "subscribe_events",
+                    "event_type": "entity_registry_updated"
+                }, handle_entity_registry_event, HA_WEBSOCKET_TIMEOUT)
+            if players == media_players_followed:
+                return
+
+            # subscribe_entities also reports changes of attributes only, e.g. volume or the playing media
+            subscription = None
+            if players:
+                subscription = await HA_WEBSOCKET.add_subscription({
+                    "type": "subscribe_entities",
+                    "entity_ids": players
+                }, handle_media_player_event, HA_WEBSOCKET_TIMEOUT)
+            if media_players_subscription is not None:
+                await HA_WEBSOCKET.remove_subscription(media_players_subscription)
+            media_players_subscription = subscription
+            media_players_followed = players
+        except Exception as e:
+            logger.error(f"Error following media players: {e}")
+
+def handle_media_player_event(event):
+    """
+    Runs on the WebSocket thread. The event holds compressed states: 'a' full states of
+    added players (and of all players after subscribing), 'c' changes as '+' new values
+    and '-' removed attributes, 'r' removed players.
+    """
+    with media_players_lock:
+        if MEDIA_PLAYERS is None:
+            return
+        for entity_id, state in event.get('a', {}).items():
+            MEDIA_PLAYERS[entity_id] = get_media_player_entry({
+                'entity_id': entity_id, 'state': state.get('s'), 'attributes': state.get('a', {})})
+        for entity_id, change in event.get('c', {}).items():
+            player = MEDIA_PLAYERS.get(entity_id)
+            if not player:
+                continue
+            attributes = dict(player['attributes'])
+            for name in change.get('-', {}).get('a', []):
+                attributes.pop(name, None)
+            attributes.update(change.get('+', {}).get('a', {}))
+            MEDIA_PLAYERS[entity_id] = get_media_player_entry({
+                'entity_id': entity_id, 'state': change.get('+', {}).get('s', player['state']), 'attributes': attributes})
+        for entity_id in event.get('r', []):
+            MEDIA_PLAYERS.pop(entity_id, None)
+
+def handle_entity_registry_event(event):
+    """Added, removed and renamed media players are read by the next load"""
+    global media_players_loaded_at
+    data = event.get('data', {})
+    if any(str(data.get(key, '')).startswith('media_player.') for key in ('entity_id', 'old_entity_id')):
+        with media_players_lock:
+            media_players_loaded_at = 0
+
+# Function for getting the media player catalogue
+def get_media_player_catalogue():
+    """
+    Returns {entity_id: player}. The catalogue is loaded again when it is older than the
+    TTL; when that fails, the previous catalogue is returned.
+    """
+    with media_players_load_lock:
+        following = HA_WEBSOCKET.is_subscribed(media_players_subscription)
+        ttl = MEDIA_PLAYERS_TTL if following else MEDIA_PLAYERS_TTL_WITHOUT_EVENTS
+        with media_players_lock:
+            fresh = media_players_loaded_at and time.monotonic() - media_players_loaded_at < ttl
+        if not fresh:
+            try:
+                load_media_players()
+            except Exception as e:
+                if MEDIA_PLAYERS is None:
+                    raise
+                logger.error(f"Error loading media players, using the previous list: {e}")
+        with media_players_lock:
+            return dict(MEDIA_PLAYERS)
 
 # New routes for media player support
 @app.route('/api/media_players/all', methods=['GET'])
 async def get_all_media_players():
     """Get list of all available media players"""
     try:
-        supervisor_token = os.environ.get('SUPERVISOR_TOKEN')
-        if not supervisor_token:
-            return jsonify({"error": "No Supervisor token available"}), 500
-
-        headers = {
-            "Authorization": f"Bearer {supervisor_token}",
-            "Content-Type": "application/json",
-        }
-
-        # Make request to Home Assistant API
-        response = requests.get(
-            "http://supervisor/core/api/states",
-            headers=headers,
-            timeout=10
-        )
-
-        if not response.ok:
-            logger.error(f"Error fetching states: {response.status_code} - {response.text}")
-            return jsonify({"error": "Failed to fetch media players"}), 500
-
-        states = response.json()
-        media_players = []
-        for entity in states:
-            if isinstance(entity, dict) and entity.get('entity_id', '').startswith('media_player.'):
-                player = {
-                    "entity_id": entity['entity_id'],
-                    "state": entity.get('state', 'unknown'),
-                    "attributes": entity.get('attributes', {})
-                }
-                if 'friendly_name' in entity.get('attributes', {}):
-                    player["name"] = entity['attributes']['friendly_name']
-                else:
-                    player["name"] = entity['entity_id'].replace('media_player.', '')
-                media_players.append(player)
-
-        logger.info(f"Found {len(media_players)} media players")
-        return jsonify({"players": media_players})
+        media_players = await asyncio.to_thread(get_media_player_catalogue)
+        return jsonify({"players": list(media_players.values())})
     except Exception as e:
         logger.error(f"Error in get_all_media_players: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -866,7 +3355,7 @@ def update_selected_media_players():
         if not isinstance(players, list):
             return jsonify({"error": "Invalid data format. Expected a list of players."}), 400
 
-        with get_db_connection() as conn:
+        def store_players(conn):
             # Clear existing selections
             conn.execute("DELETE FROM SelectedPlayers")
             # Insert new selections
@@ -878,7 +3367,8 @@ def update_selected_media_players():
                         "INSERT INTO SelectedPlayers (entity_id, display_name) VALUES (?, ?)",
                         (entity_id, display_name)
                     )
-            conn.commit()
+
+        run_write(store_players)
         return jsonify({"message": "Selected players updated successfully", "count": len(players)})
     except Exception as e:
         logger.error(f"Error in update_selected_media_players: {str(e)}")
@@ -896,6 +3386,15 @@ async def play_episode():
     if not all([player_entity_id, episode_url, episode_title]):
         return jsonify({"error": "Missing required parameters"}), 400
 
+    try:
+        media_players = await asyncio.to_thread(get_media_player_catalogue)
+    except Exception as e:
+        # Without a catalogue Home Assistant decides
+        logger.error(f"Error getting media players: {e}")
+        media_players = None
+    if media_players is not None and player_entity_id not in media_players:
+        return jsonify({"error": "Unknown media player"}), 400
+
     try:
         # Get current user for tracking
         username = get_current_user()
@@ -922,8 +3421,7 @@ async def play_episode():
                 "extra": {
                     "title": episode_title
                 }
-            },
-            "id": 2
+            }
         }
         await ha_websocket_call(play_command)
 
@@ -952,8 +3450,7 @@ async def play_episode():
                 "service_data": {
                     "entity_id": player_entity_id,
                     "seek_position": start_position
-                },
-                "id": 3
+                }
             }
             
             try:
@@ -972,76 +3469,95 @@ async def play_episode():
 
 @app.route('/api/podcasts/<int:podcast_id>/add_missing_episodes', methods=['POST'])
 def add_missing_episodes(podcast_id):
-    """Add missing episodes from an XML file"""
-    conn = None
-    logger.info(f"Starting to process episodes for podcast {podcast_id}")
-    
-    try:
-        with get_db_connection() as conn:
-            podcast = conn.execute("SELECT * FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone()
-            if not podcast:
-                return jsonify({"error": "Podcast not found"}), 404
-
-            data = request.json
-            if not data or 'episodes' not in data:
-                return jsonify({"error": "No episode data provided"}), 400
-
-            episodes = data['episodes']
-            added_count = 0
-            total_episodes = len(episodes)
-
-            for episode in episodes:
-                try:
-                    # Convert publication date to ISO format
-                    try:
-                        parsed_date = datetime.strptime(episode['datum_izdaje'], "%a, %d %b %Y %H:%M:%S %z")
-                        datum_izdaje_iso = parsed_date.strftime("%Y-%m-%d %H:%M:%S")
-                    except Exception as e:
-                        logger.error(f"Date parsing error: {e}")
-                        datum_izdaje_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                    # Check if episode already exists by title or URL
-                    existing = conn.execute("""
-                        SELECT 1 FROM Episodes 
-                        WHERE podcast_id = ? 
-                        AND (naslov = ? OR url = ?)
-                        AND izbrisano = 0
-                    """, (podcast_id, episode['naslov'], episode['url'])).fetchone()
-                    
-                    if existing:
-                        logger.info(f"Skipping duplicate episode: {episode['naslov']}")
-                        continue
+    """Queue import of missing episodes from an XML file"""
+    with get_db_connection() as conn:
+        podcast = conn.execute("SELECT * FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone()
+    if not podcast:
+        return jsonify({"error": "Podcast not found"}), 404
 
-                    conn.execute("""
-                        INSERT INTO Episodes (podcast_id, naslov, datum_izdaje, url)
-                        VALUES (?, ?, ?, ?)
-                    """, (podcast_id, episode['naslov'], datum_izdaje_iso, episode['url']))
-                    added_count += 1
-                except Exception as e:
-                    logger.error(f"Error processing episode {episode.get('naslov', 'unknown')}: {e}")
+    data = request.json
+    if not data or 'episodes' not in data:
+        return jsonify({"error": "No episode data provided"}), 400
+
+    # Identical uploads for the same podcast are coalesced into one job
+    payload_hash = hashlib.sha256(json.dumps(data['episodes'], sort_keys=True).encode('utf-8')).hexdigest()
+    user = get_user_from_db(get_current_user())
+    job_id, created = submit_job('import_xml', f"import_xml:{podcast_id}:{payload_hash}",
+                                 {'podcast_id': podcast_id, 'episodes': data['episodes']}, user['id'] if user else None)
+    logger.info(f"Queued processing of {len(data['episodes'])} episodes for podcast {podcast_id} (job {job_id})")
+    return jsonify({
+        "message": "Episode import started" if created else "Episode import is already in progress",
+        "job_id": job_id
+    }), 202
+
+# Job: import missing episodes from an uploaded XML file
+def run_import_xml_job(job_id, params):
+    feed_id = get_podcast_feed_id(params['podcast_id'])
+    episodes = params['episodes']
+    total_episodes = len(episodes)
+    update_job_progress(job_id, feeds_total=1)
+
+    errors = []
+
+    def store_episodes(conn, chunk):
+        # Titles and URLs of the feed's episodes, for skipping duplicates
+        known_titles, known_urls = set(), set()
+        for row in conn.execute("SELECT naslov, url FROM Episodes WHERE feed_id = ? AND izbrisano = 0", (feed_id,)):
+            known_titles.add(row['naslov'])
+            known_urls.add(row['url'])
+
+        added_count = 0
+        for episode in chunk:
+            try:
+                # Convert publication date to a timestamp and ISO format
+                pub_epoch = parse_publish_date(episode.get('datum_izdaje'))
+                if pub_epoch is None:
+                    logger.warning(f"Unknown publish date '{episode.get('datum_izdaje')}' for episode: {episode['naslov']}")
+                    pub_epoch = int(time.time())
+                datum_izdaje_iso = format_publish_date(pub_epoch)
+
+                # Check if episode already exists by title or URL
+                if episode['naslov'] in known_titles or episode['url'] in known_urls:
+                    logger.info(f"Skipping duplicate episode: {episode['naslov']}")
                     continue
 
-            # Count total episodes processed
-            skipped_count = total_episodes - added_count
-            
-            if added_count > 0:
-                conn.commit()
-                logger.info(f"Successfully added {added_count} episodes, skipped {skipped_count} duplicates")
-            
-            return jsonify({
-                "message": f"Successfully added {added_count} new episodes, skipped {skipped_count} duplicates",
-                "added_count": added_count,
-                "skipped_count": skipped_count,
-                "total_processed": total_episodes
-            }), 201
-    except Exception as e:
-        logger.error(f"Error in add_missing_episodes: {e}")
-        if conn:
-            try:
-                conn.rollback()
-            except Exception as rollback_error:
-                logger.error(f"Error during rollback: {rollback_error}")
-        return jsonify({"error": str(e)}), 500
+                # Without a feed GUID the URL identifies the episode
+                cursor = conn.execute("""
+                    INSERT OR IGNORE INTO Episodes (feed_id, guid, naslov, datum_izdaje, pub_epoch, url)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (feed_id, episode['url'], episode['naslov'], datum_izdaje_iso, pub_epoch, episode['url']))
+                if cursor.rowcount:
+                    known_titles.add(episode['naslov'])
+                    known_urls.add(episode['url'])
+                added_count += cursor.rowcount
+            except Exception as e:
+                logger.error(f"Error processing episode {episode.get('naslov', 'unknown')}: {e}")
+                errors.append(f"{episode.get('naslov', 'unknown')}: {e}")
+                continue
+
+        if added_count > 0:
+            refresh_latest_episodes(conn, [feed_id])
+            conn.execute("UPDATE Feeds SET episode_count = episode_count + ? WHERE id = ?", (added_count, feed_id))
+        return added_count
+
+    added_count = 0
+    for start in range(0, total_episodes, IMPORT_CHUNK_SIZE):
+        added_count += run_bulk_write(store_episodes, episodes[start:start + IMPORT_CHUNK_SIZE])
+    for error in errors:
+        update_job_progress(job_id, error=error)
+
+    # Count total episodes processed
+    skipped_count = total_episodes - added_count
+    if added_count > 0:
+        logger.info(f"Successfully added {added_count} episodes, skipped {skipped_count} duplicates")
+
+    update_job_progress(job_id, feeds_done=1, episodes_added=added_count)
+    return {
+        "message": f"Successfully added {added_count} new episodes, skipped {skipped_count} duplicates",
+        "added_count": added_count,
+        "skipped_count": skipped_count,
+        "total_processed": total_episodes
+    }
 
 # API for user initialization on first application access
 @app.route('/api/init_user', methods=['GET'])
@@ -1078,11 +3594,10 @@ def get_settings():
         if not settings:
             # If settings don't exist, create defaults
             current_time = datetime.now().strftime("%H:%M")
-            conn.execute("""
+            execute_write("""
                 INSERT INTO Settings (avtomatsko, interval, cas_posodobitve, zadnja_posodobitev)
                 VALUES (1, 24, ?, datetime('now'))
             """, (current_time,))
-            conn.commit()
             settings = conn.execute("SELECT * FROM Settings LIMIT 1").fetchone()
     return jsonify(dict(settings))
 
@@ -1099,6 +3614,7 @@ def update_settings():
         old_settings = conn.execute("SELECT avtomatsko FROM Settings LIMIT 1").fetchone()
         old_avtomatsko = old_settings['avtomatsko'] if old_settings else 0
 
+    def store_settings(conn):
         # Check if settings exist
         settings = conn.execute("SELECT 1 FROM Settings LIMIT 1").fetchone()
         if settings:
@@ -1114,7 +3630,8 @@ def update_settings():
                 INSERT INTO Settings (avtomatsko, interval, cas_posodobitve, zadnja_posodobitev)
                 VALUES (?, ?, ?, datetime('now'))
             """, (avtomatsko, interval, cas_posodobitve))
-        conn.commit()
+
+    run_write(store_settings)
     
     logger.info(f"Settings updated: automatic={avtomatsko}, interval={interval}, update_time={cas_posodobitve}")
     
@@ -1126,52 +3643,75 @@ def update_settings():
     
     return jsonify({"message": "Nastavitve uspešno posodobljene."})
 
-# Function to calculate seconds until next update
-def calculate_seconds_until_next_update():
-    try:
-        with get_db_connection() as conn:
-            settings = conn.execute("SELECT * FROM Settings LIMIT 1").fetchone()
-        
-        if not settings or settings['avtomatsko'] != 1 or not settings['cas_posodobitve']:
-            # If automatic update is not set, check again in one hour
-            return 3600  
-        
-        # Get current time
-        now = datetime.now()
-        
-        # Parse set update time
-        hour, minute = map(int, settings['cas_posodobitve'].split(':'))
-        
-        # Create datetime object for next update time
-        next_update = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        
-        # If set time is already past for today, add one day or one week
-        if next_update <= now:
-            if settings['interval'] <= 24:  # Daily update
-                next_update += timedelta(days=1)
-            else:  # Weekly update
-                next_update += timedelta(days=7)
-        # For weekly update, we can additionally check if we need to skip more days
-        elif settings['interval'] > 24 and 'zadnja_posodobitev' in settings and settings['zadnja_posodobitev']:
-            last_update = datetime.strptime(settings['zadnja_posodobitev'], "%Y-%m-%d %H:%M:%S")
-            hours_since_last_update = (now - last_update).total_seconds() / 3600
-            
-            # If not enough time has passed since last update, skip to next week
-            if hours_since_last_update < settings['interval'] and next_update > last_update:
-                next_update += timedelta(days=7)
-        
-        # Calculate seconds until next update
-        seconds_until_update = (next_update - now).total_seconds()
-        
-        logger.info(f"Next update at {next_update.strftime('%Y-%m-%d %H:%M:%S')} (over {seconds_until_update/3600:.2f} hours)")
-        return max(seconds_until_update, 60)  # At least 1 minute
-    except Exception as e:
-        logger.error(f"Error calculating time for next update: {e}", exc_info=True)
-        import traceback
-        traceback.print_exc()
-        # In case of error, check again in 1 hour
-        return 3600
-    
+# Function for storing a playback position; it is written to the database by the next flush
+def queue_playback_position(episode_id, user_id, position):
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    with pending_positions_lock:
+        PENDING_POSITIONS[(episode_id, user_id)] = (position, timestamp)
+    if POSITION_FLUSH_INTERVAL == 0:
+        flush_playback_positions()
+
+# Function for reading a playback position that is not written to the database yet
+def get_pending_position(episode_id, user_id):
+    with pending_positions_lock:
+        return PENDING_POSITIONS.get((episode_id, user_id))
+
+# Function for getting the pending playback positions of a user
+def get_pending_positions(user_id):
+    """Returns {episode_id: (position, timestamp)}"""
+    with pending_positions_lock:
+        return {episode_id: value for (episode_id, pending_user_id), value in PENDING_POSITIONS.items()
+                if pending_user_id == user_id}
+
+# Function for writing pending playback positions in a single transaction
+@atexit.register
+def flush_playback_positions():
+    """
+    Returns the number of written positions. Positions stay pending (and visible to
+    get_pending_position) until their transaction is committed; on an error they are
+    retried by the next flush.
+    """
+    with position_flush_lock:
+        with pending_positions_lock:
+            pending = dict(PENDING_POSITIONS)
+        if not pending:
+            return 0
+
+        try:
+            # Positions of episodes deleted in the meantime are dropped
+            run_write(lambda conn: conn.executemany("""
+                INSERT INTO EpisodePlaybackPosition (episode_id, user_id, position, timestamp)
+                SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM Episodes WHERE id = ? AND izbrisano IS NOT 1)
+                ON CONFLICT(episode_id, user_id)
+                DO UPDATE SET position = excluded.position, timestamp = excluded.timestamp
+            """, [(episode_id, user_id, position, timestamp, episode_id)
+                  for (episode_id, user_id), (position, timestamp) in pending.items()]))
+        except Exception as e:
+            logger.error(f"Error writing {len(pending)} playback positions: {e}")
+            return 0
+
+        # Keep positions that were updated again while this flush was running
+        with pending_positions_lock:
+            for key, value in pending.items():
+                if PENDING_POSITIONS.get(key) is value:
+                    del PENDING_POSITIONS[key]
+        return len(pending)
+
+def position_flush_loop():
+    """Writes pending playback positions and tracking checkpoints every POSITION_FLUSH_INTERVAL seconds"""
+    while True:
+        time.sleep(POSITION_FLUSH_INTERVAL)
+        flush_playback_positions()
+        checkpoint_tracking_sessions()
+
+def start_position_flush_thread():
+    global position_flush_thread
+    if POSITION_FLUSH_INTERVAL == 0 or (position_flush_thread and position_flush_thread.is_alive()):
+        return
+    position_flush_thread = threading.Thread(target=position_flush_loop, daemon=True, name='position-flush')
+    position_flush_thread.start()
+    logger.info(f"Playback positions are written every {POSITION_FLUSH_INTERVAL} s")
+
 # API for saving playback position
 @app.route('/api/episodes/<int:episode_id>/position', methods=['POST'])
 def save_episode_position(episode_id):
@@ -1208,14 +3748,8 @@ def save_episode_position(episode_id):
             if not episode:
                 return jsonify({"error": "Epizoda ne obstaja."}), 404
 
-            # Save or update position
-            conn.execute("""
-                INSERT INTO EpisodePlaybackPosition (episode_id, user_id, position, timestamp)
-                VALUES (?, ?, ?, datetime('now'))
-                ON CONFLICT(episode_id, user_id) 
-                DO UPDATE SET position = ?, timestamp = datetime('now')
-            """, (episode_id, target_user_id, position, position))
-            conn.commit()
+        # Save or update position
+        queue_playback_position(episode_id, target_user_id, position)
 
         logger.info(f"Saved position {position} for episode {episode_id} and user {target_user_id}")
         return jsonify({"message": "Pozicija uspešno shranjena."}), 200
@@ -1254,7 +3788,13 @@ def get_episode_position(episode_id):
             if not episode:
                 return jsonify({"error": "Epizoda ne obstaja."}), 404
 
-            # Get last position
+            # Get last position, a position that is not written yet takes precedence
+            position = get_pending_position(episode_id, target_user_id)
+            if position:
+                return jsonify({
+                    "position": position[0],
+                    "timestamp": position[1]
+                })
             position = conn.execute("""
                 SELECT position, timestamp
                 FROM EpisodePlaybackPosition
@@ -1276,59 +3816,177 @@ def get_episode_position(episode_id):
         logger.error(f"Napaka pri pridobivanju pozicije: {e}")
         return jsonify({"error": str(e)}), 500
 
-# Function for automatic update
-def auto_update_podcasts():
+# Function for learning how often a feed should be refreshed
+def calculate_refresh_interval(conn, feed, max_interval):
+    """
+    Returns the refresh interval in seconds for a feed: a quarter of the median
+    gap between its recent episodes, longer for feeds that went quiet, never shorter
+    than the feed's <ttl>/sy:updatePeriod hint and never longer than max_interval.
+    """
+    rows = conn.execute("""
+        SELECT pub_epoch AS published
+        FROM Episodes
+        WHERE feed_id = ?
+        ORDER BY pub_epoch DESC
+        LIMIT 10
+    """, (feed['id'],)).fetchall()
+    published = [row['published'] for row in rows if row['published']]
+
+    if len(published) >= 2:
+        gaps = sorted(newer - older for newer, older in zip(published, published[1:]))
+        median_gap = gaps[len(gaps) // 2]
+        interval = median_gap / 4
+        # Dormant feed - back off in proportion to how long it has been quiet
+        quiet_for = time.time() - published[0]
+        if quiet_for > 3 * median_gap:
+            interval = max(interval, quiet_for / 4)
+    else:
+        interval = DEFAULT_REFRESH_INTERVAL
+
+    if feed['feed_ttl']:
+        interval = max(interval, feed['feed_ttl'])
+
+    return int(min(max(interval, MIN_REFRESH_INTERVAL), max_interval))
+
+# Function for calculating when a feed should be refreshed next
+def calculate_next_refresh(feed_id, interval, settings):
+    # +-10 % jitter spreads feeds with the same cadence apart
+    due = time.time() + interval * random.uniform(0.9, 1.1)
+
+    # Slow feeds are refreshed in the window after the configured update time
+    if interval >= 86400 and settings and settings['cas_posodobitve']:
+        hour, minute = map(int, settings['cas_posodobitve'].split(':'))
+        due_time = datetime.fromtimestamp(due)
+        slot = due_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        slot += timedelta(seconds=(feed_id * 7919) % DAILY_UPDATE_WINDOW)
+        if slot < due_time:
+            slot += timedelta(days=1)
+        due = slot.timestamp()
+
+    return int(due)
+
+# Function for adding a feed to the refresh queue
+def schedule_feed_refresh(feed_id, due, priority=REFRESH_PRIORITY_SCHEDULED):
+    with refresh_queue_condition:
+        REFRESH_DUE[feed_id] = (due, priority)
+        heapq.heappush(REFRESH_QUEUE, (due, priority, feed_id))
+        refresh_queue_condition.notify_all()
+
+# Function for requesting an immediate refresh of a feed
+def request_feed_refresh(feed_id):
+    schedule_feed_refresh(feed_id, int(time.time()), REFRESH_PRIORITY_NOW)
+
+# Function for loading the refresh schedule from the database
+def load_refresh_schedule():
+    now = int(time.time())
+    with get_db_connection() as conn:
+        feeds = get_subscribed_feeds(conn)
+
+    with refresh_queue_condition:
+        REFRESH_QUEUE.clear()
+        REFRESH_DUE.clear()
+        for feed in feeds:
+            # Feeds that were never scheduled are spread over the first ten minutes
+            due = feed['next_refresh_at'] or now + (feed['id'] * 37) % 600
+            REFRESH_DUE[feed['id']] = (due, REFRESH_PRIORITY_SCHEDULED)
+            REFRESH_QUEUE.append((due, REFRESH_PRIORITY_SCHEDULED, feed['id']))
+        heapq.heapify(REFRESH_QUEUE)
+    logger.info(f"Refresh schedule loaded for {len(feeds)} feeds.")
+
+# Function for waiting until feeds are due for refresh
+def wait_for_due_refreshes():
+    """
+    Blocks until at least one feed is due (or the update thread is stopped) and
+    returns the due entries as [(feed_id, priority)], manual requests first.
+    """
+    with refresh_queue_condition:
+        while not update_thread_stop_event.is_set():
+            # Drop entries that were replaced by a newer schedule
+            while REFRESH_QUEUE and REFRESH_DUE.get(REFRESH_QUEUE[0][2]) != REFRESH_QUEUE[0][:2]:
+                heapq.heappop(REFRESH_QUEUE)
+
+            now = time.time()
+            if REFRESH_QUEUE and REFRESH_QUEUE[0][0] <= now:
+                due = []
+                while REFRESH_QUEUE and REFRESH_QUEUE[0][0] <= now:
+                    entry_due, priority, feed_id = heapq.heappop(REFRESH_QUEUE)
+                    if REFRESH_DUE.get(feed_id) == (entry_due, priority):
+                        del REFRESH_DUE[feed_id]
+                        due.append((feed_id, priority))
+                return sorted(due, key=lambda item: item[1])
+
+            timeout = min(REFRESH_QUEUE[0][0] - now, 60) if REFRESH_QUEUE else 60
+            refresh_queue_condition.wait(timeout=timeout)
+    return []
+
+# Function for storing the next refresh of a feed after it was refreshed
+def schedule_next_refresh(conn, feed, settings, failed=False):
+    """Returns the stored time; callers queue it with schedule_feed_refresh once the write succeeded"""
+    max_interval = (settings['interval'] if settings else 24) * 3600
+    interval = calculate_refresh_interval(conn, feed, max_interval)
+    if failed:
+        next_refresh = int(time.time()) + min(interval, FAILED_REFRESH_RETRY)
+    else:
+        next_refresh = calculate_next_refresh(feed['id'], interval, settings)
+    conn.execute("UPDATE Feeds SET refresh_interval = ?, next_refresh_at = ? WHERE id = ?",
+                 (interval, next_refresh, feed['id']))
+    return next_refresh
+
+# Function for refreshing the feeds that are due
+def run_due_refreshes(due):
+    with get_db_connection() as conn:
+        settings = conn.execute("SELECT * FROM Settings LIMIT 1").fetchone()
+    automatic = settings is not None and settings['avtomatsko'] == 1
+
+    # Manual requests always run; scheduled ones only with automatic update turned on
+    feed_ids = [feed_id for feed_id, priority in due if automatic or priority == REFRESH_PRIORITY_NOW]
+    for feed_id, priority in due:
+        if feed_id not in feed_ids:
+            schedule_feed_refresh(feed_id, int(time.time()) + FAILED_REFRESH_RETRY)
+    if not feed_ids:
+        logger.info("Automatic update is turned off.")
+        return
+
+    with get_db_connection() as conn:
+        feeds = get_subscribed_feeds(conn, feed_ids)
+
+    logger.info(f"Time for an update of {len(feeds)} feeds! ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})")
+    report = refresh_feeds(feeds)
+
+    def store_schedule(conn):
+        schedule = {feed['id']: schedule_next_refresh(conn, feed, settings, failed=feed['id'] in report['failed_ids'])
+                    for feed in get_subscribed_feeds(conn, feed_ids)}
+
+        # Update last update time
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute("UPDATE Settings SET zadnja_posodobitev = ? WHERE id = 1", (now,))
+        return schedule
+
+    # The queue follows the stored schedule only after it was committed
     try:
-        logger.info("Starting automatic podcast update...")
-        # Update all podcasts
-        with get_db_connection() as conn:
-            podcasts = conn.execute("SELECT * FROM Podcasts").fetchall()
-            updated = 0
-            
-            for podcast in podcasts:
-                try:
-                    update_episodes(podcast['id'], podcast['rss_url'])
-                    updated += 1
-                except Exception as e:
-                    logger.error(f"Napaka pri posodabljanju podcasta {podcast['naslov']}: {e}")
-            
-            # Update last update time
-            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            conn.execute("UPDATE Settings SET zadnja_posodobitev = ? WHERE id = 1", (now,))
-            conn.commit()
-        logger.info(f"Automatic update completed. Updated {updated} podcasts.")
-        return True
-    except Exception as e:
-        logger.error(f"Error while auto-updating podcasts: {e}")
-        return False
+        schedule = run_write(store_schedule)
+    except Exception:
+        for feed_id in feed_ids:
+            schedule_feed_refresh(feed_id, int(time.time()) + FAILED_REFRESH_RETRY)
+        raise
+    for feed_id, next_refresh in schedule.items():
+        schedule_feed_refresh(feed_id, next_refresh)
 
 # Function for automatic update
 def auto_update_loop():
     logger.info("Automatic update initialized.")
+    load_refresh_schedule()
     while not update_thread_stop_event.is_set():
         try:
-            # Calculate time until next update
-            sleep_duration = calculate_seconds_until_next_update()
-            
-            # Wait until next update
-            logger.info(f"I'm sleeping {sleep_duration/3600:.2f} hours until the next update..")
-            # Use wait with timeout instead of sleep to detect stop earlier
-            if update_thread_stop_event.wait(timeout=sleep_duration):
-                logger.info("Request received to stop update thread.")
-                break
-            
-            # Check settings once more before update
-            with get_db_connection() as conn:
-                settings = conn.execute("SELECT * FROM Settings LIMIT 1").fetchone()
-            
-            if settings and settings['avtomatsko'] == 1:
-                logger.info(f"Time for an update! ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})")
-                auto_update_podcasts()
-            else:
-                logger.info("Automatic update is turned off.")
+            due = wait_for_due_refreshes()
+            if due:
+                run_due_refreshes(due)
         except Exception as e:
             logger.error(f"Error in auto_update_loop: {e}")
-            time.sleep(300)  # In case of error, wait 5 minutes
+            # In case of error, wait 5 minutes
+            if update_thread_stop_event.wait(timeout=300):
+                break
+    logger.info("Request received to stop update thread.")
 
 # Function for safe start/restart of thread
 def start_update_thread():
@@ -1338,6 +3996,8 @@ def start_update_thread():
     if update_thread and update_thread.is_alive():
         logger.info("I'm stopping the existing update thread...")
         update_thread_stop_event.set()  # Send stop signal
+        with refresh_queue_condition:
+            refresh_queue_condition.notify_all()
         update_thread.join(timeout=5)   # Wait up to 5 seconds for thread to stop
         update_thread_stop_event.clear()  # Reset event
     
@@ -1351,7 +4011,9 @@ def start_update_thread():
 def start_tracking_session(episode_id, player_entity_id, episode_url, user_id):
     """Start tracking playback session"""
     try:
-        with get_db_connection() as conn:
+        started_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+        def store_session(conn):
             # Delete any existing session for this episode/user
             conn.execute("""
                 DELETE FROM ActiveTrackingSessions 
@@ -1359,14 +4021,31 @@ def start_tracking_session(episode_id, player_entity_id, episode_url, user_id):
             """, (episode_id, user_id))
             
             # Insert new session
-            conn.execute("""
+            return conn.execute("""
                 INSERT INTO ActiveTrackingSessions 
                 (episode_id, player_entity_id, episode_url, user_id, started_at)
-                VALUES (?, ?, ?, ?, datetime('now'))
-            """, (episode_id, player_entity_id, episode_url, user_id))
-            
-            conn.commit()
-            logger.info(f"Started tracking session: episode {episode_id} on {player_entity_id}")
+                VALUES (?, ?, ?, ?, ?)
+            """, (episode_id, player_entity_id, episode_url, user_id, started_at)).lastrowid
+
+        session_id = run_write(store_session)
+        with tracking_sessions_lock:
+            for session in list(TRACKING_SESSIONS.values()):
+                if session['episode_id'] == episode_id and session['user_id'] == user_id:
+                    del TRACKING_SESSIONS[session['id']]
+            TRACKING_SESSIONS[session_id] = {
+                'id': session_id,
+                'episode_id': episode_id,
+                'player_entity_id': player_entity_id,
+                'episode_url': episode_url,
+                'user_id': user_id,
+                'started_at': started_at,
+                'last_position': -1,
+                'same_position_count': 0,
+            }
+        logger.info(f"Started tracking session: episode {episode_id} on {player_entity_id}")
+        if TRACKING_MODE == 'events':
+            update_tracking_subscription()
+        wake_tracking()
             
     except Exception as e:
         logger.error(f"Error starting tracking session: {e}")
@@ -1374,95 +4053,186 @@ def start_tracking_session(episode_id, player_entity_id, episode_url, user_id):
 def end_tracking_session(session_id):
     """End tracking session"""
     try:
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM ActiveTrackingSessions WHERE id = ?", (session_id,))
-            conn.commit()
-            logger.info(f"Ended tracking session: {session_id}")
+        with tracking_sessions_lock:
+            TRACKING_SESSIONS.pop(session_id, None)
+            changed_tracking_sessions.discard(session_id)
+        execute_write("DELETE FROM ActiveTrackingSessions WHERE id = ?", (session_id,))
+        logger.info(f"Ended tracking session: {session_id}")
+        if TRACKING_MODE == 'events':
+            update_tracking_subscription()
     except Exception as e:
         logger.error(f"Error ending tracking session: {e}")
 
 def get_active_sessions():
     """Get all active tracking sessions"""
-    try:
-        with get_db_connection() as conn:
-            sessions = conn.execute("""
-                SELECT * FROM ActiveTrackingSessions
-            """).fetchall()
-            return [dict(session) for session in sessions]
-    except Exception as e:
-        logger.error(f"Error getting active sessions: {e}")
-        return []
+    with tracking_sessions_lock:
+        return [dict(session) for session in TRACKING_SESSIONS.values()]
     
 def update_session_position_tracking(session_id, position, count):
-    """Update session position tracking data"""
+    """Update session position tracking data; it is written to the database by the next checkpoint"""
+    with tracking_sessions_lock:
+        session = TRACKING_SESSIONS.get(session_id)
+        if not session or (session['last_position'], session['same_position_count']) == (position, count):
+            return
+        session['last_position'] = position
+        session['same_position_count'] = count
+        changed_tracking_sessions.add(session_id)
+    if POSITION_FLUSH_INTERVAL == 0:
+        checkpoint_tracking_sessions()
+
+# Function for restoring tracking sessions from before a restart
+def load_tracking_sessions():
+    with get_db_connection() as conn:
+        sessions = [dict(session) for session in conn.execute("SELECT * FROM ActiveTrackingSessions")]
+    with tracking_sessions_lock:
+        TRACKING_SESSIONS.clear()
+        TRACKING_SESSIONS.update((session['id'], session) for session in sessions)
+    if sessions:
+        logger.info(f"Restored {len(sessions)} tracking sessions.")
+
+# Function for writing the tracking data of changed sessions in a single transaction
+@atexit.register
+def checkpoint_tracking_sessions():
+    """
+    Returns the number of written sessions. Sessions whose rows are gone, because their
+    episode or user was deleted, are dropped from the registry.
+    """
+    with tracking_sessions_lock:
+        changed = [(TRACKING_SESSIONS[session_id]['last_position'],
+                    TRACKING_SESSIONS[session_id]['same_position_count'], session_id)
+                   for session_id in changed_tracking_sessions if session_id in TRACKING_SESSIONS]
+        changed_tracking_sessions.clear()
+    if not changed:
+        return 0
+
+    def store_checkpoint(conn):
+        return [session_id for position, count, session_id in changed if conn.execute("""
+            UPDATE ActiveTrackingSessions SET last_position = ?, same_position_count = ? WHERE id = ?
+        """, (position, count, session_id)).rowcount == 0]
+
     try:
-        with get_db_connection() as conn:
-            conn.execute("""
-                UPDATE ActiveTrackingSessions 
-                SET last_position = ?, same_position_count = ?
-                WHERE id = ?
-            """, (position, count, session_id))
-            conn.commit()
+        missing = run_write(store_checkpoint)
     except Exception as e:
-        logger.error(f"Error updating session position tracking: {e}")
+        logger.error(f"Error writing {len(changed)} tracking sessions: {e}")
+        # Retried by the next checkpoint
+        with tracking_sessions_lock:
+            changed_tracking_sessions.update(session_id for _, _, session_id in changed)
+        return 0
 
-async def get_player_state_from_ha(player_entity_id):
-    """Get current state of media player from Home Assistant"""
-    try:
-        supervisor_token = os.environ.get('SUPERVISOR_TOKEN')
-        if not supervisor_token:
-            logger.error("No Supervisor token available")
-            return None
+    with tracking_sessions_lock:
+        for session_id in missing:
+            TRACKING_SESSIONS.pop(session_id, None)
+    return len(changed)
 
-        headers = {
-            "Authorization": f"Bearer {supervisor_token}",
-            "Content-Type": "application/json",
-        }
+# Function for reading the states of media players from the Home Assistant REST API
+# Template rendering the states of the players in entity_ids as JSON, without the other entities
+PLAYER_STATES_TEMPLATE = """{% set ns = namespace(states=[]) %}
+{%- for state in states.media_player | selectattr('entity_id', 'in', entity_ids) -%}
+{%- set ns.states = ns.states + [{'entity_id': state.entity_id, 'state': state.state, 'attributes': dict(state.attributes)}] -%}
+{%- endfor -%}
+{{ ns.states | to_json }}"""
 
-        # Get player state from HA API
-        response = requests.get(
-           f"http://supervisor/core/api/states/{player_entity_id}",
-            headers=headers,
-            timeout=5
-        )
+def fetch_player_states(player_entity_ids):
+    """
+    Reads only the tracked players, with one template render on the pooled session; all
+    states of Home Assistant can be megabytes. The REST API is used because polling runs
+    while the WebSocket API is not available. Returns {entity_id: state}, without players
+    that do not exist.
+    """
+    supervisor_token = os.environ.get('SUPERVISOR_TOKEN')
+    if not supervisor_token:
+        raise Exception("No Supervisor token available")
 
-        if not response.ok:
-            logger.error(f"Error fetching player state: {response.status_code}")
-            return None
+    headers = {
+        "Authorization": f"Bearer {supervisor_token}",
+        "Content-Type": "application/json",
+    }
+    response = HA_SESSION.post("http://supervisor/core/api/template", headers=headers, timeout=5, json={
+        "template": PLAYER_STATES_TEMPLATE,
+        "variables": {"entity_ids": list(player_entity_ids)}
+    })
+    response.raise_for_status()
+    return {state['entity_id']: state for state in json.loads(response.text)}
+
+async def get_player_states_from_ha(player_entity_ids):
+    """Get current states of media players from Home Assistant without blocking the event loop"""
+    return await asyncio.to_thread(fetch_player_states, player_entity_ids)
+
+def get_player_state(state_data):
+    """Extract relevant attributes of a media player state"""
+    attributes = state_data.get('attributes', {})
+    return {
+        'state': state_data.get('state', 'unknown'),
+        'media_content_id': attributes.get('media_content_id', ''),
+        'media_position': attributes.get('media_position', 0),
+        'media_duration': attributes.get('media_duration', 0),
+        'media_position_updated_at': attributes.get('media_position_updated_at', ''),
+    }
 
-        state_data = response.json()
-        
-        # Extract relevant attributes
-        attributes = state_data.get('attributes', {})
-        player_state = {
-            'state': state_data.get('state', 'unknown'),
-            'media_content_id': attributes.get('media_content_id', ''),
-            'media_position': attributes.get('media_position', 0),
-            'media_duration': attributes.get('media_duration', 0),
-            'media_position_updated_at': attributes.get('media_position_updated_at', ''),
-        }
-        
-        return player_state
-        
-    except Exception as e:
-        logger.error(f"Error getting player state for {player_entity_id}: {e}")
-        return None    
+# Function for choosing when a player is polled again
+def get_poll_interval(state_data):
+    if state_data.get('state') != 'playing':
+        return TRACKING_POLL_PAUSED
+    duration = state_data.get('attributes', {}).get('media_duration')
+    position = get_media_position(state_data)
+    if duration and position is not None and duration - position <= TRACKING_NEAR_END:
+        return TRACKING_POLL_NEAR_END
+    return TRACKING_POLL_PLAYING
+
+# Function for waking the tracking monitor from any thread
+def wake_tracking():
+    """Called when a session starts, player events stop or the tracking thread stops"""
+    loop, wakeup = tracking_event_loop, tracking_wakeup
+    if loop is None or wakeup is None:
+        return
+    try:
+        loop.call_soon_threadsafe(wakeup.set)
+    except RuntimeError:
+        pass  # the tracking loop is already closed
+
+# Function for waiting until wake_tracking() is called or the timeout passes
+async def wait_for_tracking_wakeup(timeout=None):
+    """Runs on the tracking event loop, which keeps running its other tasks meanwhile"""
+    try:
+        await asyncio.wait_for(tracking_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    tracking_wakeup.clear()
+
+# Function for checking whether state change events of the tracked players arrive
+def tracking_events_active():
+    return TRACKING_MODE == 'events' and HA_WEBSOCKET.is_subscribed(tracking_subscription)
 
 async def monitor_active_sessions():
-    """Monitor all active tracking sessions"""
+    """
+    Monitor all active tracking sessions. In events mode players are polled only while
+    their state change events are not available; without sessions nothing is polled.
+    """
     logger.info("Starting playback tracking monitor...")
 
     while not tracking_thread_stop_event.is_set():
         try:
             sessions = get_active_sessions()
+            if not sessions:
+                # Wait for a session to start
+                await wait_for_tracking_wakeup()
+                continue
+            if tracking_events_active():
+                await wait_for_tracking_wakeup(TRACKING_EVENTS_CHECK)
+                continue
+
+            # Get current player states from HA, only of the tracked players
+            player_states = await get_player_states_from_ha(
+                sorted({session['player_entity_id'] for session in sessions}))
+            interval = TRACKING_POLL_PAUSED
 
             for session in sessions:
                 try:
-                    # Get current player state from HA
-                    player_state = await get_player_state_from_ha(session['player_entity_id'])
-
-                    if not player_state:
+                    state_data = player_states.get(session['player_entity_id'])
+                    if not state_data:
                         continue
+                    player_state = get_player_state(state_data)
+                    interval = min(interval, get_poll_interval(state_data))
 
                     # Check if player is still playing our episode
                     playing_url = player_state['media_content_id'].replace("builtin://track/", "")
@@ -1521,100 +4291,140 @@ async def monitor_active_sessions():
                 except Exception as e:
                     logger.error(f"Error processing session {session.get('id', 'unknown')}: {e}")
 
-            # Wait 1 second before next check
-            if tracking_thread_stop_event.wait(timeout=1.0):
-                break
+            # Wait until the next check, or for a new session
+            await wait_for_tracking_wakeup(interval)
 
         except Exception as e:
             logger.error(f"Error in monitor_active_sessions: {e}")
-            # Wait before retrying
-            if tracking_thread_stop_event.wait(timeout=5.0):
-                break
+            # Wait before retrying; stopping the thread wakes the monitor
+            await wait_for_tracking_wakeup(5.0)
 
     logger.info("Playback tracking monitor stopped.")
 
-def mark_session_paused(session_id, state, position):
-    """Mark session as paused"""
+# Function for following state changes of the media players that have tracking sessions
+def update_tracking_subscription():
+    """
+    Subscribes only while sessions exist, so idle tracking costs nothing. The change is made
+    on the WebSocket thread; the caller does not wait for Home Assistant.
+    """
     try:
-        with get_db_connection() as conn:
-            conn.execute("""
-                UPDATE ActiveTrackingSessions 
-                SET last_state = ?, last_position = ?, paused_at = datetime('now')
-                WHERE id = ?
-            """, (state, position, session_id))
-            conn.commit()
+        HA_WEBSOCKET.run(follow_tracked_players)
     except Exception as e:
-        logger.error(f"Error marking session as paused: {e}")
+        logger.error(f"Error updating tracking subscription: {e}")
 
-def clear_session_pause(session_id, state, position):
-    """Clear pause state from session"""
-    try:
-        with get_db_connection() as conn:
-            conn.execute("""
-                UPDATE ActiveTrackingSessions 
-                SET last_state = ?, last_position = ?, paused_at = NULL
-                WHERE id = ?
-            """, (state, position, session_id))
-            conn.commit()
-    except Exception as e:
-        logger.error(f"Error clearing session pause: {e}")
+async def follow_tracked_players():
+    global tracking_subscription, tracking_players
+    async with HA_WEBSOCKET.changes_lock:
+        try:
+            # The sessions are read here, so the last change follows the current sessions
+            players = sorted({session['player_entity_id'] for session in get_active_sessions()})
+            if players == tracking_players:
+                return
+
+            subscription = None
+            if players:
+                # to: None triggers on state changes only, not on every position update
+                subscription = await HA_WEBSOCKET.add_subscription({
+                    "type": "subscribe_trigger",
+                    "trigger": {"platform": "state", "entity_id": players, "to": None}
+                }, queue_player_event, HA_WEBSOCKET_TIMEOUT, on_lost=wake_tracking)
+            if tracking_subscription is not None:
+                await HA_WEBSOCKET.remove_subscription(tracking_subscription)
+            tracking_subscription = subscription
+            tracking_players = players
+            logger.info(f"Following state changes of {len(players)} media players")
+        except Exception as e:
+            logger.error(f"Error updating tracking subscription: {e}")
 
-def update_session_state(session_id, state, position):
-    """Update session state"""
-    try:
-        with get_db_connection() as conn:
-            conn.execute("""
-                UPDATE ActiveTrackingSessions 
-                SET last_state = ?, last_position = ?
-                WHERE id = ?
-            """, (state, position, session_id))
-            conn.commit()
-    except Exception as e:
-        logger.error(f"Error updating session state: {e}")
+def queue_player_event(event):
+    """Runs on the WebSocket thread, which must not wait for the database"""
+    TRACKING_EXECUTOR.submit(handle_player_event, event)
 
-def get_pause_duration(paused_at_str):
-    """Calculate how long session has been paused in seconds"""
+# Function for getting the playback position of a media player state
+def get_media_position(state, at=None):
+    """
+    While playing, media_position is the position at media_position_updated_at and is
+    moved on to the time at (an ISO timestamp, now by default).
+    """
+    attributes = state.get('attributes', {})
+    position = attributes.get('media_position')
+    if position is None:
+        return None
+    updated_at = attributes.get('media_position_updated_at')
+    if state.get('state') == 'playing' and updated_at:
+        updated_at = datetime.fromisoformat(updated_at)
+        at = datetime.fromisoformat(at) if at else datetime.now(updated_at.tzinfo)
+        position += max(0, (at - updated_at).total_seconds())
+    duration = attributes.get('media_duration')
+    if duration:
+        position = min(position, duration)
+    return int(position)
+
+# Function for saving the position of tracked episodes when their player pauses or stops
+def handle_player_event(event):
     try:
-        from datetime import datetime
-        paused_at = datetime.fromisoformat(paused_at_str.replace('Z', '+00:00'))
-        now = datetime.now(paused_at.tzinfo)
-        return (now - paused_at).total_seconds()
+        trigger = event.get('variables', {}).get('trigger', {})
+        old_state = trigger.get('from_state')
+        new_state = trigger.get('to_state')
+        if not new_state:
+            return
+
+        sessions = [session for session in get_active_sessions()
+                    if session['player_entity_id'] == trigger.get('entity_id')]
+
+        state = new_state['state']
+        for session in sessions:
+            playing_url = new_state.get('attributes', {}).get('media_content_id', '').replace("builtin://track/", "")
+
+            if state == 'paused':
+                if playing_url != session['episode_url']:
+                    end_tracking_session(session['id'])
+                    logger.info(f"Stopped tracking session {session['id']} - different content playing")
+                    continue
+                position = get_media_position(new_state)
+                if position:
+                    queue_playback_position(session['episode_id'], session['user_id'], position)
+                    logger.info(f"Saved position {position} for episode {session['episode_id']} (paused)")
+
+            elif state in ('playing', 'buffering'):
+                if playing_url and playing_url != session['episode_url']:
+                    end_tracking_session(session['id'])
+                    logger.info(f"Stopped tracking session {session['id']} - different content playing")
+
+            elif state in ('idle', 'off', 'standby'):
+                # The stopped state has no position - take it from the previous state at the time of the stop
+                if old_state and old_state['state'] in ('playing', 'paused'):
+                    old_url = old_state.get('attributes', {}).get('media_content_id', '').replace("builtin://track/", "")
+                    position = get_media_position(old_state, new_state.get('last_changed'))
+                    if old_url == session['episode_url'] and position:
+                        queue_playback_position(session['episode_id'], session['user_id'], position)
+                        logger.info(f"Saved position {position} for episode {session['episode_id']} (stopped)")
+                end_tracking_session(session['id'])
+                logger.info(f"Stopped tracking session {session['id']} - playback stopped")
     except Exception as e:
-        logger.error(f"Error calculating pause duration: {e}")
-        return 0
+        logger.error(f"Error handling media player event: {e}")
 
 async def save_playback_position(episode_id, position, user_id):
     """Save playback position (async wrapper for existing function)"""
     try:
-        with get_db_connection() as conn:
-            conn.execute("""
-                INSERT INTO EpisodePlaybackPosition (episode_id, user_id, position, timestamp)
-                VALUES (?, ?, ?, datetime('now'))
-                ON CONFLICT(episode_id, user_id) 
-                DO UPDATE SET position = ?, timestamp = datetime('now')
-            """, (episode_id, user_id, position, position))
-            conn.commit()
+        queue_playback_position(episode_id, user_id, position)
     except Exception as e:
         logger.error(f"Error saving playback position: {e}")
 
 async def mark_episode_listened(episode_id, user_id):
     """Mark episode as listened (async wrapper for existing function)"""
     try:
-        with get_db_connection() as conn:
-            conn.execute("""
-                INSERT INTO EpisodeListenStatus (episode_id, user_id, poslušano, timestamp)
-                VALUES (?, ?, 1, datetime('now'))
-                ON CONFLICT(episode_id, user_id) 
-                DO UPDATE SET poslušano = 1, timestamp = datetime('now')
-            """, (episode_id, user_id))
-            conn.commit()
+        await asyncio.wrap_future(submit_write(set_episode_listened, episode_id, user_id))
     except Exception as e:
         logger.error(f"Error marking episode as listened: {e}")
 
 def tracking_loop():
     """Main tracking loop that runs in separate thread"""
+    global tracking_event_loop, tracking_wakeup
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    tracking_wakeup = asyncio.Event()
+    tracking_event_loop = loop
     try:
         loop.run_until_complete(monitor_active_sessions())
     finally:
@@ -1623,11 +4433,18 @@ def tracking_loop():
 def start_tracking_thread():
     """Start tracking thread"""
     global tracking_thread, tracking_thread_stop_event
+
+    if TRACKING_MODE == 'events':
+        # Sessions from before a restart are followed again; polling is the fallback
+        if get_active_sessions():
+            update_tracking_subscription()
+        logger.info("Playback tracking follows media player state changes.")
     
     # First stop existing thread if it exists
     if tracking_thread and tracking_thread.is_alive():
         logger.info("Stopping existing tracking thread...")
         tracking_thread_stop_event.set()
+        wake_tracking()
         tracking_thread.join(timeout=5)
         tracking_thread_stop_event.clear()
     
@@ -1637,12 +4454,39 @@ def start_tracking_thread():
     tracking_thread.start()
     logger.info("Tracking thread started.")
 
+# Create or update the database before threads start using it
+migrate_database()
+start_db_writer()
+check_latest_episodes()
+
 # Start automatic updates in separate thread
 start_update_thread()
 
 # Start tracking thread for playback monitoring
+load_tracking_sessions()
 start_tracking_thread()
 
+# Start writing buffered playback positions
+start_position_flush_thread()
+
+# Background job handlers by job kind
+JOB_HANDLERS = {
+    'update_all': run_update_all_job,
+    'import_podcast': run_import_podcast_job,
+    'import_html': run_import_html_job,
+    'import_xml': run_import_xml_job,
+    'maintenance': run_maintenance_job,
+    'delete_feed': run_delete_feed_job,
+}
+
+# Continue jobs interrupted by a restart
+resume_jobs()
+
+# Start periodic retention, purge and vacuum
+start_maintenance_thread()
+
+logger.info(f"Startup completed in {(time.perf_counter() - STARTUP_STARTED) * 1000:.0f} ms")
+
 # API for getting latest added episodes from each podcast
 @app.route('/api/latest_episodes', methods=['GET'])
 def get_latest_episodes():
@@ -1677,11 +4521,11 @@ def get_latest_episodes():
         is_admin = current_user['is_admin'] == 1
 
     with get_db_connection() as conn:
-        # For each accessible podcast, get the latest unlistened episode
+        # For each accessible podcast, get the latest episode; unlistened ones first
         if is_admin:
             # Admin uporabnik vidi vse epizode
             podcast_filter = ""
-            params = (check_user_id, check_user_id, limit)
+            filter_params = ()
         else:
             # Regular users see episodes from their podcasts and public podcasts
             # Add filter for hidden podcasts as well
@@ -1689,93 +4533,49 @@ def get_latest_episodes():
                 AND (p.user_id = ? OR p.is_public = 1)
                 AND (pvp.hidden IS NULL OR pvp.hidden = 0)
             """
-            params = (check_user_id, check_user_id, check_user_id, limit)
-            
+            filter_params = (check_user_id,)
+
         query = f"""
-            WITH LatestEpisodes AS (
-                SELECT 
-                    e.*,
-                    p.naslov as podcast_naslov,
-                    p.image_url,
-                    COALESCE(els.poslušano, 0) as uporabnik_poslušal,
-                    ROW_NUMBER() OVER (PARTITION BY e.podcast_id ORDER BY datetime(e.datum_izdaje) DESC) as rn
-                FROM Episodes e
-                JOIN Podcasts p ON e.podcast_id = p.id
-                LEFT JOIN EpisodeListenStatus els ON e.id = els.episode_id AND els.user_id = ?
-                LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
-                WHERE e.izbrisano IS NOT 1 {podcast_filter}
-            )
-            SELECT * FROM LatestEpisodes
-            WHERE rn = 1 AND uporabnik_poslušal = 0
-            ORDER BY datetime(datum_izdaje) DESC
+            SELECT
+                e.*,
+                p.id as podcast_id,
+                p.naslov as podcast_naslov,
+                f.image_url
+            FROM LatestEpisodes le
+            JOIN Podcasts p ON p.feed_id = le.feed_id
+            JOIN Episodes e ON e.id = ({SUBSCRIPTION_LATEST_EPISODE})
+            JOIN Feeds f ON f.id = le.feed_id
+            LEFT JOIN EpisodeListenStatus els ON els.episode_id = e.id AND els.user_id = ?
+            LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
+            WHERE COALESCE(els.poslušano, 0) = ? {podcast_filter}
+            ORDER BY le.pub_epoch DESC, le.episode_id DESC
             LIMIT ?
         """
-        episodes = conn.execute(query, params).fetchall()
-        
+        episodes = conn.execute(query, (check_user_id, check_user_id, 0, *filter_params, limit)).fetchall()
+
         # If there aren't enough unlistened episodes, add listened ones too
         if len(episodes) < limit:
-            remaining = limit - len(episodes)
-            # Get podcasts for which we haven't found episodes yet
-            existing_podcast_ids = [ep['podcast_id'] for ep in episodes]
-            existing_ids_str = ','.join('?' for _ in existing_podcast_ids) if existing_podcast_ids else '0'
-            
-            if is_admin:
-                # Admin user sees all episodes
-                podcast_filter = ""
-                # Here's the key fix - correct number of parameters
-                if existing_podcast_ids:
-                    params = [check_user_id] + existing_podcast_ids + [remaining]
-                else:
-                    params = [check_user_id, remaining]
-            else:
-                # Regular users see episodes from their podcasts and public podcasts
-                # Add filter for hidden podcasts as well
-                podcast_filter = """
-                    AND (p.user_id = ? OR p.is_public = 1)
-                    AND (pvp.hidden IS NULL OR pvp.hidden = 0)
-                """
-                # Here's the key fix - correct number of parameters
-                if existing_podcast_ids:
-                    params = [check_user_id, check_user_id] + existing_podcast_ids + [remaining]
-                else:
-                    params = [check_user_id, check_user_id, remaining]
-
-            additional_query = f"""
-                WITH LatestEpisodes AS (
-                    SELECT 
-                        e.*,
-                        p.naslov as podcast_naslov,
-                        p.image_url,
-                        ROW_NUMBER() OVER (PARTITION BY e.podcast_id ORDER BY datetime(e.datum_izdaje) DESC) as rn
-                    FROM Episodes e
-                    JOIN Podcasts p ON e.podcast_id = p.id
-                    LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
-                    WHERE e.izbrisano IS NOT 1 
-                    AND (e.podcast_id NOT IN ({existing_ids_str}) OR 1=1) {podcast_filter}
-                )
-                SELECT * FROM LatestEpisodes
-                WHERE rn = 1
-                ORDER BY datetime(datum_izdaje) DESC
-                LIMIT ?
-            """
-            additional_episodes = conn.execute(additional_query, params).fetchall()
-            
-            # Merge results
-            for ep in additional_episodes:
-                if ep['podcast_id'] not in existing_podcast_ids:
-                    episodes.append(ep)
-                    if len(episodes) >= limit:
-                        break
+            episodes += conn.execute(query, (check_user_id, check_user_id, 1, *filter_params,
+                                             limit - len(episodes))).fetchall()
+    
+    return jsonify([dict(episode) for episode in episodes])
+
+# Subscription shown for a paused episode of a shared feed: the listener's own, then a public one
+PAUSED_EPISODE_PODCAST = """
+    COALESCE(
+        (SELECT MIN(p2.id) FROM Podcasts p2 WHERE p2.feed_id = e.feed_id AND p2.user_id = epp.user_id),
+        (SELECT MIN(p2.id) FROM Podcasts p2 WHERE p2.feed_id = e.feed_id AND p2.is_public = 1),
+        (SELECT MIN(p2.id) FROM Podcasts p2 WHERE p2.feed_id = e.feed_id)
+    )
+"""
 
-    result = []
-    for episode in episodes:
-        ep_dict = dict(episode)
-        # Remove helper columns
-        for key in ['rn', 'uporabnik_poslušal']:
-            if key in ep_dict:
-                del ep_dict[key]
-        result.append(ep_dict)
-    return jsonify(result)
+# Pending playback positions passed as JSON [[episode_id, user_id, position, timestamp], ...],
+# in the shape of EpisodePlaybackPosition
+PENDING_POSITIONS_TABLE = """(
+    SELECT json_extract(value, '$[0]') AS episode_id, json_extract(value, '$[1]') AS user_id,
+        json_extract(value, '$[2]') AS position, json_extract(value, '$[3]') AS timestamp
+    FROM json_each(?)
+)"""
 
 # API for getting paused episodes for current user
 @app.route('/api/episodes/paused', methods=['GET'])
@@ -1802,45 +4602,55 @@ def get_paused_episodes():
         # Using current user
         check_user_id = current_user['id']
 
+    all_users = current_user['is_admin'] == 1 and not as_user_id
+
+    # Positions that are not written yet take precedence over stored ones
+    with pending_positions_lock:
+        pending = [[episode_id, user_id, position, timestamp]
+                   for (episode_id, user_id), (position, timestamp) in PENDING_POSITIONS.items()
+                   if all_users or user_id == check_user_id]
+    pending_keys = {(episode_id, user_id) for episode_id, user_id, _, _ in pending}
+
     with get_db_connection() as conn:
-        # Get target user data
-        target_user = conn.execute("SELECT * FROM Users WHERE id = ?", (check_user_id,)).fetchone()
-        
-        if current_user['is_admin'] == 1 and not as_user_id:
-            # Admin user without as_user parameter - show all paused episodes
-            episodes = conn.execute("""
-                SELECT 
-                    e.id as episode_id,
-                    e.podcast_id,
-                    e.naslov as episode_naslov,
-                    p.naslov as podcast_naslov,
-                    p.image_url,
-                    epp.position,
-                    epp.timestamp,
-                    u.display_name as user_display_name
-                FROM EpisodePlaybackPosition epp
-                JOIN Episodes e ON epp.episode_id = e.id
-                JOIN Podcasts p ON e.podcast_id = p.id
-                JOIN Users u ON epp.user_id = u.id
-                WHERE epp.position > 0
-                AND (e.izbrisano IS NULL OR e.izbrisano = 0)
-                ORDER BY epp.timestamp DESC
-                LIMIT ?
-            """, (limit,)).fetchall()
-        else:
+        def query_paused(positions, positions_params, row_limit):
+            if all_users:
+                # Admin user without as_user parameter - show all paused episodes
+                return conn.execute(f"""
+                    SELECT 
+                        e.id as episode_id,
+                        p.id as podcast_id,
+                        e.naslov as episode_naslov,
+                        p.naslov as podcast_naslov,
+                        f.image_url,
+                        epp.position,
+                        epp.timestamp,
+                        epp.user_id,
+                        u.display_name as user_display_name
+                    FROM {positions} epp
+                    JOIN Episodes e ON epp.episode_id = e.id
+                    JOIN Podcasts p ON p.id = ({PAUSED_EPISODE_PODCAST})
+                    JOIN Feeds f ON p.feed_id = f.id
+                    JOIN Users u ON epp.user_id = u.id
+                    WHERE epp.position > 0
+                    AND (e.izbrisano IS NULL OR e.izbrisano = 0)
+                    ORDER BY epp.timestamp DESC
+                    LIMIT ?
+                """, (*positions_params, row_limit)).fetchall()
             # Regular user, tab user or admin with as_user - show specific user's episodes
-            episodes = conn.execute("""
+            return conn.execute(f"""
                 SELECT 
                     e.id as episode_id,
-                    e.podcast_id,
+                    p.id as podcast_id,
                     e.naslov as episode_naslov,
                     p.naslov as podcast_naslov,
-                    p.image_url,
+                    f.image_url,
                     epp.position,
-                    epp.timestamp
-                FROM EpisodePlaybackPosition epp
+                    epp.timestamp,
+                    epp.user_id
+                FROM {positions} epp
                 JOIN Episodes e ON epp.episode_id = e.id
-                JOIN Podcasts p ON e.podcast_id = p.id
+                JOIN Podcasts p ON p.id = ({PAUSED_EPISODE_PODCAST})
+                JOIN Feeds f ON p.feed_id = f.id
                 LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
                 WHERE epp.user_id = ? 
                 AND epp.position > 0
@@ -1848,12 +4658,20 @@ def get_paused_episodes():
                 AND (pvp.hidden IS NULL OR pvp.hidden = 0)
                 ORDER BY epp.timestamp DESC
                 LIMIT ?
-            """, (check_user_id, check_user_id, limit)).fetchall()
+            """, (*positions_params, check_user_id, check_user_id, row_limit)).fetchall()
+
+        # Stored rows replaced by pending positions are skipped, so as many more are read
+        stored = query_paused("EpisodePlaybackPosition", (), limit + len(pending))
+        episodes = [episode for episode in stored if (episode['episode_id'], episode['user_id']) not in pending_keys]
+        if pending:
+            episodes += query_paused(PENDING_POSITIONS_TABLE, (json.dumps(pending),), len(pending))
+        episodes = sorted(episodes, key=lambda episode: episode['timestamp'], reverse=True)[:limit]
         
     # Convert results and add formatted time
     result = []
     for episode in episodes:
         ep_dict = dict(episode)
+        del ep_dict['user_id']
         # Add formatted playback time
         minutes = ep_dict['position'] // 60
         seconds = ep_dict['position'] % 60
@@ -1950,15 +4768,15 @@ def update_user_settings():
         data = request.json
         tab_user_id = data.get('tab_user_id')
         
-        with get_db_connection() as conn:
+        def store_tab_user(conn):
             # First reset all existing tab users
             conn.execute("UPDATE Users SET is_tab_user = 0")
             
             # If ID was provided, set new tab user
             if tab_user_id:
                 conn.execute("UPDATE Users SET is_tab_user = 1 WHERE id = ?", (tab_user_id,))
-            
-            conn.commit()
+
+        run_write(store_tab_user)
         
         # Invalidate cache for all users to ensure changes take effect immediately
         invalidate_user_cache()
@@ -1996,20 +4814,26 @@ def get_user_podcasts(user_id):
             
             # 1. If viewing admin user, return all podcasts
             if is_user_admin:
-                podcasts = conn.execute("""
-                    SELECT p.*, u.display_name as user_display_name 
+                podcasts = conn.execute(f"""
+                    SELECT p.*, f.image_url, f.description, u.display_name as user_display_name,
+                        {UNREAD_COUNT} as unread_count
                     FROM Podcasts p
+                    JOIN Feeds f ON p.feed_id = f.id
                     LEFT JOIN Users u ON p.user_id = u.id
+                    LEFT JOIN ListenedCounts lc ON lc.user_id = ? AND lc.feed_id = p.feed_id
                     ORDER BY p.naslov
-                """).fetchall()
+                """, (user_id,)).fetchall()
                 logger.info(f"I am returning all podcasts for the admin user. {user_id}")
                 
             # 2. If current user is admin or viewing their own podcasts
             elif is_current_admin or is_self_view:
-                podcasts = conn.execute("""
-                    SELECT p.*, u.display_name as user_display_name 
+                podcasts = conn.execute(f"""
+                    SELECT p.*, f.image_url, f.description, u.display_name as user_display_name,
+                        {UNREAD_COUNT} as unread_count
                     FROM Podcasts p
+                    JOIN Feeds f ON p.feed_id = f.id
                     LEFT JOIN Users u ON p.user_id = u.id
+                    LEFT JOIN ListenedCounts lc ON lc.user_id = p.user_id AND lc.feed_id = p.feed_id
                     WHERE p.user_id = ?
                     ORDER BY p.naslov
                 """, (user_id,)).fetchall()
@@ -2018,33 +4842,39 @@ def get_user_podcasts(user_id):
             # 3. If current user is tab user
             elif is_current_tab_user:
                 # Tab user can see all podcasts of selected user + public podcasts
-                podcasts = conn.execute("""
+                podcasts = conn.execute(f"""
                     SELECT 
                         p.id,
                         p.naslov,
                         p.rss_url,
                         p.datum_naročnine,
-                        p.image_url,
-                        p.description,
+                        f.image_url,
+                        f.description,
                         p.user_id,
                         p.is_public,
-                        u.display_name as user_display_name
+                        u.display_name as user_display_name,
+                        {UNREAD_COUNT} as unread_count
                     FROM Podcasts p
+                    JOIN Feeds f ON p.feed_id = f.id
                     LEFT JOIN Users u ON p.user_id = u.id
+                    LEFT JOIN ListenedCounts lc ON lc.user_id = ? AND lc.feed_id = p.feed_id
                     LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
                     WHERE (p.user_id = ? OR p.is_public = 1)
                     AND (pvp.hidden IS NULL OR pvp.hidden = 0)
                     ORDER BY p.naslov
-                """, (user_id, user_id)).fetchall()
+                """, (user_id, user_id, user_id)).fetchall()
                 logger.info(f"Tab user {current_user['id']} is watching podcasts by user {user_id} (found: {len(podcasts)})")
                 
             # 4. Other cases (regular users viewing other users)
             else:
                 # Show only public podcasts of this user
-                podcasts = conn.execute("""
-                    SELECT p.*, u.display_name as user_display_name
+                podcasts = conn.execute(f"""
+                    SELECT p.*, f.image_url, f.description, u.display_name as user_display_name,
+                        {UNREAD_COUNT} as unread_count
                     FROM Podcasts p
+                    JOIN Feeds f ON p.feed_id = f.id
                     LEFT JOIN Users u ON p.user_id = u.id
+                    LEFT JOIN ListenedCounts lc ON lc.user_id = p.user_id AND lc.feed_id = p.feed_id
                     WHERE p.user_id = ? AND p.is_public = 1
                     ORDER BY p.naslov
                
@@ -2092,51 +4922,35 @@ def get_user_latest_episodes(user_id):
                 if is_self_view or is_current_tab_user:
                     # For own podcasts or as tab user, consider hidden podcasts
                     podcast_filter += " AND (pvp.hidden IS NULL OR pvp.hidden = 0)"
-                    params = (user_id, current_user['id'], user_id, limit)
-                else:
-                    # As admin, viewing all user's podcasts (without filtering hidden)
-                    params = (user_id, user_id, limit)
             else:
                 # Can see only public podcasts of the user (considering hidden podcasts)
                 podcast_filter = """
                     AND p.user_id = ? AND p.is_public = 1
                     AND (pvp.hidden IS NULL OR pvp.hidden = 0)
                 """
-                params = (user_id, current_user['id'], user_id, limit)
+            params = (current_user['id'], user_id, limit)
             
-            # For each podcast, get the latest unlistened episode
+            # For each podcast, get the latest episode
             query = f"""
-                WITH LatestEpisodes AS (
-                    SELECT 
-                        e.*,
-                        p.naslov as podcast_naslov,
-                        p.image_url,
-                        COALESCE(els.poslušano, 0) as uporabnik_poslušal,
-                        ROW_NUMBER() OVER (PARTITION BY e.podcast_id ORDER BY datetime(e.datum_izdaje) DESC) as rn
-                    FROM Episodes e
-                    JOIN Podcasts p ON e.podcast_id = p.id
-                    LEFT JOIN EpisodeListenStatus els ON e.id = els.episode_id AND els.user_id = ?
-                    LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
-                    WHERE e.izbrisano IS NOT 1 {podcast_filter}
-                )
-                SELECT * FROM LatestEpisodes
-                WHERE rn = 1
-                ORDER BY datetime(datum_izdaje) DESC
+                SELECT
+                    e.*,
+                    p.id as podcast_id,
+                    p.naslov as podcast_naslov,
+                    f.image_url
+                FROM LatestEpisodes le
+                JOIN Podcasts p ON p.feed_id = le.feed_id
+                JOIN Episodes e ON e.id = ({SUBSCRIPTION_LATEST_EPISODE})
+                JOIN Feeds f ON f.id = le.feed_id
+                LEFT JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id AND pvp.user_id = ?
+                WHERE 1 = 1 {podcast_filter}
+                ORDER BY le.pub_epoch DESC, le.episode_id DESC
                 LIMIT ?
             """
             
             episodes = conn.execute(query, params).fetchall()
             logger.info(f"Found {len(episodes)} episodes for the user {user_id}")
             
-        result = []
-        for episode in episodes:
-            ep_dict = dict(episode)
-            # Remove helper columns
-            for key in ['rn', 'uporabnik_poslušal']:
-                if key in ep_dict:
-                    del ep_dict[key]
-            result.append(ep_dict)
-        return jsonify(result)
+        return jsonify([dict(episode) for episode in episodes])
     except Exception as e:
         logger.error(f"Napaka pri pridobivanju zadnjih epizod uporabnika: {e}")
         return jsonify({"error": str(e)}), 500
@@ -2168,12 +4982,49 @@ def update_podcast_visibility(podcast_id):
         conn.close()
         return jsonify({"error": "Nimate dovoljenja za urejanje tega podcasta."}), 403
 
-    conn.execute("UPDATE Podcasts SET is_public = ? WHERE id = ?", (is_public, podcast_id))
-    conn.commit()
     conn.close()
+    execute_write("UPDATE Podcasts SET is_public = ? WHERE id = ?", (is_public, podcast_id))
 
     return jsonify({"message": "Vidnost podcasta uspešno posodobljena."}), 200
 
+# API for setting which episodes of a podcast are kept
+@app.route('/api/podcasts/<int:podcast_id>/retention', methods=['PATCH'])
+def update_podcast_retention(podcast_id):
+    """keep_episodes and keep_days are positive integers, null keeps all episodes"""
+    data = request.get_json(silent=True) or {}
+    keep_episodes = data.get('keep_episodes')
+    keep_days = data.get('keep_days')
+    for name, value in (('keep_episodes', keep_episodes), ('keep_days', keep_days)):
+        if value is not None and (type(value) is not int or value < 1):
+            return jsonify({"error": f"Parameter '{name}' mora biti pozitivno celo število."}), 400
+
+    username = get_current_user()
+    user = get_user_from_db(username)
+
+    if not user:
+        return jsonify({"error": "Napaka pri preverjanju uporabnika."}), 500
+
+    with get_db_connection() as conn:
+        podcast = conn.execute("SELECT id, user_id, feed_id FROM Podcasts WHERE id = ?", (podcast_id,)).fetchone()
+
+    if not podcast:
+        return jsonify({"error": "Podcast ne obstaja."}), 404
+
+    # Check if user has permission to edit podcast
+    if podcast['user_id'] != user['id'] and not user['is_admin']:
+        return jsonify({"error": "Nimate dovoljenja za urejanje tega podcasta."}), 403
+
+    execute_write("UPDATE Podcasts SET keep_episodes = ?, keep_days = ? WHERE id = ?",
+                  (keep_episodes, keep_days, podcast_id))
+
+    # Apply the new policy now instead of at the next maintenance run
+    job_id = None
+    if keep_episodes is not None or keep_days is not None:
+        job_id, _ = submit_job('maintenance', f"maintenance:{podcast['feed_id']}",
+                               {'feed_ids': [podcast['feed_id']]}, user['id'])
+
+    return jsonify({"message": "Hramba epizod podcasta uspešno posodobljena.", "job_id": job_id}), 200
+
 # API for hiding podcast for current user
 @app.route('/api/podcasts/<int:podcast_id>/hide', methods=['POST'])
 def hide_podcast(podcast_id):
@@ -2190,30 +5041,14 @@ def hide_podcast(podcast_id):
     if not podcast:
         conn.close()
         return jsonify({"error": "Podcast ne obstaja."}), 404
-    
-        
-    # Check if visibility record already exists
-    visibility = conn.execute("""
-        SELECT * FROM PodcastVisibilityPreferences 
-        WHERE podcast_id = ? AND user_id = ?
-    """, (podcast_id, user['id'])).fetchone()
-    
-    if visibility:
-        # Update existing record
-        conn.execute("""
-            UPDATE PodcastVisibilityPreferences
-            SET hidden = 1
-            WHERE podcast_id = ? AND user_id = ?
-        """, (podcast_id, user['id']))
-    else:
-        # Create new record
-        conn.execute("""
-            INSERT INTO PodcastVisibilityPreferences (podcast_id, user_id, hidden)
-            VALUES (?, ?, 1)
-        """, (podcast_id, user['id']))
-    
-    conn.commit()
     conn.close()
+
+    # Create the visibility record or update the existing one
+    execute_write("""
+        INSERT INTO PodcastVisibilityPreferences (podcast_id, user_id, hidden)
+        VALUES (?, ?, 1)
+        ON CONFLICT(podcast_id, user_id) DO UPDATE SET hidden = 1
+    """, (podcast_id, user['id']))
     
     logger.info(f"User {user['username']} hid the podcast {podcast_id}")
     return jsonify({"message": "Podcast successfully hidden."}), 200
@@ -2234,16 +5069,14 @@ def show_podcast(podcast_id):
     if not podcast:
         conn.close()
         return jsonify({"error": "Podcast ne obstaja."}), 404
+    conn.close()
     
     # Delete or update visibility record
-    conn.execute("""
+    execute_write("""
         DELETE FROM PodcastVisibilityPreferences
         WHERE podcast_id = ? AND user_id = ?
     """, (podcast_id, user['id']))
     
-    conn.commit()
-    conn.close()
-    
     logger.info(f"User {user['username']} showed a podcast {podcast_id}")
     return jsonify({"message": "Podcast successfully displayed."}), 200
 
@@ -2260,8 +5093,9 @@ def get_hidden_podcasts():
     
     # Get all hidden podcasts
     podcasts = conn.execute("""
-        SELECT p.*, u.display_name as user_display_name 
+        SELECT p.*, f.image_url, f.description, u.display_name as user_display_name 
         FROM Podcasts p
+        JOIN Feeds f ON p.feed_id = f.id
         LEFT JOIN Users u ON p.user_id = u.id
         JOIN PodcastVisibilityPreferences pvp ON p.id = pvp.podcast_id
         WHERE pvp.user_id = ? AND pvp.hidden = 1
@@ -2295,15 +5129,13 @@ def update_user_admin_status():
             if not user:
                 return jsonify({"error": "Uporabnik ne obstaja"}), 404
 
-            conn.execute("""
-                UPDATE Users 
-                SET is_admin = ?
-                WHERE id = ?
-            """, (is_admin, user_id))
-            conn.commit()
+        execute_write("""
+            UPDATE Users 
+            SET is_admin = ?
+            WHERE id = ?
+        """, (is_admin, user_id))
+        logger.info(f"Updated admin status for user {user_id} on {is_admin}")
 
-            logger.info(f"Updated admin status for user {user_id} on {is_admin}")
-            
         return jsonify({
             "message": "Admin status successfully updated",
             "user_id": user_id,
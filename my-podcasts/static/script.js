@@ -206,15 +206,23 @@ document.addEventListener('DOMContentLoaded', () => {
                 });
 
                 if (response.ok) {
+                    const { job_id } = await response.json();
                     showToast(window.i18n.t('messages.podcast_added'));
                     loadPodcasts();
                     podcastForm.reset();
-                    // Also re-download the latest episodes as a new podcast may be added
-                    if (latestEpisodesList) {
-                        loadLatestEpisodes();
-                    }
-                    // Reloads paused episodes as well
-                    loadPausedEpisodes();
+                    // Episodes are imported in the background, reload the lists once the import is done
+                    waitForJob(job_id).then(job => {
+                        if (job.status === 'failed') {
+                            showToast(job.errors.join(', ') || 'Error importing podcast.', 'error');
+                        }
+                        loadPodcasts();
+                        // Also re-download the latest episodes as a new podcast may be added
+                        if (latestEpisodesList) {
+                            loadLatestEpisodes();
+                        }
+                        // Reloads paused episodes as well
+                        loadPausedEpisodes();
+                    }).catch(error => showToast(error.message, 'error'));
                 } else {
                     const error = await response.json();
                     throw new Error(error.error || 'Error adding podcast.');
@@ -274,6 +282,7 @@ document.addEventListener('DOMContentLoaded', () => {
         
                             <div class="podcast-status-row">
                                 ${podcast.is_public ? `<span class="public-badge">${window.i18n.t('forms.public_podcast_short') || 'Public'}</span>` : ''}
+                                ${podcast.unread_count > 0 ? `<span class="unread-badge" title="${window.i18n.t('forms.unread_episodes')}">${podcast.unread_count}</span>` : ''}
                                 ${showHideButton ? `
                                     <button onclick="hidePodcast(${podcast.id}, this)" class="hide-btn" title="${window.i18n.t('navigation.hide')}">
                                         <span class="hide-icon">🚫</span>
@@ -453,6 +462,24 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Wait for a background job to finish and return its final state
+    async function waitForJob(jobId, onProgress) {
+        while (true) {
+            const response = await fetch(`${ingressBase}/api/jobs/${jobId}`);
+            if (!response.ok) {
+                throw new Error('Error fetching job status.');
+            }
+            const job = await response.json();
+            if (onProgress) {
+                onProgress(job);
+            }
+            if (job.status === 'done' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     // Update all podcasts
     window.updateAllPodcasts = async function() {
         try {
@@ -467,6 +494,15 @@ document.addEventListener('DOMContentLoaded', () => {
             });
 
             if (response.ok) {
+                const { job_id } = await response.json();
+                const job = await waitForJob(job_id, job => {
+                    if (job.feeds_total) {
+                        updateButton.textContent = `Updating... ${job.feeds_done}/${job.feeds_total}`;
+                    }
+                });
+                if (job.status === 'failed') {
+                    throw new Error('Error updating podcasts.');
+                }
                 showToast(window.i18n.t('messages.all_podcasts_updated'));
                 await loadPodcasts();
                 // Reload the latest episodes too
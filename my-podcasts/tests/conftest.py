@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+import websockets
+
+# main.py opens its database and starts its threads on import, so the test
+# database has to be chosen before the first test module imports it
+os.environ['MY_PODCASTS_DB'] = os.path.join(tempfile.mkdtemp(prefix='mypodcasts-test-'), 'mypodcasts.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def main():
+    import main
+    return main
+
+
+@pytest.fixture(scope='session')
+def client(main):
+    return main.app.test_client()
+
+
+TOKEN = 'test-token'
+
+
+class FakeHomeAssistant:
+    """Stand-in for the Home Assistant WebSocket API: authentication, results in any order and events"""
+
+    def __init__(self):
+        self.token = TOKEN
+        self.connections = 0
+        self.messages = []
+        self.drop_next = False
+        self.fail_subscriptions = False
+        self.delay = 0  # seconds added before every result
+        self.connected = set()
+        self.subscribers = {}  # {message id of a subscribe command: websocket}
+        self.replies = set()  # tasks sending results
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        threading.Thread(target=self.serve, args=(started,), daemon=True).start()
+        started.wait()
+
+    def serve(self, started):
+        asyncio.set_event_loop(self.loop)
+
+        async def run():
+            self.server = await websockets.serve(self.handle, '127.0.0.1', 0)
+            self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+            started.set()
+            await self.server.wait_closed()
+
+        self.loop.run_until_complete(run())
+
+    async def handle(self, websocket):
+        self.connections += 1
+        try:
+            await self.converse(websocket)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connected.discard(websocket)
+
+    async def converse(self, websocket):
+        await websocket.send(json.dumps({'type': 'auth_required'}))
+        auth = json.loads(await websocket.recv())
+        if auth.get('access_token') != self.token:
+            await websocket.send(json.dumps({'type': 'auth_invalid', 'message': 'Invalid access token'}))
+            return
+        await websocket.send(json.dumps({'type': 'auth_ok'}))
+        self.connected.add(websocket)
+
+        async def reply(message, delay):
+            await asyncio.sleep(self.delay + delay)
+            if self.fail_subscriptions and message['type'].startswith('subscribe_'):
+                await websocket.send(json.dumps({'id': message['id'], 'type': 'result', 'success': False,
+                                                 'error': {'code': 'unknown_error', 'message': 'Unknown error'}}))
+                return
+            await websocket.send(json.dumps({'id': message['id'], 'type': 'result', 'success': True,
+                                             'result': message.get('service_data')}))
+
+        async for raw in websocket:
+            message = json.loads(raw)
+            self.messages.append(message)
+            if self.drop_next:
+                self.drop_next = False
+                await websocket.close()
+                return
+            if message['type'].startswith('subscribe_') and not self.fail_subscriptions:
+                self.subscribers[message['id']] = websocket
+            # Later commands are answered first, so results arrive out of order
+            task = asyncio.ensure_future(reply(message, 0.05 if message['id'] % 2 else 0))
+            self.replies.add(task)
+            task.add_done_callback(self.replies.discard)
+
+    def drop(self):
+        """Closes every connection"""
+        async def close():
+            for websocket in list(self.connected):
+                await websocket.close()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(5)
+
+    def close(self):
+        """Stops the server; results that were not sent yet are dropped"""
+        async def close():
+            for task in list(self.replies):
+                task.cancel()
+            await asyncio.gather(*self.replies, return_exceptions=True)
+            self.server.close()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(5)
+
+    def send_event(self, event):
+        async def send():
+            for message_id, websocket in list(self.subscribers.items()):
+                try:
+                    await websocket.send(json.dumps({'id': message_id, 'type': 'event', 'event': event}))
+                except websockets.ConnectionClosed:
+                    self.subscribers.pop(message_id)
+
+        asyncio.run_coroutine_threadsafe(send(), self.loop).result(5)
+
+
+@pytest.fixture
+def fake_ha(main, monkeypatch):
+    monkeypatch.setattr(main, 'HA_RECONNECT_DELAYS', (0.1, 0.2))
+    ha = FakeHomeAssistant()
+    yield ha
+    ha.close()
+
+
+@pytest.fixture
+def ha_client(main, fake_ha):
+    client = main.HomeAssistantWebSocket(fake_ha.url, token=TOKEN)
+    yield client
+    if client.loop:
+        asyncio.run_coroutine_threadsafe(cancel_tasks(), client.loop).result(5)
+        client.loop.call_soon_threadsafe(client.loop.stop)
+
+
+async def cancel_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.02)
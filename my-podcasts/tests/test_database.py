@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+WRITER_THREADS = 8
+WRITES_PER_THREAD = 40
+
+
+def test_pooled_connection_is_reused_with_pragmas(main):
+    conn = main.get_db_connection()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    conn.close()
+    conn.close()  # second close does nothing
+    with main.get_db_connection() as again:
+        assert again is conn
+
+
+def test_threads_never_share_a_connection(main):
+    checked_out = []
+    barrier = threading.Barrier(6)
+
+    def read():
+        with main.get_db_connection() as conn:
+            barrier.wait()  # all six connections are checked out at once
+            checked_out.append(id(conn))
+            conn.execute("SELECT COUNT(*) FROM Episodes").fetchone()
+
+    threads = [threading.Thread(target=read) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(checked_out)) == 6
+    assert len(main.DB_POOL) <= main.DB_POOL_SIZE
+
+
+def test_failed_write_is_rolled_back_alone(main):
+    def fail(conn):
+        conn.execute("INSERT INTO Users (username, display_name) VALUES ('rolled_back', 'Rolled back')")
+        raise ValueError("write failed")
+
+    failed = main.submit_write(fail)
+    stored = main.submit_write(lambda conn: conn.execute(
+        "INSERT INTO Users (username, display_name) VALUES ('kept', 'Kept')").lastrowid)
+
+    with pytest.raises(ValueError):
+        failed.result()
+    assert stored.result()
+    with main.get_db_connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT username FROM Users WHERE username IN ('rolled_back', 'kept')")}
+    assert names == {'kept'}
+
+
+@pytest.fixture
+def podcast(main):
+    def add(conn):
+        feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES ('stress/feed', 'http://stress/feed')").lastrowid
+        user_id = conn.execute("INSERT INTO Users (username, display_name) VALUES ('stress', 'Stress')").lastrowid
+        podcast_id = conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, feed_id)
+                                     VALUES ('stress', 'http://stress/feed', datetime('now'), ?, ?)""",
+                                  (user_id, feed_id)).lastrowid
+        conn.executemany("""INSERT INTO Episodes (feed_id, guid, naslov, datum_izdaje, url)
+                            VALUES (?, ?, ?, '2024-01-01 10:00:00', ?)""",
+                         [(feed_id, f"s{n}", f"stress {n}", f"http://stress/{n}.mp3") for n in range(50)])
+        episode_ids = [row[0] for row in conn.execute("SELECT id FROM Episodes WHERE feed_id = ?", (feed_id,))]
+        return podcast_id, episode_ids
+
+    return main.run_write(add)
+
+
+def test_position_writes_during_large_import(main, client, podcast, monkeypatch):
+    """
+    Hundreds of position and listened writes while two imports store 2,000 episodes each,
+    without 'database is locked'. A position write waits for at most one import chunk.
+    """
+    podcast_id, episode_ids = podcast
+    monkeypatch.setattr(main, 'POSITION_FLUSH_INTERVAL', 0)  # every position is written at once
+    headers = {'X-Remote-User-Name': 'stress'}
+    failures = []
+
+    # Import chunks started on the writer while each position or listened write was waiting
+    chunks_started = 0
+    chunks_waited_for = []
+    shared_transactions = []
+    apply_writes, submit_write = main.apply_writes, main.submit_write
+
+    def count_chunks(conn, batch):
+        nonlocal chunks_started
+        if any(func.__name__ == 'store_episodes' for func, _, _ in batch):
+            chunks_started += 1
+            if len(batch) > 1:
+                shared_transactions.append(len(batch))
+        return apply_writes(conn, batch)
+
+    def submit_counted(func, *args):
+        started = chunks_started
+        future = submit_write(func, *args)
+        future.add_done_callback(lambda _: chunks_waited_for.append(chunks_started - started))
+        return future
+
+    monkeypatch.setattr(main, 'apply_writes', count_chunks)
+    monkeypatch.setattr(main, 'submit_write', submit_counted)
+
+    def post_positions(n):
+        for i in range(WRITES_PER_THREAD):
+            episode_id = episode_ids[(n * 7 + i) % len(episode_ids)]
+            if i % 5 == 4:
+                response = client.post(f'/api/episodes/mark_listened/{episode_id}', headers=headers, json={})
+            else:
+                response = client.post(f'/api/episodes/{episode_id}/position', headers=headers, json={'position': i})
+            if response.status_code != 200:
+                failures.append(response.get_data(as_text=True))
+
+    job_ids = []
+    for name in ('stress', 'stress-2'):
+        episodes = [{'naslov': f"{name} import {n}", 'url': f"http://stress/{name}/{n}.mp3",
+                     'datum_izdaje': f"Mon, 0{1 + n % 9} Jan 2029 10:{n % 60:02d}:00 +0000"} for n in range(2000)]
+        job_ids.append(main.submit_job('import_xml', name, {'podcast_id': podcast_id, 'episodes': episodes})[0])
+    threads = [threading.Thread(target=post_positions, args=(n,)) for n in range(WRITER_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    deadline = time.time() + 60
+    with main.get_db_connection() as conn:
+        for job_id in job_ids:
+            while conn.execute("SELECT status FROM Jobs WHERE id = ?", (job_id,)).fetchone()[0] not in ('done', 'failed'):
+                assert time.time() < deadline
+                time.sleep(0.05)
+        jobs = [tuple(conn.execute("SELECT status, errors FROM Jobs WHERE id = ?", (job_id,)).fetchone())
+                for job_id in job_ids]
+        episode_count = conn.execute("SELECT COUNT(*) FROM Episodes e JOIN Podcasts p ON p.feed_id = e.feed_id "
+                                     "WHERE p.id = ?", (podcast_id,)).fetchone()[0]
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+
+    assert not failures
+    assert jobs == [('done', None), ('done', None)]
+    assert episode_count == 4050
+    assert integrity == 'ok'
+    assert chunks_started == 2 * 2000 // main.IMPORT_CHUNK_SIZE
+    assert not shared_transactions
+    assert chunks_waited_for
+    assert max(chunks_waited_for) <= 1
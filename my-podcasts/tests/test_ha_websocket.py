@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from conftest import TOKEN, wait_until
+
+def seek(n):
+    return {'type': 'call_service', 'domain': 'media_player', 'service': 'media_seek', 'service_data': {'n': n}}
+
+
+def test_concurrent_commands_share_one_connection(fake_ha, ha_client):
+    results = {}
+
+    def send(first):
+        for n in range(first, first + 20):
+            results[n] = ha_client.submit(seek(n)).result(5)['result']['n']
+
+    threads = [threading.Thread(target=send, args=(k * 100,)) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 80 and all(n == result for n, result in results.items())
+    assert fake_ha.connections == 1
+    ids = [message['id'] for message in fake_ha.messages]
+    assert len(set(ids)) == len(ids)
+
+
+def test_reconnects_after_the_connection_drops(fake_ha, ha_client):
+    assert ha_client.submit(seek(1)).result(5)['success']
+
+    fake_ha.drop_next = True
+    with pytest.raises(ConnectionError):
+        ha_client.submit(seek(2)).result(5)
+    assert ha_client.submit(seek(3)).result(5)['result'] == {'n': 3}
+    assert fake_ha.connections == 2
+
+
+def test_waits_for_authentication_to_succeed_again(fake_ha, ha_client):
+    assert ha_client.submit(seek(1)).result(5)['success']
+
+    fake_ha.token = 'rotated'
+    fake_ha.drop_next = True
+    with pytest.raises(ConnectionError):
+        ha_client.submit(seek(2)).result(5)
+    with pytest.raises(ConnectionError):
+        ha_client.submit(seek(3), timeout=0.5).result(5)
+
+    fake_ha.token = TOKEN
+    assert ha_client.submit(seek(4)).result(5)['result'] == {'n': 4}
+    assert fake_ha.connections >= 3
+
+
+def test_subscription_is_renewed_after_reconnect(fake_ha, ha_client):
+    events = []
+    key = ha_client.subscribe({'type': 'subscribe_events', 'event_type': 'state_changed'}, events.append).result(5)
+    wait_until(lambda: ha_client.subscriptions[key]['id'] is not None)
+    fake_ha.send_event({'n': 1})
+
+    fake_ha.drop_next = True
+    with pytest.raises(ConnectionError):
+        ha_client.submit(seek(1)).result(5)
+    wait_until(lambda: ha_client.subscriptions[key]['id'] is not None)
+    fake_ha.send_event({'n': 2})
+
+    wait_until(lambda: len(events) == 2)
+    assert events == [{'n': 1}, {'n': 2}]
+    assert [message['type'] for message in fake_ha.messages].count('subscribe_events') == 2
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+
+def add_job(main, dedupe_key, status='queued', finished_days_ago=None, params='{"episodes": []}'):
+    finished_at = f"-{finished_days_ago} days" if finished_days_ago is not None else None
+    return main.run_write(lambda conn: conn.execute("""
+        INSERT INTO Jobs (kind, dedupe_key, params, status, finished_at)
+        VALUES ('maintenance', ?, ?, ?, CASE WHEN ? IS NOT NULL THEN datetime('now', ?) END)
+    """, (dedupe_key, params, status, finished_at, finished_at)).lastrowid)
+
+
+def test_finished_job_drops_its_parameters(main, client):
+    def add_podcast(conn):
+        feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES ('jobs/feed', 'http://jobs/feed')").lastrowid
+        user_id = conn.execute("INSERT INTO Users (username, display_name) VALUES ('jobs', 'Jobs')").lastrowid
+        return conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, feed_id)
+                               VALUES ('jobs', 'http://jobs/feed', datetime('now'), ?, ?)""", (user_id, feed_id)).lastrowid
+
+    podcast_id = main.run_write(add_podcast)
+    episodes = [{'naslov': f"jobs {n}", 'url': f"http://jobs/{n}.mp3",
+                 'datum_izdaje': 'Mon, 01 Jan 2029 10:00:00 +0000'} for n in range(10)]
+    job_id, _ = main.submit_job('import_xml', 'jobs', {'podcast_id': podcast_id, 'episodes': episodes})
+
+    deadline = time.time() + 30
+    with main.get_db_connection() as conn:
+        while conn.execute("SELECT status FROM Jobs WHERE id = ?", (job_id,)).fetchone()[0] not in ('done', 'failed'):
+            assert time.time() < deadline
+            time.sleep(0.05)
+        job = conn.execute("SELECT status, params FROM Jobs WHERE id = ?", (job_id,)).fetchone()
+    assert tuple(job) == ('done', None)
+    assert client.get(f'/api/jobs/{job_id}').get_json()['result']['added_count'] == 10
+
+
+def test_old_finished_jobs_are_pruned(main):
+    old = add_job(main, 'prune-old', 'failed', finished_days_ago=main.JOBS_KEEP_DAYS + 1)
+    recent = add_job(main, 'prune-recent', 'done', finished_days_ago=1)
+    running = add_job(main, 'prune-running', 'running')
+    last_maintenance = add_job(main, 'maintenance', 'done', finished_days_ago=main.JOBS_KEEP_DAYS + 5)
+
+    main.run_write(main.prune_finished_jobs)
+
+    with main.get_db_connection() as conn:
+        jobs = dict(conn.execute(f"SELECT id, params FROM Jobs WHERE id IN ({old}, {recent}, {running}, {last_maintenance})"))
+    assert jobs == {recent: None, running: '{"episodes": []}', last_maintenance: None}
+
+
+@pytest.fixture
+def job_streams(main, client):
+    """Opens event streams of a job for users; all are closed afterwards"""
+    job_id = add_job(main, 'streams')
+    responses = []
+
+    def open_stream(username):
+        response = client.get(f'/api/jobs/{job_id}/events', headers={'X-Remote-User-Name': username}, buffered=False)
+        responses.append(response)
+        return response.status_code
+
+    yield open_stream
+    for response in reversed(responses):  # request contexts of unread streams are nested
+        response.close()
+    assert main.JOB_EVENT_STREAMS == {}
+
+
+def test_event_streams_are_shared_between_users(main, job_streams):
+    assert main.JOB_EVENTS_MAX_STREAMS == main.GUNICORN_THREADS // 2
+    per_user = main.JOB_EVENTS_MAX_STREAMS_PER_USER
+    assert [job_streams('stream_a') for _ in range(per_user + 1)] == [200] * per_user + [204]
+    # A second user still gets a stream while the first one has all of theirs
+    assert job_streams('stream_b') == 200
+    while sum(main.JOB_EVENT_STREAMS.values()) < main.JOB_EVENTS_MAX_STREAMS:
+        assert job_streams(f"stream_{sum(main.JOB_EVENT_STREAMS.values())}") == 200
+    assert job_streams('stream_c') == 204
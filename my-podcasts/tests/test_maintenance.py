@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+
+def add_shared_feed(main, prefix, episodes):
+    """Two users, each subscribed to one feed with described episodes"""
+    def add(conn):
+        feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES (?, ?)",
+                               (f"{prefix}/feed", f"http://{prefix}/feed")).lastrowid
+        podcasts = {}
+        for username in (f"{prefix}_a", f"{prefix}_b"):
+            user_id = conn.execute("INSERT INTO Users (username, display_name) VALUES (?, ?)",
+                                   (username, username)).lastrowid
+            podcasts[username] = conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, feed_id, is_public)
+                                                 VALUES (?, ?, datetime('now'), ?, ?, 1)""",
+                                              (prefix, f"http://{prefix}/feed", user_id, feed_id)).lastrowid
+        episode_ids = [conn.execute("""INSERT INTO Episodes (feed_id, guid, naslov, datum_izdaje, url, opis, opis_hash)
+                                       VALUES (?, ?, ?, '2024-01-01 10:00:00', ?, 'A long description', 'hash')""",
+                                    (feed_id, f"{prefix}-{n}", f"{prefix} {n}", f"http://{prefix}/{n}.mp3")).lastrowid
+                       for n in range(episodes)]
+        conn.execute("UPDATE Feeds SET episode_count = ? WHERE id = ?", (episodes, feed_id))
+        return podcasts, episode_ids
+
+    return main.run_write(add)
+
+
+@pytest.fixture
+def shared_feed(main):
+    return add_shared_feed(main, 'purge', 2)
+
+
+def run_maintenance(main):
+    job_id, _ = main.submit_job('maintenance', f"maintenance:test:{time.monotonic()}")
+    deadline = time.time() + 30
+    with main.get_db_connection() as conn:
+        while conn.execute("SELECT status FROM Jobs WHERE id = ?", (job_id,)).fetchone()[0] not in ('done', 'failed'):
+            assert time.time() < deadline
+            time.sleep(0.05)
+        assert conn.execute("SELECT status FROM Jobs WHERE id = ?", (job_id,)).fetchone()[0] == 'done'
+
+
+def get_episode(main, episode_id):
+    with main.get_db_connection() as conn:
+        return conn.execute("SELECT guid, opis, opis_hash, izbrisano FROM Episodes WHERE id = ?", (episode_id,)).fetchone()
+
+
+def test_episode_deleted_by_every_subscription_is_purged(main, client, shared_feed):
+    podcasts, (deleted_id, kept_id) = shared_feed
+    response = client.post(f'/api/episodes/{deleted_id}/delete', headers={'X-Remote-User-Name': 'purge_a'})
+    assert response.status_code == 200
+    run_maintenance(main)
+    assert get_episode(main, deleted_id)['opis'] == 'A long description'  # purge_b still has it
+
+    response = client.post(f'/api/episodes/{deleted_id}/delete', headers={'X-Remote-User-Name': 'purge_b'})
+    assert response.status_code == 200
+    run_maintenance(main)
+
+    episode = get_episode(main, deleted_id)
+    assert episode['opis'] is None
+    assert episode['guid'] == 'purge-0'
+    assert episode['opis_hash'] == 'hash'  # a refresh does not store the description again
+    assert get_episode(main, kept_id)['opis'] == 'A long description'
+    with main.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM DeletedEpisodes WHERE episode_id = ?", (deleted_id,)).fetchone()[0] == 2
+    for username, podcast_id in podcasts.items():
+        episodes = client.get(f'/api/episodes/{podcast_id}', headers={'X-Remote-User-Name': username}).get_json()
+        assert [episode['id'] for episode in episodes] == [kept_id]
+
+
+def get_unread_counts(client, username):
+    podcasts = client.get('/api/podcasts', headers={'X-Remote-User-Name': username}).get_json()
+    return {podcast['id']: podcast['unread_count'] for podcast in podcasts if podcast['naslov'] == 'unread'}
+
+
+def test_unread_counts_follow_deletes_and_listens(main, client):
+    podcasts, (first_id, second_id, third_id) = add_shared_feed(main, 'unread', 3)
+    a, b = podcasts['unread_a'], podcasts['unread_b']
+
+    def post(path, username):
+        assert client.post(path, headers={'X-Remote-User-Name': username}, json={}).status_code == 200
+
+    post(f'/api/episodes/mark_listened/{first_id}', 'unread_a')
+    post(f'/api/episodes/mark_listened/{second_id}', 'unread_b')
+    post(f'/api/episodes/{first_id}/delete', 'unread_a')  # listened by its owner
+    post(f'/api/episodes/{second_id}/delete', 'unread_a')  # listened by another user
+    post(f'/api/episodes/{second_id}/delete', 'unread_a')  # again, without effect
+    assert get_unread_counts(client, 'unread_a') == {a: 1, b: 3}
+    assert get_unread_counts(client, 'unread_b') == {a: 1, b: 2}
+
+    post(f'/api/episodes/mark_listened/{first_id}', 'unread_b')  # already deleted from a
+    assert get_unread_counts(client, 'unread_b') == {a: 1, b: 1}
+
+    main.run_write(main.soft_delete_episode, first_id)
+    assert get_unread_counts(client, 'unread_a') == {a: 1, b: 2}
+    assert get_unread_counts(client, 'unread_b') == {a: 1, b: 1}
+
+    # The maintained counters match a recount
+    def read_counters():
+        with main.get_db_connection() as conn:
+            return (conn.execute("SELECT id, deleted_count FROM Podcasts WHERE id IN (?, ?) ORDER BY id", (a, b)).fetchall(),
+                    conn.execute("""SELECT user_id, podcast_id, listened FROM DeletedListenedCounts
+                                    WHERE podcast_id IN (?, ?) AND listened != 0 ORDER BY 1, 2""", (a, b)).fetchall())
+    counters = [list(map(tuple, rows)) for rows in read_counters()]
+    main.run_write(main.rebuild_deleted_counts)
+    assert [list(map(tuple, rows)) for rows in read_counters()] == counters
+    assert counters[0] == [(a, 1), (b, 0)]
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from conftest import TOKEN, wait_until
+
+STATES = [
+    {'entity_id': 'media_player.kitchen', 'state': 'idle', 'attributes': {'friendly_name': 'Kitchen', 'volume_level': 0.2}},
+    {'entity_id': 'media_player.office', 'state': 'off', 'attributes': {}},
+    {'entity_id': 'sensor.power', 'state': '12', 'attributes': {'unit_of_measurement': 'W'}},
+]
+
+
+class FakeResponse:
+    ok = True
+    status_code = 200
+
+    def json(self):
+        return STATES
+
+
+@pytest.fixture
+def catalogue(main, fake_ha, ha_client, monkeypatch):
+    """Empty media player catalogue, loaded from STATES and followed through the fake Home Assistant"""
+    fetches = []
+
+    def get(url, headers=None, timeout=None):
+        fetches.append(url)
+        return FakeResponse()
+
+    monkeypatch.setenv('SUPERVISOR_TOKEN', TOKEN)
+    monkeypatch.setattr(main.HA_SESSION, 'get', get)
+    monkeypatch.setattr(main, 'HA_WEBSOCKET', ha_client)
+    for name, value in (('MEDIA_PLAYERS', None), ('media_players_loaded_at', 0), ('media_players_subscription', None),
+                        ('media_players_followed', []), ('media_players_registry_subscription', None)):
+        monkeypatch.setattr(main, name, value)
+    return fetches
+
+
+def subscribed_players(fake_ha):
+    return [message['entity_ids'] for message in fake_ha.messages if message['type'] == 'subscribe_entities']
+
+
+def test_loading_does_not_wait_for_subscriptions(main, fake_ha, catalogue):
+    fake_ha.delay = 2
+    started = time.monotonic()
+    players = main.get_media_player_catalogue()
+
+    assert time.monotonic() - started < 1
+    assert sorted(players) == ['media_player.kitchen', 'media_player.office']
+    assert players['media_player.kitchen']['name'] == 'Kitchen'
+    wait_until(lambda: subscribed_players(fake_ha) == [['media_player.kitchen', 'media_player.office']])
+
+
+def test_attribute_changes_keep_the_catalogue_fresh(main, fake_ha, ha_client, catalogue):
+    main.get_media_player_catalogue()
+    wait_until(lambda: ha_client.is_subscribed(main.media_players_subscription))
+
+    fake_ha.send_event({'c': {'media_player.kitchen': {'+': {'a': {'volume_level': 0.5, 'media_title': 'Episode'}},
+                                                       '-': {'a': ['friendly_name']}}}})
+    wait_until(lambda: main.MEDIA_PLAYERS['media_player.kitchen']['attributes'].get('volume_level') == 0.5)
+    kitchen = main.get_media_player_catalogue()['media_player.kitchen']
+    assert kitchen['state'] == 'idle'
+    assert kitchen['attributes'] == {'volume_level': 0.5, 'media_title': 'Episode'}
+    assert kitchen['name'] == 'kitchen'
+
+    fake_ha.send_event({'c': {'media_player.office': {'+': {'s': 'playing'}}}, 'r': ['media_player.kitchen']})
+    wait_until(lambda: 'media_player.kitchen' not in main.MEDIA_PLAYERS)
+    assert main.get_media_player_catalogue()['media_player.office']['state'] == 'playing'
+    assert len(catalogue) == 1  # events, not reloads
+
+
+def test_catalogue_is_reloaded_sooner_without_events(main, fake_ha, ha_client, catalogue, monkeypatch):
+    main.get_media_player_catalogue()
+    wait_until(lambda: ha_client.is_subscribed(main.media_players_subscription))
+    monkeypatch.setattr(main, 'media_players_loaded_at', time.monotonic() - main.MEDIA_PLAYERS_TTL_WITHOUT_EVENTS - 1)
+    main.get_media_player_catalogue()
+    assert len(catalogue) == 1
+
+    fake_ha.fail_subscriptions = True
+    fake_ha.drop()
+    wait_until(lambda: [message['type'] for message in fake_ha.messages].count('subscribe_entities') == 2)
+    wait_until(ha_client.is_connected)
+    main.get_media_player_catalogue()
+    assert len(catalogue) == 2
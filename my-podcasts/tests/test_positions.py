@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def listener(main):
+    """A user subscribed to a feed with three episodes, two of them with stored positions"""
+    def add(conn):
+        feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES ('paused/feed', 'http://paused/feed')").lastrowid
+        user_id = conn.execute("INSERT INTO Users (username, display_name) VALUES ('paused', 'Paused')").lastrowid
+        conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, feed_id)
+                        VALUES ('paused', 'http://paused/feed', datetime('now'), ?, ?)""", (user_id, feed_id))
+        episode_ids = [conn.execute("""INSERT INTO Episodes (feed_id, guid, naslov, datum_izdaje, url)
+                                       VALUES (?, ?, ?, '2024-01-01 10:00:00', ?)""",
+                                    (feed_id, f"paused-{n}", f"paused {n}", f"http://paused/{n}.mp3")).lastrowid
+                       for n in range(3)]
+        conn.executemany("INSERT INTO EpisodePlaybackPosition (episode_id, user_id, position, timestamp) VALUES (?, ?, ?, ?)",
+                         [(episode_ids[0], user_id, 100, '2024-01-01 10:00:00'),
+                          (episode_ids[1], user_id, 200, '2024-01-02 10:00:00')])
+        return user_id, episode_ids
+
+    return main.run_write(add)
+
+
+def test_paused_episodes_include_pending_positions_without_writing(main, client, listener, monkeypatch):
+    user_id, (first, second, third) = listener
+    flushes = []
+    monkeypatch.setattr(main, 'flush_playback_positions', lambda: flushes.append(True))
+    monkeypatch.setattr(main, 'PENDING_POSITIONS', {
+        (first, user_id): (150, '2024-01-03 10:00:00'),
+        (second, user_id): (0, '2024-01-04 10:00:00'),  # played from the start again
+        (third, user_id): (300, '2024-01-05 10:00:00'),
+        (third, -1): (400, '2024-01-06 10:00:00'),  # another user
+    })
+
+    paused = client.get('/api/episodes/paused', headers={'X-Remote-User-Name': 'paused'}).get_json()
+
+    assert [(episode['episode_id'], episode['position']) for episode in paused] == [(third, 300), (first, 150)]
+    assert paused[1]['playback_time_formatted'] == '2:30'
+    assert not flushes
+    with main.get_db_connection() as conn:
+        stored = dict(conn.execute("SELECT episode_id, position FROM EpisodePlaybackPosition WHERE user_id = ?", (user_id,)))
+    assert stored == {first: 100, second: 200}
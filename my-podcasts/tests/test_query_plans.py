@@ -0,0 +1,140 @@
+import random
+import re
+import sqlite3
+
+import pytest
+
+# Tables that grow with the number of episodes and listeners
+LARGE_TABLES = {'Episodes', 'Feeds', 'EpisodeListenStatus', 'ListenedCounts'}
+
+FEEDS = 20
+EPISODES_PER_FEED = 300
+
+
+@pytest.fixture(scope='module')
+def seeded(main):
+    """
+    Three users subscribed to 20 feeds of 300 episodes, with listens, positions and deletes.
+    Returns the ids used in HOT_REQUESTS.
+    """
+    random.seed(1)
+
+    def seed(conn):
+        users = {name: conn.execute("INSERT INTO Users (username, display_name, is_admin) VALUES (?, ?, ?)",
+                                    (name, name.title(), is_admin)).lastrowid
+                 for name, is_admin in (('admin', 1), ('ana', 0), ('bor', 0))}
+        feed_ids = []
+        for n in range(FEEDS):
+            rss_url = f"http://h{n % 4}/f{n}"
+            feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url, image_url) VALUES (?, ?, 'img')",
+                                   (main.normalize_feed_url(rss_url), rss_url)).lastrowid
+            feed_ids.append(feed_id)
+            for name in ('admin', 'ana') if n % 3 else ('admin', 'ana', 'bor'):
+                conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, is_public, feed_id)
+                                VALUES (?, ?, datetime('now'), ?, ?, ?)""",
+                             (f"p{n}", rss_url, users[name], n % 2, feed_id))
+            conn.executemany("""INSERT INTO Episodes (feed_id, guid, naslov, datum_izdaje, url, opis)
+                                VALUES (?, ?, ?, ?, ?, 'opis')""",
+                             [(feed_id, f"g{n}-{k}", f"ep {k}", f"2024-{1 + k % 12:02d}-{1 + k % 28:02d} 10:{k % 60:02d}:00",
+                               f"{rss_url}/{k}.mp3") for k in range(EPISODES_PER_FEED)])
+        episode_ids = [row[0] for row in conn.execute(
+            f"SELECT id FROM Episodes WHERE feed_id IN ({','.join('?' for _ in feed_ids)})", feed_ids)]
+        for user_id in users.values():
+            conn.executemany("INSERT OR IGNORE INTO EpisodeListenStatus (episode_id, user_id, poslušano) VALUES (?, ?, 1)",
+                             [(e, user_id) for e in random.sample(episode_ids, len(episode_ids) // 3)])
+            conn.executemany("""INSERT OR IGNORE INTO EpisodePlaybackPosition (episode_id, user_id, position, timestamp)
+                                VALUES (?, ?, ?, datetime('now', ?))""",
+                             [(e, user_id, random.choice([0, 30, 600]), f"-{random.randint(1, 10000)} minutes")
+                              for e in random.sample(episode_ids, len(episode_ids) // 5)])
+        conn.execute("""INSERT INTO DeletedEpisodes (podcast_id, episode_id)
+                        SELECT p.id, e.id FROM Podcasts p JOIN Episodes e ON e.feed_id = p.feed_id
+                        WHERE p.user_id = ? AND e.id % 10 = 0""", (users['ana'],))
+        main.rebuild_unread_counts(conn)
+        main.rebuild_latest_episodes(conn)
+
+        podcast_id = conn.execute("SELECT id FROM Podcasts WHERE user_id = ? AND feed_id = ?",
+                                  (users['ana'], feed_ids[0])).fetchone()[0]
+        episode_id = conn.execute("SELECT MIN(id) FROM Episodes WHERE feed_id = ? AND id % 10 != 0",
+                                  (feed_ids[0],)).fetchone()[0]
+        return {'admin': users['admin'], 'ana': users['ana'], 'podcast': podcast_id, 'episode': episode_id}
+
+    ids = main.run_write(seed)
+    main.USER_CACHE.clear()
+    return ids
+
+
+@pytest.fixture
+def statements(main, monkeypatch):
+    """Statements run through pooled connections while the test runs"""
+    recorded = []
+    execute = sqlite3.Connection.execute
+
+    def recording_execute(conn, sql, parameters=()):
+        recorded.append((sql, parameters))
+        return execute(conn, sql, parameters)
+
+    monkeypatch.setattr(main.PooledConnection, 'execute', recording_execute)
+    return recorded
+
+
+def plan_problems(main, sql, parameters):
+    """Full scans of a large table, and sorts in a temp B-tree of more than single rows of one"""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+        return []
+    tables = {}
+    for table, alias in main.TABLE_ALIAS_PATTERN.findall(sql):
+        tables[table] = table
+        if alias:
+            tables[alias] = table
+    with main.get_db_connection() as conn:
+        plan = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+
+        problems = []
+        # A temp B-tree sorts the rows of the (sub)query it belongs to, that is of its siblings in the plan
+        sorted_queries = set()
+        for _, parent, _, detail in plan:
+            match = re.match(r'(SCAN|SEARCH) (\w+)', detail)
+            table = tables.get(match.group(2)) if match else None
+            if table not in LARGE_TABLES:
+                continue
+            if match.group(1) == 'SCAN' or 'AUTOMATIC' in detail:
+                problems.append(detail)
+            if not main.is_single_row_lookup(conn, table, detail):
+                sorted_queries.add(parent)
+    problems.extend(detail for _, parent, _, detail in plan
+                    if 'USE TEMP B-TREE' in detail and parent in sorted_queries)
+    return problems
+
+
+ADMIN = {'X-Remote-User-Name': 'admin'}
+ANA = {'X-Remote-User-Name': 'ana'}
+
+HOT_REQUESTS = [
+    ('get', '/api/podcasts', ADMIN, None),
+    ('get', '/api/podcasts', ANA, None),
+    ('get', '/api/episodes/{podcast}', ANA, None),
+    ('get', '/api/latest_episodes?limit=10', ANA, None),
+    ('get', '/api/latest_episodes?limit=10&as_user={ana}', ADMIN, None),
+    ('get', '/api/users/{ana}/latest_episodes', ADMIN, None),
+    ('get', '/api/users/{ana}/podcasts', ANA, None),
+    ('get', '/api/users/{admin}/podcasts', ANA, None),
+    ('get', '/api/episodes/paused', ANA, None),
+    ('get', '/api/episodes/{episode}/position', ANA, None),
+    ('post', '/api/episodes/{episode}/position', ANA, {'position': 42}),
+    ('post', '/api/episodes/mark_listened/{episode}', ANA, {}),
+    ('post', '/api/episodes/{episode}/delete', ANA, None),
+]
+
+
+@pytest.mark.parametrize('method, url, headers, body', HOT_REQUESTS)
+def test_hot_queries_use_indexes(main, client, seeded, statements, method, url, headers, body):
+    response = getattr(client, method)(url.format(**seeded), headers=headers, json=body)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    problems = {}
+    for sql, parameters in statements:
+        found = plan_problems(main, sql, parameters)
+        if found:
+            problems[' '.join(sql.split())] = found
+    assert statements
+    assert not problems
@@ -0,0 +1,141 @@
+import email.utils
+import http.server
+import threading
+import time
+
+import pytest
+
+FEEDS_PER_HOST = 6
+EPISODES_PER_FEED = 5
+
+
+def feed_xml(path):
+    items = ''.join(f"""
+        <item><title>{path} {n}</title><guid>{path}-{n}</guid>
+        <pubDate>{email.utils.formatdate(time.time() - n * 86400)}</pubDate>
+        <enclosure url="http://example.com{path}/{n}.mp3" type="audio/mpeg" length="1"/></item>"""
+                    for n in range(EPISODES_PER_FEED))
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>{path}</title><description>Test</description>{items}</channel></rss>"""
+
+
+@pytest.fixture
+def feed_server():
+    """Slow feed server that records how many requests each host name, and all of them ('*'), have in progress"""
+    in_progress = {}
+    most_in_progress = {}
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            hosts = (self.headers['Host'].split(':')[0], '*')
+            with lock:
+                for host in hosts:
+                    in_progress[host] = in_progress.get(host, 0) + 1
+                    most_in_progress[host] = max(most_in_progress.get(host, 0), in_progress[host])
+            try:
+                time.sleep(0.2)
+                body = feed_xml(self.path).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with lock:
+                    for host in hosts:
+                        in_progress[host] -= 1
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1], most_in_progress
+    server.shutdown()
+    server.server_close()
+
+
+def add_feeds(main, port):
+    """Subscribes a user to feeds on two host names of the local server"""
+    def add(conn):
+        user_id = conn.execute("INSERT INTO Users (username, display_name) VALUES ('refresh', 'Refresh')").lastrowid
+        feed_ids = []
+        for host in ('127.0.0.1', 'localhost'):
+            for n in range(FEEDS_PER_HOST):
+                rss_url = f"http://{host}:{port}/feed{n}"
+                feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES (?, ?)",
+                                       (main.normalize_feed_url(rss_url), rss_url)).lastrowid
+                conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, feed_id)
+                                VALUES (?, ?, datetime('now'), ?, ?)""", (rss_url, rss_url, user_id, feed_id))
+                feed_ids.append(feed_id)
+        return feed_ids
+
+    feed_ids = main.run_write(add)
+    with main.get_db_connection() as conn:
+        return main.get_subscribed_feeds(conn, feed_ids)
+
+
+def test_interleave_by_host(main):
+    feeds = [{'id': n, 'rss_url': url} for n, url in enumerate(
+        ['http://a/1', 'http://a/2', 'http://a/3', 'http://B/1', 'http://b/2', 'http://c/1'])]
+    assert [feed['id'] for feed in main.interleave_by_host(feeds)] == [0, 3, 5, 1, 4, 2]
+
+
+def test_parallel_refresh_respects_per_host_limit(main, feed_server, monkeypatch):
+    port, most_in_progress = feed_server
+    monkeypatch.setattr(main, 'REFRESH_PER_HOST', 2)
+    monkeypatch.setattr(main, 'HOST_SEMAPHORES', {})
+    feeds = add_feeds(main, port)
+
+    report = main.refresh_feeds(feeds, max_workers=8)
+
+    assert report['updated'] == len(feeds) and report['failed'] == 0
+    assert report['episodes_added'] == len(feeds) * EPISODES_PER_FEED
+    # Both hosts were downloaded from at the same time, each with two downloads at most
+    assert most_in_progress == {'127.0.0.1': 2, 'localhost': 2, '*': 4}
+
+    with main.get_db_connection() as conn:
+        stored = conn.execute(f"SELECT COUNT(*) FROM Episodes WHERE feed_id IN ({','.join('?' for _ in feeds)})",
+                              [feed['id'] for feed in feeds]).fetchone()[0]
+    assert stored == len(feeds) * EPISODES_PER_FEED
+
+
+def test_failed_schedule_write_leaves_queue_unchanged(main, monkeypatch):
+    def add(conn):
+        user_id = conn.execute("INSERT INTO Users (username, display_name) VALUES ('schedule', 'Schedule')").lastrowid
+        feed_ids = []
+        for n in range(2):
+            rss_url = f"http://schedule/feed{n}"
+            feed_id = conn.execute("INSERT INTO Feeds (feed_key, rss_url) VALUES (?, ?)",
+                                   (main.normalize_feed_url(rss_url), rss_url)).lastrowid
+            conn.execute("""INSERT INTO Podcasts (naslov, rss_url, datum_naročnine, user_id, feed_id)
+                            VALUES (?, ?, datetime('now'), ?, ?)""", (rss_url, rss_url, user_id, feed_id))
+            feed_ids.append(feed_id)
+        return feed_ids
+
+    feed_ids = main.run_write(add)
+    monkeypatch.setattr(main, 'refresh_feeds', lambda feeds: {'failed_ids': set()})
+    scheduled = []
+
+    def calculate_next_refresh(feed_id, interval, settings):
+        # The second feed fails after the first one was stored, rolling both back
+        if scheduled:
+            raise RuntimeError("schedule write failed")
+        scheduled.append(feed_id)
+        return int(time.time()) + 2 * main.FAILED_REFRESH_RETRY
+
+    monkeypatch.setattr(main, 'calculate_next_refresh', calculate_next_refresh)
+    with pytest.raises(RuntimeError):
+        main.run_due_refreshes([(feed_id, main.REFRESH_PRIORITY_NOW) for feed_id in feed_ids])
+
+    with main.get_db_connection() as conn:
+        stored = conn.execute(f"SELECT next_refresh_at FROM Feeds WHERE id IN ({','.join('?' for _ in feed_ids)})",
+                              feed_ids).fetchall()
+    assert [row[0] for row in stored] == [None, None]
+    # Both feeds are retried, none is queued for the schedule that was rolled back
+    with main.refresh_queue_condition:
+        queued = {feed_id: main.REFRESH_DUE[feed_id] for feed_id in feed_ids}
+    for due, priority in queued.values():
+        assert due <= time.time() + main.FAILED_REFRESH_RETRY and priority == main.REFRESH_PRIORITY_SCHEDULED
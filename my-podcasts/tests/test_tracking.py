@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import jinja2.sandbox
+
+import pytest
+
+from conftest import TOKEN, wait_until
+
+
+@pytest.fixture
+def tracked_player(main, ha_client, monkeypatch):
+    """A tracking session on media_player.test, followed through the fake Home Assistant"""
+    monkeypatch.setattr(main, 'HA_WEBSOCKET', ha_client)
+    monkeypatch.setattr(main, 'TRACKING_MODE', 'events')
+    monkeypatch.setattr(main, 'tracking_subscription', None)
+    monkeypatch.setattr(main, 'tracking_players', [])
+    wakeups = []
+    monkeypatch.setattr(main, 'wake_tracking', lambda: wakeups.append(True))
+    monkeypatch.setitem(main.TRACKING_SESSIONS, -1, {
+        'id': -1, 'episode_id': -1, 'player_entity_id': 'media_player.test', 'episode_url': 'http://test/1.mp3',
+        'user_id': -1, 'started_at': '2024-01-01T10:00:00', 'last_position': -1, 'same_position_count': 0,
+    })
+    main.update_tracking_subscription()
+    yield wakeups
+    main.TRACKING_SESSIONS.pop(-1, None)
+    main.update_tracking_subscription()
+    wait_until(lambda: main.tracking_players == [])
+
+
+def test_events_are_active_once_subscribed(main, ha_client, tracked_player):
+    wait_until(main.tracking_events_active)
+    assert ha_client.is_subscribed(main.tracking_subscription)
+
+
+def test_poller_takes_over_when_renewing_fails(main, fake_ha, ha_client, tracked_player):
+    wait_until(main.tracking_events_active)
+    fake_ha.fail_subscriptions = True
+    fake_ha.drop()
+    wait_until(lambda: [message['type'] for message in fake_ha.messages].count('subscribe_trigger') == 2)
+    wait_until(ha_client.is_connected)
+
+    assert len(tracked_player) >= 2  # connection lost, then renewing failed
+    assert not main.tracking_events_active()
+
+    # The next connection renews the subscription and events take over again
+    fake_ha.fail_subscriptions = False
+    fake_ha.drop()
+    wait_until(main.tracking_events_active)
+
+
+def test_session_changes_do_not_wait_for_home_assistant(main, fake_ha, ha_client, tracked_player, monkeypatch):
+    wait_until(main.tracking_events_active)
+    fake_ha.delay = 1
+    monkeypatch.setitem(main.TRACKING_SESSIONS, -2, dict(main.TRACKING_SESSIONS[-1], id=-2, player_entity_id='media_player.other'))
+    started = time.monotonic()
+    main.update_tracking_subscription()
+    assert time.monotonic() - started < 0.5
+    wait_until(lambda: main.tracking_players == ['media_player.other', 'media_player.test'])
+
+    started = time.monotonic()
+    main.end_tracking_session(-2)
+    assert time.monotonic() - started < 0.5
+    wait_until(lambda: main.tracking_players == ['media_player.test'])
+    assert ha_client.is_subscribed(main.tracking_subscription)
+    fake_ha.delay = 0
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+
+class FakeState:
+    def __init__(self, entity_id, state, attributes):
+        self.entity_id = entity_id
+        self.state = state
+        self.attributes = attributes
+
+
+def render_template(template, variables):
+    """Renders like Home Assistant: states.<domain> lists the states of a domain, to_json serializes dates"""
+    environment = jinja2.sandbox.ImmutableSandboxedEnvironment()
+    environment.filters['to_json'] = lambda value: json.dumps(value, default=datetime.isoformat)
+    players = [
+        FakeState('media_player.a', 'playing', {'media_position': 10, 'media_position_updated_at': datetime(2024, 1, 1)}),
+        FakeState('media_player.b', 'paused', {}),
+        FakeState('media_player.untracked', 'playing', {}),
+    ]
+    return environment.from_string(template).render(states=SimpleNamespace(media_player=players), **variables)
+
+
+def test_player_states_are_read_with_one_request(main, monkeypatch):
+    requests = []
+
+    def post(url, headers=None, timeout=None, json=None):
+        requests.append(url)
+        return FakeResponse(200, render_template(json['template'], json['variables']))
+
+    monkeypatch.setenv('SUPERVISOR_TOKEN', TOKEN)
+    monkeypatch.setattr(main.HA_SESSION, 'post', post)
+    states = main.fetch_player_states(['media_player.a', 'media_player.b', 'media_player.gone'])
+
+    assert requests == ["http://supervisor/core/api/template"]
+    assert sorted(states) == ['media_player.a', 'media_player.b']
+    assert states['media_player.a']['attributes']['media_position_updated_at'] == '2024-01-01T00:00:00'
+    assert main.get_media_position(states['media_player.a'], '2024-01-01T00:00:05') == 15
+
+
+def test_waiting_for_wakeup_keeps_the_event_loop_running(main, monkeypatch):
+    async def wait_while_ticking():
+        monkeypatch.setattr(main, 'tracking_event_loop', asyncio.get_running_loop())
+        monkeypatch.setattr(main, 'tracking_wakeup', asyncio.Event())
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        threading.Timer(0.3, main.wake_tracking).start()
+        started = time.monotonic()
+        await main.wait_for_tracking_wakeup(5)
+        ticker.cancel()
+        return ticks, time.monotonic() - started
+
+    ticks, waited = asyncio.run(wait_while_ticking())
+    assert ticks >= 10
+    assert waited < 2
+    assert not main.tracking_wakeup.is_set()